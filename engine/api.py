@@ -1,15 +1,24 @@
-from typing import Annotated
+import unicodedata
+from typing import Annotated, Literal
 from uuid import uuid4
 from dataclasses import dataclass, field
 from rich import print
 
-from fastapi import FastAPI, Header, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Header, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import Field
 
-from pipelines import CompletePipeline, StatusEventHandler
 from config import EnabledModels
-from config.redis import redis_client
+from config.redis import Status
+from exceptions.notion import MalformedDatabaseException
+from jobs import Job, JobQueue, JobRegistry, JobState, RedisCheckpoint
+from jobs.events import valid_event_id
+from jobs.queue import MAX_PRIORITY
+from metrics import QueueCollector, build_registry, render
 from models import ModelConfig
+from pipelines import select_leaves
+from tasks import NotionWiki, WritingMethod
+from tasks.usage import usage_ledger
 
 __version__ = "0.0.2"
 
@@ -22,6 +31,15 @@ def on_startup():
     print(f"Running version [bold green]{__version__}[/bold green]")
 
 
+queue = JobQueue()
+registry = JobRegistry()
+metrics_registry = build_registry(QueueCollector(queue, registry))
+
+
+# The writing methods a request can pick, by name, e.g. "double_agent"
+WritingMethodName = Literal[tuple(method.name.lower() for method in WritingMethod)]
+
+
 @dataclass
 class GenerateBody:
     title: str
@@ -29,6 +47,48 @@ class GenerateBody:
     headings: str = field(default=EnabledModels.HEADINGS)
     icons: str = field(default=EnabledModels.ICONS)
     categories: str = field(default=EnabledModels.CATEGORIES)
+    writing_method: WritingMethodName = "single"
+
+
+@dataclass
+class BatchTitle:
+    title: str
+    priority: Annotated[
+        int, Field(ge=-MAX_PRIORITY, le=MAX_PRIORITY)
+    ] = 0  # Higher priorities are generated first
+
+
+@dataclass
+class GenerateBatchBody:
+    titles: Annotated[list[BatchTitle | str], Field(min_length=1, max_length=1000)]
+    writing: str = field(default=EnabledModels.WRITING)
+    headings: str = field(default=EnabledModels.HEADINGS)
+    icons: str = field(default=EnabledModels.ICONS)
+    categories: str = field(default=EnabledModels.CATEGORIES)
+    writing_method: WritingMethodName = "single"
+
+
+@dataclass
+class RegenerateBody:
+    headings: Annotated[list[str], Field(min_length=1)]  # Heading indices, e.g. '2' or '3.1'
+    writing: str = field(default=EnabledModels.WRITING)
+    writing_method: WritingMethodName = "single"
+
+
+# The settings of a job kept in the registry, so it can be resumed without keeping its secrets
+MODEL_FIELDS = ("writing", "headings", "icons", "categories", "writing_method")
+
+
+def job_fields(page_url: str, model_config: ModelConfig) -> dict[str, str]:
+    return {
+        "page_url": page_url,
+        **{name: getattr(model_config, name) for name in MODEL_FIELDS},
+    }
+
+
+def normalise_title(title: str) -> str:
+    """The form of a title used to spot duplicates, ignoring case, spacing and unicode variants."""
+    return " ".join(unicodedata.normalize("NFKC", title).casefold().split())
 
 
 @app.post("/generate")
@@ -37,38 +97,307 @@ def generate_page(
     notion_secret: Annotated[str, Header()],
     oai_key: Annotated[str, Header()],
     body: GenerateBody,
-    background_tasks: BackgroundTasks,
 ):
     task_id = uuid4().hex
-    
-    pipeline = CompletePipeline(
-        page_url,
-        notion_secret=notion_secret,
-        model_config=ModelConfig(
-            oai_key=oai_key,
-            writing=body.writing,
-            headings=body.headings,
-            icons=body.icons,
-            categories=body.categories,
-        ),
-        event_handler=StatusEventHandler(task_id), # Allow for decoupled Redis status updating
+    model_config = ModelConfig(
+        oai_key=oai_key,
+        writing=body.writing,
+        headings=body.headings,
+        icons=body.icons,
+        categories=body.categories,
+        writing_method=body.writing_method,
+    )
+
+    registry.register(task_id, body.title, **job_fields(page_url, model_config))
+
+    # * The job is picked up by a worker (see worker.py), which reports its progress to Redis
+    queue.enqueue(
+        Job(
+            task_id=task_id,
+            title=body.title,
+            page_url=page_url,
+            notion_secret=notion_secret,
+            model_config=model_config,
+        )
     )
 
-    background_tasks.add_task(pipeline.run, body.title)
-    
     return {"message": f"'{body.title}' added to generation queue", "id": task_id}
 
 
+@app.post("/generate/batch")
+def generate_batch(
+    page_url: Annotated[str, Header()],
+    notion_secret: Annotated[str, Header()],
+    oai_key: Annotated[str, Header()],
+    body: GenerateBatchBody,
+):
+    # * Keep the first spelling of each title, with the highest priority it was given
+    unique: dict[str, BatchTitle] = {}
+    duplicates: list[str] = []
+    for entry in body.titles:
+        entry = BatchTitle(title=entry) if isinstance(entry, str) else entry
+        key = normalise_title(entry.title)
+
+        if not key:
+            continue
+        if key not in unique:
+            unique[key] = BatchTitle(title=entry.title.strip(), priority=entry.priority)
+        else:
+            unique[key].priority = max(unique[key].priority, entry.priority)
+            duplicates.append(entry.title)
+
+    if not unique:
+        return JSONResponse(status_code=400, content={"message": "No titles given"})
+
+    # * Every page in the batch goes to the same database, so its categories are only read once
+    notion = NotionWiki(notion_secret)
+    try:
+        categories = [
+            cat["name"] for cat in notion.get_categories(notion.split_url(page_url))
+        ]
+    except MalformedDatabaseException as ex:
+        return JSONResponse(status_code=400, content={"message": str(ex)})
+
+    model_config = ModelConfig(
+        oai_key=oai_key,
+        writing=body.writing,
+        headings=body.headings,
+        icons=body.icons,
+        categories=body.categories,
+        writing_method=body.writing_method,
+    )
+    batch_id = uuid4().hex
+    jobs = [
+        (
+            Job(
+                task_id=uuid4().hex,
+                title=entry.title,
+                page_url=page_url,
+                notion_secret=notion_secret,
+                model_config=model_config,
+                categories=categories,
+            ),
+            entry.priority,
+        )
+        for entry in unique.values()
+    ]
+
+    registry.register_batch(
+        batch_id,
+        {job.task_id: job.title for job, _ in jobs},
+        **job_fields(page_url, model_config),
+    )
+    queue.enqueue_many(jobs)
+
+    task_ids = {key: job.task_id for key, (job, _) in zip(unique, jobs)}
+
+    return {
+        "message": f"{len(jobs)} pages added to generation queue",
+        "id": batch_id,
+        "jobs": [
+            {"title": job.title, "id": job.task_id, "priority": priority}
+            for job, priority in jobs
+        ],
+        # * Each duplicate title maps to the job generating it
+        "duplicates": {title: task_ids[normalise_title(title)] for title in duplicates},
+    }
+
+
+@app.post("/resume/{id}")
+def resume(
+    id: str,
+    notion_secret: Annotated[str, Header()],
+    oai_key: Annotated[str, Header()],
+):
+    job = registry.get(id)
+
+    if job is None:
+        return JSONResponse(status_code=404, content={"message": "Process not found"})
+    if job["state"] != JobState.FAILED.value:
+        return JSONResponse(
+            status_code=409, content={"message": "Only failed generations can be resumed"}
+        )
+    if "page_url" not in job:
+        return JSONResponse(
+            status_code=409,
+            content={"message": "Generation was queued without the settings needed to resume it"},
+        )
+    if "regenerates" in job:
+        return JSONResponse(
+            status_code=409,
+            content={"message": "Regenerations can't be resumed, regenerate the headings again"},
+        )
+    if queue.leased(id):
+        # * The job is marked failed just before its worker lets go of it
+        return JSONResponse(
+            status_code=409,
+            content={"message": "Generation is still finishing, try again shortly"},
+        )
+
+    registry.update(id, Status.WAITING)
+
+    # * The worker carries on from the job's checkpoint, skipping every heading already written or published
+    queue.enqueue(
+        Job(
+            task_id=id,
+            title=job["title"],
+            page_url=job["page_url"],
+            notion_secret=notion_secret,
+            model_config=ModelConfig(
+                # * Jobs queued before a setting existed are resumed with its default
+                oai_key=oai_key, **{name: job[name] for name in MODEL_FIELDS if name in job}
+            ),
+        )
+    )
+
+    return {"message": f"'{job['title']}' added back to generation queue", "id": id}
+
+
+@app.post("/regenerate/{id}")
+def regenerate(
+    id: str,
+    notion_secret: Annotated[str, Header()],
+    oai_key: Annotated[str, Header()],
+    body: RegenerateBody,
+):
+    checkpoint = RedisCheckpoint(id)
+
+    if not checkpoint.exists():
+        return JSONResponse(status_code=404, content={"message": "Page not found"})
+    if not checkpoint.get("completed"):
+        return JSONResponse(
+            status_code=409, content={"message": "Only finished pages can be regenerated"}
+        )
+
+    try:
+        chosen = select_leaves(checkpoint.sections(), body.headings)
+    except KeyError as ex:
+        return JSONResponse(
+            status_code=400, content={"message": f"Unknown headings: {ex.args[0]}"}
+        )
+
+    task_id = uuid4().hex
+    title = checkpoint.get("title")
+    page_url = checkpoint.get("page_url")
+    # * Only the writing model is used, the outline and icons of the page are kept
+    model_config = ModelConfig(
+        oai_key=oai_key, writing=body.writing, writing_method=body.writing_method
+    )
+
+    registry.register(
+        task_id, title, **job_fields(page_url, model_config), regenerates=id
+    )
+
+    # * The page is regenerated from the checkpoint of the job that generated it
+    queue.enqueue(
+        Job(
+            task_id=task_id,
+            title=title,
+            page_url=page_url,
+            notion_secret=notion_secret,
+            model_config=model_config,
+            regenerate=body.headings,
+            source_id=id,
+        )
+    )
+
+    return {
+        "message": f"{len(chosen)} headings of '{title}' added to generation queue",
+        "id": task_id,
+    }
+
+
+@app.get("/generate/batch/{id}")
+def batch_status(id: str):
+    batch = registry.get_batch(id)
+
+    if batch is None:
+        return JSONResponse(status_code=404, content={"message": "Batch not found"})
+
+    return batch
+
+
 @app.get("/status/{id}")
 def status(id: str):
-    if not redis_client.exists(id):
+    job = registry.get(id)
+
+    if job is None:
         return JSONResponse(status_code=404, content={"message": "Process not found"})
-    
-    return JSONResponse(status_code=200, content={"message": redis_client.get(id)})
+
+    return JSONResponse(
+        status_code=200,
+        content={"message": job["status"], **job, "usage": usage_ledger.get(id)},
+    )
+
 
 @app.get("/status")
-def status_list():
-    keys = redis_client.keys(pattern="generation:*")
-    statuses = [redis_client.hget(key, "status") for key in keys]
-    return [{"id": key, "status": value} for key, value in zip(keys, statuses)]
+def status_list(
+    cursor: float | None = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    state: JobState | None = None,
+):
+    jobs, next_cursor = registry.list(cursor=cursor, limit=limit, state=state)
+    return {"jobs": jobs, "next_cursor": next_cursor}
+
+
+@app.get("/usage")
+def usage(limit: int = Query(default=10, ge=1, le=100)):
+    summary = usage_ledger.summary(limit)
+
+    # * Name the most expensive jobs, if they are still registered
+    for job in summary["jobs"]:
+        job["title"] = (registry.get(job["id"]) or {}).get("title")
+
+    return summary
+
+
+@app.get("/usage/{id}")
+def job_usage(id: str):
+    usage = usage_ledger.get(id, calls=True)
+
+    if usage is None:
+        return JSONResponse(status_code=404, content={"message": "No usage recorded"})
+
+    return usage
+
+
+def event_stream(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def invalid_event_id() -> JSONResponse:
+    return JSONResponse(
+        status_code=400,
+        content={"message": "Last-Event-ID must be the ID of an event, like '1700000000000-0'"},
+    )
+
+
+@app.get("/status/{id}/events")
+def status_events(
+    id: str, last_event_id: Annotated[str | None, Header()] = None
+):
+    if registry.get(id) is None:
+        return JSONResponse(status_code=404, content={"message": "Process not found"})
+    if last_event_id is not None and not valid_event_id(last_event_id):
+        return invalid_event_id()
+
+    return event_stream(registry.events.stream(id, last_event_id))
+
+
+@app.get("/events")
+def events(last_event_id: Annotated[str | None, Header()] = None):
+    if last_event_id is not None and not valid_event_id(last_event_id):
+        return invalid_event_id()
+
+    return event_stream(registry.events.stream(None, last_event_id))
+
 
+@app.get("/metrics")
+def metrics():
+    # * Jobs are generated by the workers, which serve their own metrics (see `Metrics.WORKER_PORT`)
+    content, content_type = render(metrics_registry)
+    return Response(content=content, media_type=content_type)
@@ -0,0 +1,196 @@
+"""
+Deterministic, in-memory stand-ins for the OpenAI and Notion APIs, so the engine can be benchmarked offline.
+
+`FakeChatCompletion` replaces `openai.ChatCompletion`, below langchain and the request scheduler, and answers each
+kind of prompt the engine sends. `FakeNotionClient` replaces the Notion client, below `NotionWiki`. Both count the
+requests they are sent.
+"""
+import json
+import random
+import asyncio
+import hashlib
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from unittest import mock
+from uuid import uuid4
+
+from notion_client import Client
+
+from config import Markdown, Prompts
+
+CATEGORY = "Benchmarks"
+
+
+def synthetic_outline(headings: int) -> str:
+    """
+    Build an outline of exactly `headings` headings, shaped like the heading prompt's responses: sections of a
+    heading, two subheadings and two nested headings under each.
+    """
+    lines = []
+    section = 0
+
+    while len(lines) < headings:
+        section += 1
+        lines.append(f"{section}: Section {section}")
+
+        for sub in range(1, 3):
+            lines.append(f"    {section}.{sub}: Part {section}.{sub}")
+            for nested in range(1, 3):
+                lines.append(f"        {section}.{sub}.{nested}: Detail {section}.{sub}.{nested}")
+
+    return "Here is the breakdown:\n" + "\n".join(lines[:headings])
+
+
+def synthetic_content(seed: str, paragraphs: int = 4) -> str:
+    """Build a markdown article, the same for the same seed, using most of the syntax the writers produce."""
+    rng = random.Random(seed)
+    words = ["engine", "wiki", "notion", "history", "design", "theory", "method", "**bold**", "*italic*", "`code`"]
+
+    def sentence() -> str:
+        return " ".join(rng.choice(words) for _ in range(rng.randint(8, 20))).capitalize() + "."
+
+    parts = [f"## {seed}"]
+    for i in range(paragraphs):
+        parts.append(" ".join(sentence() for _ in range(rng.randint(3, 6))))
+        if i == 1:
+            parts.append("\n".join(f"- {sentence()}" for _ in range(4)))
+        if i == 2:
+            parts.append("```python\nprint('hello')\n```")
+
+    return "\n\n".join(parts)
+
+
+class FakeChatCompletion:
+    """Answers chat completion requests the way the engine expects, after `latency` seconds."""
+
+    def __init__(self, headings: int, latency: float = 0) -> None:
+        self.outline = synthetic_outline(headings)
+        self.latency = latency
+        self.requests = Counter()
+        self._lock = threading.Lock()
+
+    def _answer(self, messages: list[dict]) -> tuple[str, str]:
+        system = next((m["content"] for m in messages if m["role"] == "system"), "")
+        prompt = messages[-1]["content"]
+
+        if system == Prompts.heading_prompt:
+            return "outline", self.outline
+        if system.startswith(Prompts.categoriser_prompt[:40]):
+            return "category", CATEGORY
+        if system == Prompts.icons_batch_prompt:
+            return "icons", json.dumps({title: "📘" for title in json.loads(prompt)})
+        if system == Prompts.icons_prompt:
+            return "icons", "📘"
+
+        return "writing", synthetic_content(hashlib.sha256(prompt.encode()).hexdigest()[:8])
+
+    def _record(self, kind: str):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def create(self, **kwargs):
+        kind, content = self._answer(kwargs["messages"])
+        self._record(kind)
+        time.sleep(self.latency)
+
+        if kwargs.get("stream"):
+            return iter(self._chunks(content))
+
+        return self._response(content)
+
+    async def acreate(self, **kwargs):
+        kind, content = self._answer(kwargs["messages"])
+        self._record(kind)
+        await asyncio.sleep(self.latency)
+
+        if kwargs.get("stream"):
+
+            async def stream():
+                for chunk in self._chunks(content):
+                    yield chunk
+
+            return stream()
+
+        return self._response(content)
+
+    def _chunks(self, content: str) -> list[dict]:
+        return [
+            {"choices": [{"delta": {"content": content[i : i + 16]}, "finish_reason": None}]}
+            for i in range(0, len(content), 16)
+        ] + [{"choices": [{"delta": {}, "finish_reason": "stop"}]}]
+
+    def _response(self, content: str) -> dict:
+        tokens = len(content) // 4
+        return {
+            "choices": [
+                {"message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+            ],
+            "usage": {"prompt_tokens": 0, "completion_tokens": tokens, "total_tokens": tokens},
+        }
+
+
+class FakeNotionClient(Client):
+    """A Notion client that keeps pages and blocks in memory, and counts requests by endpoint."""
+
+    def __init__(self) -> None:
+        super().__init__(auth="benchmark")
+        self.requests = Counter()
+        self.written = Counter()  # Blocks written, by parent
+        self._lock = threading.Lock()
+        self._schema = {
+            "properties": {
+                "Category": {"select": {"options": [{"name": CATEGORY, "color": "blue"}]}}
+            }
+        }
+
+    def _endpoint(self, method: str, path: str) -> str:
+        # * Strip the IDs, so requests to the same endpoint are counted together
+        resource = path.split("/")[0]
+        return f"{method} {resource}" + ("/children" if path.endswith("/children") else "")
+
+    def request(self, path: str, method: str, query=None, body=None, auth=None):
+        with self._lock:
+            self.requests[self._endpoint(method, path)] += 1
+
+            if path.startswith("databases/"):
+                if method == "PATCH":
+                    self._schema["properties"].update(body["properties"])
+                return {"id": path.split("/")[1], **self._schema}
+
+            if path.endswith("/children"):
+                self.written[path.split("/")[1]] += len(body["children"])
+                return {"results": [{"id": uuid4().hex, **child} for child in body["children"]]}
+
+            if path == "pages":
+                page_id = uuid4().hex
+                self.written[page_id] += len(body.get("children", []))
+                return {"id": page_id}
+
+            return {"id": path.split("/")[-1]}
+
+
+def native_markdown():
+    """Convert markdown natively, as martian needs node (and a bridge to it) that can't be benchmarked offline."""
+    return mock.patch.object(Markdown, "CONVERTER", "native")
+
+
+@contextmanager
+def offline(headings: int, latency: float = 0):
+    """
+    Run the engine against the fakes: every chat completion is answered by a `FakeChatCompletion` and every
+    Notion request by a `FakeNotionClient`.
+
+    Markdown is converted natively, see `native_markdown`.
+
+    Yields:
+      the fake chat completion and the fake Notion client.
+    """
+    chat = FakeChatCompletion(headings, latency)
+    notion = FakeNotionClient()
+
+    with mock.patch("openai.ChatCompletion.create", chat.create), mock.patch(
+        "openai.ChatCompletion.acreate", chat.acreate
+    ), mock.patch("tasks.notion.shared_client", lambda secret: notion), native_markdown():
+        yield chat, notion
@@ -0,0 +1,83 @@
+"""
+Report how long the engine's entry points take to import, to catch cold start regressions.
+
+Run from the engine directory:
+
+    python -m benchmarks.import_time [--top 15] [--budget-ms 1500] [api worker ...]
+
+Each module is imported in a fresh interpreter with `python -X importtime`. With `--budget-ms`, the report exits
+non-zero if any module takes longer than the budget to import.
+"""
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from rich import print
+from rich.table import Table
+
+DEFAULT_MODULES = ["api", "worker", "pipelines", "tasks.writing.single"]
+
+
+def import_times(module: str) -> tuple[float, dict[str, float]]:
+    """
+    Import a module in a fresh interpreter.
+
+    Returns:
+      the total import time in milliseconds, and the time spent importing the modules of every top-level package
+    it pulled in (not counting the packages they import in turn), in milliseconds.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONPATH": os.getcwd()},
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Could not import {module}:\n{result.stderr[-2000:]}")
+
+    packages = defaultdict(float)
+    total = 0
+
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        own, cumulative, name = (part.strip() for part in line[len("import time:") :].split("|"))
+
+        # * Self times add up to the total without counting nested imports twice
+        packages[name.split(".")[0]] += int(own) / 1000
+        if name == module:
+            total = int(cumulative) / 1000
+
+    return total, dict(packages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float)
+    args = parser.parse_args()
+
+    over_budget = []
+
+    for module in args.modules:
+        total, packages = import_times(module)
+
+        table = Table("Package", "Self (ms)", title=f"import {module}: {total:.0f} ms")
+        for package, own in sorted(packages.items(), key=lambda p: -p[1])[: args.top]:
+            table.add_row(package, f"{own:.1f}")
+        print(table)
+
+        if args.budget_ms is not None and total > args.budget_ms:
+            over_budget.append(module)
+
+    if over_budget:
+        print(f"[red]Over the {args.budget_ms:.0f} ms import budget: {', '.join(over_budget)}[/red]")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
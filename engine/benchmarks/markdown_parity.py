@@ -0,0 +1,118 @@
+"""
+Check the native markdown converter against martian, and time both.
+
+Each document in `benchmarks/markdown` has a golden file next to it (`<name>.json`), holding the blocks martian
+converts it to. The native converter must convert every document to exactly its golden blocks, or this exits
+non-zero. Run from the engine directory:
+
+    python -m benchmarks.markdown_parity [--iterations 200]
+
+Goldens are recorded from martian, which needs node and `@tryfabric/martian` (through the javascript bridge):
+
+    python -m benchmarks.markdown_parity --record
+"""
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+
+from dictdiffer import diff
+from rich import print
+from rich.table import Table
+
+from tasks.markdown import markdown_to_blocks
+
+CORPUS = Path(__file__).parent / "markdown"
+
+
+def timed(convert, markdown: str, iterations: int) -> float:
+    """Return the median time to convert a document, in microseconds."""
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        convert(markdown)
+        timings.append(time.perf_counter() - start)
+
+    return statistics.median(timings) * 1_000_000
+
+
+def load_martian():
+    try:
+        from tasks.notion import martian
+
+        converter = martian()
+    except Exception as ex:
+        print(f"[yellow]Martian is not available, only timing the native converter ({type(ex).__name__})[/yellow]")
+        return None
+
+    return lambda markdown: converter.markdownToBlocks(
+        markdown, {"nonInline": "ignore", "strictImageUrls": False}
+    ).valueOf()
+
+
+def golden_path(document: Path) -> Path:
+    return document.with_suffix(".json")
+
+
+def record(martian):
+    """Write the golden blocks of every document, as martian converts them."""
+    for path in sorted(CORPUS.glob("*.md")):
+        blocks = martian(path.read_text())
+        golden_path(path).write_text(json.dumps(blocks, indent=2, ensure_ascii=False) + "\n")
+        print(f"Recorded {len(blocks)} blocks for {path.name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--record", action="store_true", help="Record the goldens from martian, then exit")
+    args = parser.parse_args()
+
+    martian = load_martian()
+
+    if args.record:
+        if martian is None:
+            raise SystemExit("Goldens can only be recorded from martian, which is not available")
+        record(martian)
+        return
+
+    mismatches = 0
+    table = Table("Document", "Blocks", "Native (µs)", "Martian (µs)", "Parity")
+
+    for path in sorted(CORPUS.glob("*.md")):
+        markdown = path.read_text()
+        native = markdown_to_blocks(markdown)
+
+        if golden_path(path).exists():
+            differences = list(diff(json.loads(golden_path(path).read_text()), native))
+            parity = "[green]✓[/green]" if not differences else f"[red]{len(differences)} differences[/red]"
+        else:
+            # * A document without a golden isn't checked, which counts as a failure rather than a pass
+            differences = ["no golden, record one with --record"]
+            parity = "[red]no golden[/red]"
+
+        mismatches += bool(differences)
+        for difference in differences[:5]:
+            print(f"[grey]{path.name}: {difference}[/grey]")
+
+        martian_time = "-"
+        if martian is not None:
+            martian_time = f"{timed(martian, markdown, max(1, args.iterations // 10)):.0f}"
+
+        table.add_row(
+            path.name,
+            str(len(native)),
+            f"{timed(markdown_to_blocks, markdown, args.iterations):.0f}",
+            martian_time,
+            parity,
+        )
+
+    print(table)
+
+    if mismatches:
+        raise SystemExit(f"{mismatches} documents differ from martian")
+
+
+if __name__ == "__main__":
+    main()
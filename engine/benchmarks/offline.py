@@ -0,0 +1,195 @@
+"""
+Time the engine's components, and full pipeline runs, offline against fake OpenAI and Notion APIs (see `fakes.py`),
+on synthetic outlines of different sizes.
+
+Run from the engine directory:
+
+    python -m benchmarks.offline [--sizes 10 50 100 500] [--iterations 20] [--save FILE] [--compare FILE]
+
+`--save` writes the results as JSON, to be compared against by a later run with `--compare`. Timings are only
+comparable on the same machine, request counts are comparable anywhere.
+"""
+import os
+
+# * Keep every limiter and cache in this process, so nothing needs Redis, and keep the limits out of the timings
+for name, value in {
+    "NOTION_RATE_LIMIT_BACKEND": "local",
+    "OPENAI_LIMIT_BACKEND": "local",
+    "OPENAI_RPM": "1e9",
+    "OPENAI_TPM": "1e12",
+    "OPENAI_INITIAL_CONCURRENCY": "64",
+    "OPENAI_MAX_CONCURRENCY": "64",
+    "LLM_CACHE_BACKEND": "none",
+}.items():
+    os.environ.setdefault(name, value)
+
+import argparse
+import contextlib
+import io
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from rich import print
+from rich.table import Table
+
+from config import Concurrency
+from models import Section, ModelConfig
+from pipelines import CompletePipeline, EventHandler, init_writer_pool
+from tasks import NotionWiki
+from tasks.notion import invalidate_schema
+from .fakes import native_markdown, offline, synthetic_outline, synthetic_content
+
+DEFAULT_SIZES = [10, 50, 100, 500]
+PAGE_URL = "https://www.notion.so/benchmark?v=1"
+
+
+def timed(function, iterations: int) -> float:
+    """Return the median time of a call, in microseconds."""
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    return statistics.median(timings) * 1_000_000
+
+
+def written_sections(outline: str) -> list[Section]:
+    sections = Section.from_string(outline)
+    for section in sections:
+        for node in section.tree:
+            node.data.content = synthetic_content(node.data.title)
+
+    return sections
+
+
+def bench_components(headings: int, iterations: int) -> dict[str, float]:
+    """Time each component on an outline of `headings` headings, in microseconds per page."""
+    outline = synthetic_outline(headings)
+    sections = Section.from_string(outline)
+    written = written_sections(outline)
+    contents = [node.data.content for section in written for node in section.tree]
+    wiki = NotionWiki.__new__(NotionWiki)  # * Only converts markdown, so needs no client
+
+    handler = EventHandler()
+    handler.register("sectionWritten", lambda **kwargs: None)
+
+    background = EventHandler(background=True, coalesce={"sectionWritten"})
+    background.register("sectionWritten", lambda **kwargs: None)
+
+    def fire(handler: EventHandler):
+        for i in range(headings):
+            handler.fire("sectionWritten", section=None, index=i, sections=sections)
+        handler.flush()
+
+    def convert():
+        with native_markdown():
+            return [wiki.md_to_blocks(content) for content in contents]
+
+    results = {
+        "Section.from_string": timed(lambda: Section.from_string(outline), iterations),
+        "Section.format": timed(lambda: [s.format() for s in sections], iterations),
+        "Section.dump": timed(lambda: [s.dump() for s in written], iterations),
+        "NotionWiki.md_to_blocks": timed(convert, max(1, iterations // 5)),
+        "EventHandler.fire": timed(lambda: fire(handler), iterations),
+        "EventHandler.fire (background)": timed(lambda: fire(background), iterations),
+    }
+    background.close()
+
+    return results
+
+
+def bench_pipeline(headings: int, latency: float) -> dict:
+    """Run the complete pipeline once against the fakes, returning its time and the requests of each stage."""
+    invalidate_schema()
+
+    with offline(headings, latency) as (chat, notion):
+        pipeline = CompletePipeline(
+            PAGE_URL,
+            notion_secret="benchmark",
+            model_config=ModelConfig(oai_key="benchmark"),
+            event_handler=EventHandler(),
+        )
+
+        # * The pipeline prints a line per heading
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            pipeline.run("Benchmark")
+            seconds = time.perf_counter() - start
+
+    return {
+        "seconds": seconds,
+        "llm": dict(sorted(chat.requests.items())),
+        "notion": dict(sorted(notion.requests.items())),
+        "blocks": sum(notion.written.values()),
+    }
+
+
+def change(current: float, baseline: float | None) -> str:
+    if not baseline:
+        return "-"
+
+    ratio = current / baseline
+    colour = "red" if ratio > 1.1 else "green" if ratio < 0.9 else "white"
+    return f"[{colour}]{ratio:.2f}x[/{colour}]"
+
+
+def report(results: dict, baseline: dict | None):
+    baseline = baseline or {}
+
+    table = Table("Component", "Headings", "Median (µs)", "vs baseline")
+    for size, components in results["components"].items():
+        for name, micros in components.items():
+            before = baseline.get("components", {}).get(size, {}).get(name)
+            table.add_row(name, size, f"{micros:.0f}", change(micros, before))
+    print(table)
+
+    table = Table("Headings", "Seconds", "vs baseline", "LLM requests", "Notion requests", "Blocks")
+    for size, run in results["pipeline"].items():
+        before = baseline.get("pipeline", {}).get(size, {})
+        requests_changed = before and (before["llm"], before["notion"]) != (run["llm"], run["notion"])
+
+        table.add_row(
+            size,
+            f"{run['seconds']:.2f}",
+            change(run["seconds"], before.get("seconds")),
+            "\n".join(f"{kind}: {count}" for kind, count in run["llm"].items()),
+            "\n".join(f"{endpoint}: {count}" for endpoint, count in run["notion"].items()),
+            str(run["blocks"]) + (" [yellow](requests changed)[/yellow]" if requests_changed else ""),
+        )
+    print(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0, help="Seconds each fake LLM request takes")
+    parser.add_argument("--save", type=Path, help="Write the results to this file")
+    parser.add_argument("--compare", type=Path, help="Compare against the results in this file")
+    args = parser.parse_args()
+
+    # * Write headings on threads, so the fakes are shared with the writers
+    init_writer_pool(executor=ThreadPoolExecutor(Concurrency.WRITER_POOL_SIZE))
+
+    # * The first run pays for importing the writing method and langchain's agents, so isn't timed
+    bench_pipeline(min(args.sizes), args.latency)
+
+    # * JSON keys are strings, so sizes are too
+    results = {
+        "components": {str(size): bench_components(size, args.iterations) for size in args.sizes},
+        "pipeline": {str(size): bench_pipeline(size, args.latency) for size in args.sizes},
+    }
+
+    report(results, json.loads(args.compare.read_text()) if args.compare else None)
+
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2, ensure_ascii=False) + "\n")
+        print(f"[bold grey]Saved results to {args.save}[/bold grey]")
+
+
+if __name__ == "__main__":
+    main()
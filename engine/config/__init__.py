@@ -1,2 +1,17 @@
-from .models import GPT35, GPT4, AutoGen, EnabledModels, Prompts
+from .models import GPT35, GPT4, EnabledModels, Prompts
+from .settings import (
+    Concurrency,
+    WritingLimits,
+    Queue,
+    NotionLimits,
+    NotionSchema,
+    OpenAILimits,
+    Clients,
+    LLMCache,
+    SearchCache,
+    LLMUsage,
+    Markdown,
+    Checkpoints,
+    Metrics,
+)
 from .redis import redis_client
@@ -1,11 +1,21 @@
+import os
 from enum import Enum
 
 from redis import StrictRedis
+from redis import asyncio as aioredis
 from redis.connection import BlockingConnectionPool
 
-pool = BlockingConnectionPool(host="redis", port=6379, decode_responses=True)
+REDIS_HOST = os.environ.get("REDIS_HOST", "redis")
+REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
+
+pool = BlockingConnectionPool(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
 redis_client = StrictRedis(connection_pool=pool)
 
+# For the API's streaming endpoints, which hold a connection open per subscriber
+async_redis_client = aioredis.StrictRedis(
+    host=REDIS_HOST, port=REDIS_PORT, decode_responses=True
+)
+
 class Status(Enum):
     WAITING = "Waiting"
     PAGE_SETUP = "Setting up page"
@@ -13,6 +23,3 @@ class Status(Enum):
     GENERATING_CONTENT = "Generating content"
     COMPLETE = "Completed"
     FAILED = "Failed"
-
-def update_status(page_id: str, status: Status):
-    redis_client.hset(f"generation:{page_id}", "status", status.value if isinstance(status, Status) else status)
\ No newline at end of file
@@ -0,0 +1,248 @@
+import os
+
+from .models import GPT35, GPT4
+
+
+class Concurrency:
+    """Limits on how much work the engine does at once.
+
+    Attributes:
+        WRITER_POOL_SIZE: The number of writer processes shared by every job in this process.
+        JOB_CONCURRENCY: The number of headings a single job may be writing at any one time.
+    """
+
+    WRITER_POOL_SIZE = int(os.environ.get("WRITER_POOL_SIZE", 10))
+    JOB_CONCURRENCY = int(os.environ.get("WRITER_JOB_CONCURRENCY", 5))
+
+
+class Queue:
+    """Settings for the Redis job queue shared by the API and the workers.
+
+    Attributes:
+        VISIBILITY_TIMEOUT: Seconds a claimed job stays invisible before it is re-delivered, unless its worker heartbeats.
+        MAX_ATTEMPTS: The number of deliveries before a job is moved to the dead letter list.
+        POLL_INTERVAL: Seconds an idle worker waits before looking for a new job.
+        WORKER_JOBS: The number of jobs a single worker process runs at once.
+        DATA_TTL: Seconds a job's data (which holds its secrets) is kept for, at most. Deleted as soon as it is done.
+        ERROR_BACKOFF_MAX: The most seconds a worker waits before trying again, after failing to reach Redis.
+    """
+
+    VISIBILITY_TIMEOUT = int(os.environ.get("QUEUE_VISIBILITY_TIMEOUT", 300))
+    MAX_ATTEMPTS = int(os.environ.get("QUEUE_MAX_ATTEMPTS", 3))
+    POLL_INTERVAL = float(os.environ.get("QUEUE_POLL_INTERVAL", 1))
+    WORKER_JOBS = int(os.environ.get("WORKER_JOBS", 2))
+    DATA_TTL = int(os.environ.get("QUEUE_DATA_TTL", 7 * 24 * 60 * 60))
+    ERROR_BACKOFF_MAX = float(os.environ.get("QUEUE_ERROR_BACKOFF_MAX", 60))
+
+
+class NotionLimits:
+    """Settings for throttling requests to the Notion API.
+
+    Attributes:
+        RATE: Requests per second allowed for each integration secret.
+        BURST: The number of requests that may be sent at once before throttling starts.
+        BACKEND: "local" to share limits within a process, or "redis" to share them across every worker.
+        MAX_RETRIES: The number of times a rate limited or failed request is retried.
+        BACKOFF_BASE: Seconds to wait before the first retry, doubled on each further retry.
+        BACKOFF_MAX: The longest wait between two retries, in seconds.
+    """
+
+    RATE = float(os.environ.get("NOTION_RATE_LIMIT", 3))
+    BURST = float(os.environ.get("NOTION_RATE_BURST", 3))
+    BACKEND = os.environ.get("NOTION_RATE_LIMIT_BACKEND", "local")
+    MAX_RETRIES = int(os.environ.get("NOTION_MAX_RETRIES", 5))
+    BACKOFF_BASE = float(os.environ.get("NOTION_BACKOFF_BASE", 0.5))
+    BACKOFF_MAX = float(os.environ.get("NOTION_BACKOFF_MAX", 30))
+
+
+class OpenAILimits:
+    """Settings for scheduling requests to the OpenAI API, shared by every job using the same API key.
+
+    Attributes:
+        RPM: Requests per minute allowed for each API key.
+        TPM: Tokens per minute allowed for each API key, counting both the prompt and the response.
+        BACKEND: "redis" to share limits across every worker and writer process, or "local" to only share them
+        within a process.
+        EXPECTED_OUTPUT_TOKENS: The response length assumed when admitting a request that sets no `max_tokens`.
+        INITIAL_CONCURRENCY: The number of requests per key allowed in flight at once, before it is adapted.
+        MIN_CONCURRENCY: The lowest the concurrency of a key can be lowered to.
+        MAX_CONCURRENCY: The highest the concurrency of a key can be raised to.
+        DECREASE: The factor the concurrency of a key is multiplied by after a 429 or a slow response.
+        LATENCY_TARGET: Seconds a request may take per thousand tokens before it counts as slow.
+        SLOT_LEASE: Seconds after which the slot of a request that never finished (e.g. its process died) is
+        freed. Only used by the "redis" backend.
+        MAX_RETRIES: The number of times a request is attempted before its error is raised.
+    """
+
+    RPM = float(os.environ.get("OPENAI_RPM", 500))
+    TPM = float(os.environ.get("OPENAI_TPM", 40_000))
+    BACKEND = os.environ.get("OPENAI_LIMIT_BACKEND", "redis")
+    EXPECTED_OUTPUT_TOKENS = int(os.environ.get("OPENAI_EXPECTED_OUTPUT_TOKENS", 1000))
+    INITIAL_CONCURRENCY = float(os.environ.get("OPENAI_INITIAL_CONCURRENCY", 4))
+    MIN_CONCURRENCY = float(os.environ.get("OPENAI_MIN_CONCURRENCY", 1))
+    MAX_CONCURRENCY = float(os.environ.get("OPENAI_MAX_CONCURRENCY", 32))
+    DECREASE = float(os.environ.get("OPENAI_CONCURRENCY_DECREASE", 0.5))
+    LATENCY_TARGET = float(os.environ.get("OPENAI_LATENCY_TARGET", 60))
+    SLOT_LEASE = float(os.environ.get("OPENAI_SLOT_LEASE", 600))
+    MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", 6))
+
+
+class WritingLimits:
+    """Limits on the agent based writing methods (`DOUBLE_AGENT` and `PAE`), for every heading they write.
+
+    Attributes:
+        MAX_ROUNDS: The most drafts the researcher of `DOUBLE_AGENT` writes, each after a critique of the last.
+        MAX_STEPS: The most steps of a `PAE` plan carried out.
+        MAX_TOOL_CALLS: The most tool calls (e.g. searches) made while carrying out each step of a `PAE` plan.
+        MAX_TOKENS: The most tokens spent on a heading. Once spent, the latest draft (or step) is used.
+        MAX_SECONDS: The most seconds spent on a heading, after which the latest draft (or step) is used.
+        CONVERGENCE: How alike (from 0 to 1) two drafts, or two critiques, in a row must be for the drafts to count
+        as finished, and the critique to stop.
+    """
+
+    MAX_ROUNDS = int(os.environ.get("WRITING_MAX_ROUNDS", 3))
+    MAX_STEPS = int(os.environ.get("WRITING_MAX_STEPS", 5))
+    MAX_TOOL_CALLS = int(os.environ.get("WRITING_MAX_TOOL_CALLS", 5))
+    MAX_TOKENS = int(os.environ.get("WRITING_MAX_TOKENS", 30_000))
+    MAX_SECONDS = float(os.environ.get("WRITING_MAX_SECONDS", 300))
+    CONVERGENCE = float(os.environ.get("WRITING_CONVERGENCE", 0.95))
+
+
+class Clients:
+    """Settings for the long-lived API clients shared by every job in a process (see `tasks.clients`).
+
+    Attributes:
+        MAX_CLIENTS: The most clients of each kind kept at once, least recently used is dropped first.
+        IDLE_TIMEOUT: Seconds a client may go unused before it is closed. Longer than any request takes, so a
+        client is never closed under a request.
+        MAX_CONNECTIONS: The most connections each client opens to its API at once.
+        MAX_KEEPALIVE: The most idle connections each client keeps open for reuse.
+        KEEPALIVE_EXPIRY: Seconds an idle connection is kept open for.
+    """
+
+    MAX_CLIENTS = int(os.environ.get("CLIENTS_MAX_CLIENTS", 64))
+    IDLE_TIMEOUT = float(os.environ.get("CLIENTS_IDLE_TIMEOUT", 300))
+    MAX_CONNECTIONS = int(os.environ.get("CLIENTS_MAX_CONNECTIONS", 20))
+    MAX_KEEPALIVE = int(os.environ.get("CLIENTS_MAX_KEEPALIVE", 10))
+    KEEPALIVE_EXPIRY = float(os.environ.get("CLIENTS_KEEPALIVE_EXPIRY", 30))
+
+
+class NotionSchema:
+    """Settings for caching Notion database schemas.
+
+    Attributes:
+        TTL: Seconds a database's schema (e.g. its category options) is reused before it is read again.
+        LOCK_TIMEOUT: Seconds a worker may hold the lock for adding a category to a database, before it is
+        released for others.
+        LOCK_WAIT: The longest a worker waits for that lock, in seconds.
+    """
+
+    TTL = float(os.environ.get("NOTION_SCHEMA_TTL", 300))
+    LOCK_TIMEOUT = float(os.environ.get("NOTION_CATEGORY_LOCK_TIMEOUT", 30))
+    LOCK_WAIT = float(os.environ.get("NOTION_CATEGORY_LOCK_WAIT", 60))
+
+
+class LLMCache:
+    """Settings for caching responses to `generate.prompt`.
+
+    Attributes:
+        BACKEND: "memory", "disk", "redis", or "none" to turn caching off.
+        MAX_BYTES: The most response text kept by the memory and disk backends, least recently used is evicted first.
+        DIRECTORY: Where the disk backend keeps its cache.
+        DEFAULT_TTL: Seconds a response is kept for, when its prompt type has no TTL of its own.
+        TTLS: Seconds a response is kept for, by prompt type.
+    """
+
+    BACKEND = os.environ.get("LLM_CACHE_BACKEND", "memory")
+    MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    DIRECTORY = os.environ.get("LLM_CACHE_DIRECTORY", "/tmp/wikiwizard-llm-cache")
+    DEFAULT_TTL = int(os.environ.get("LLM_CACHE_TTL", 24 * 60 * 60))
+    TTLS = {
+        "categories": 60 * 60,  # The categories of a database change as pages are added
+        "icons": 7 * 24 * 60 * 60,
+        "headings": 24 * 60 * 60,
+    }
+
+
+class SearchCache:
+    """Settings for caching the web searches made by the writers.
+
+    Attributes:
+        BACKEND: "memory", "disk" or "redis" to keep results for every job, or "none" to only keep them per job.
+        TTL: Seconds a result is kept for every job.
+        JOB_TTL: Seconds a result is kept for the job that searched for it, in Redis, so every heading of a page
+        is written from the same results. 0 to not keep results per job.
+        DEDUPE: "redis" to make a single search for a query sent by several processes at once, or "local" to only
+        do so within a process.
+        LOCK_TIMEOUT: Seconds a search may take before other processes stop waiting for its result.
+        PREFETCH: Whether to search for the likely queries of every heading as soon as it is outlined, before it
+        is written.
+        PREFETCH_WORKERS: The number of prefetching searches made at once by each process.
+    """
+
+    BACKEND = os.environ.get("SEARCH_CACHE_BACKEND", "redis")
+    TTL = int(os.environ.get("SEARCH_CACHE_TTL", 6 * 60 * 60))
+    JOB_TTL = int(os.environ.get("SEARCH_CACHE_JOB_TTL", 24 * 60 * 60))
+    DEDUPE = os.environ.get("SEARCH_DEDUPE", "redis")
+    LOCK_TIMEOUT = float(os.environ.get("SEARCH_LOCK_TIMEOUT", 30))
+    PREFETCH = os.environ.get("SEARCH_PREFETCH", "false").lower() == "true"
+    PREFETCH_WORKERS = int(os.environ.get("SEARCH_PREFETCH_WORKERS", 2))
+
+
+class LLMUsage:
+    """Settings for the ledger of LLM calls kept for every job.
+
+    Attributes:
+        TTL: Seconds the usage of a job is kept for, as long as the job itself is kept.
+        MAX_CALLS: The number of a job's most recent calls kept individually, on top of its totals.
+        MAX_JOBS: The number of most expensive jobs listed by `/usage`.
+        PRICES: US dollars per thousand prompt and completion tokens, by model. Calls to other models are
+        recorded at no cost.
+    """
+
+    TTL = int(os.environ.get("LLM_USAGE_TTL", 3 * 24 * 60 * 60))
+    MAX_CALLS = int(os.environ.get("LLM_USAGE_MAX_CALLS", 1000))
+    MAX_JOBS = int(os.environ.get("LLM_USAGE_MAX_JOBS", 1000))
+    PRICES = {
+        GPT35: (0.001, 0.002),
+        GPT4: (0.01, 0.03),
+        "gpt-4": (0.03, 0.06),
+    }
+
+
+class Checkpoints:
+    """Settings for the checkpoints of page generations.
+
+    Attributes:
+        TTL: Seconds a page's checkpoint (its outline, the content of each heading and where each was published) is
+        kept after it was last written. A failed generation can be resumed, and the headings of a finished page
+        regenerated, for as long as it is kept.
+    """
+
+    TTL = int(os.environ.get("CHECKPOINT_TTL", 30 * 24 * 60 * 60))
+
+
+class Markdown:
+    """Settings for converting markdown into Notion blocks.
+
+    Attributes:
+        CONVERTER: "native" to convert in-process, or "martian" to use the martian JS package over the javascript bridge.
+        Martian stays the default until the native converter matches it on every golden of
+        `benchmarks.markdown_parity`.
+    """
+
+    CONVERTER = os.environ.get("MARKDOWN_CONVERTER", "martian")
+
+
+class Metrics:
+    """Settings for exposing Prometheus metrics.
+
+    The API serves its metrics on `/metrics`. A worker serves the metrics of its jobs on a port of its own, as they
+    are recorded in the worker's process. When `PROMETHEUS_MULTIPROC_DIR` is set (to an empty directory, before the
+    worker starts), the metrics of its writer processes are collected there and served along with the worker's.
+
+    Attributes:
+        WORKER_PORT: The port a worker serves its metrics on, or 0 to not serve them.
+    """
+
+    WORKER_PORT = int(os.environ.get("METRICS_WORKER_PORT", 9100))
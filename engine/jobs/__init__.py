@@ -0,0 +1,4 @@
+from .queue import Job, JobQueue
+from .registry import JobRegistry, JobState
+from .events import JobEvents
+from .checkpoint import Checkpoint, RedisCheckpoint
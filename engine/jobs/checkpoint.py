@@ -0,0 +1,170 @@
+import json
+import threading
+
+from redis import StrictRedis
+
+from config import Checkpoints
+from config.redis import redis_client
+from models import Heading, Section
+
+
+class Checkpoint:
+    """The progress of a page's generation, kept so a failed generation can carry on where it stopped, and so
+    the headings of a finished page can be regenerated.
+
+    Holds the page's fields (e.g. its category and page ID), each section of its outline as it is generated, the
+    content of each heading as it is written, which headings are already published to the page, the subpage
+    each leaf heading was published as, and the error blocks written in place of headings that failed. This one is kept in memory, so only lasts as long as the pipeline.
+    """
+
+    def __init__(self) -> None:
+        self._fields = {}
+        self._sections = []
+        self._contents = {}
+        self._published = set()
+        self._subpages = {}
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def get(self, field: str) -> str | None:
+        return self._fields.get(field)
+
+    def update(self, **fields: str):
+        self._fields.update(fields)
+
+    def add_section(self, section: Section):
+        """Record the next section of the outline."""
+        self._sections.append(section.format())
+
+    def sections(self) -> list[Section]:
+        """Rebuild the sections of the outline recorded so far, in order."""
+        return [Section.from_string(section)[0] for section in self._sections]
+
+    def save_content(self, heading: Heading):
+        with self._lock:
+            self._contents[heading.index] = heading.content
+
+    def contents(self) -> dict[str, str]:
+        """The content of every heading written so far, by heading index."""
+        return dict(self._contents)
+
+    def mark_published(self, *indices: str):
+        with self._lock:
+            self._published.update(indices)
+
+    def published(self) -> set[str]:
+        """The index of every heading already on the page."""
+        return set(self._published)
+
+    def add_subpage(self, heading: Heading, page_id: str):
+        with self._lock:
+            self._subpages[heading.index] = page_id
+
+    def subpages(self) -> dict[str, str]:
+        """The ID of the subpage each leaf heading was published as, by heading index."""
+        return dict(self._subpages)
+
+    def add_failure(self, heading: Heading, block_ids: list[str]):
+        with self._lock:
+            self._failures[heading.index] = list(block_ids)
+
+    def remove_failure(self, heading: Heading):
+        with self._lock:
+            self._failures.pop(heading.index, None)
+
+    def failures(self) -> dict[str, list[str]]:
+        """The IDs of the error blocks written in place of each heading that failed, by heading index."""
+        return dict(self._failures)
+
+    def exists(self) -> bool:
+        return bool(self._fields)
+
+    def touch(self):
+        """Keep the whole checkpoint for as long as its most recent write, see `RedisCheckpoint`."""
+
+    def clear(self):
+        self.__init__()
+
+
+class RedisCheckpoint(Checkpoint):
+    """A checkpoint kept in Redis, so a job can be resumed (or its page regenerated) by any worker.
+
+    Kept at `checkpoint:{id}` (the page's fields), `checkpoint:{id}:sections`, `checkpoint:{id}:contents`,
+    `checkpoint:{id}:subpages` and `checkpoint:{id}:failures` (by heading index) and `checkpoint:{id}:published`,
+    for `Checkpoints.TTL` seconds after each part was last written.
+    """
+
+    def __init__(self, task_id: str, client: StrictRedis = redis_client) -> None:
+        self._client = client
+        self._key = f"checkpoint:{task_id}"
+
+    def _keys(self) -> list[str]:
+        parts = ("sections", "contents", "published", "subpages", "failures")
+        return [self._key, *(f"{self._key}:{part}" for part in parts)]
+
+    def _write(self, command: str, key: str, *args):
+        with self._client.pipeline(transaction=False) as pipe:
+            getattr(pipe, command)(key, *args)
+            pipe.expire(key, Checkpoints.TTL)
+            pipe.execute()
+
+    def get(self, field: str) -> str | None:
+        return self._client.hget(self._key, field)
+
+    def update(self, **fields: str):
+        with self._client.pipeline(transaction=False) as pipe:
+            pipe.hset(self._key, mapping=fields)
+            pipe.expire(self._key, Checkpoints.TTL)
+            pipe.execute()
+
+    def add_section(self, section: Section):
+        self._write("rpush", f"{self._key}:sections", section.format())
+
+    def sections(self) -> list[Section]:
+        return [
+            Section.from_string(section)[0]
+            for section in self._client.lrange(f"{self._key}:sections", 0, -1)
+        ]
+
+    def save_content(self, heading: Heading):
+        self._write("hset", f"{self._key}:contents", heading.index, heading.content)
+
+    def contents(self) -> dict[str, str]:
+        return self._client.hgetall(f"{self._key}:contents")
+
+    def mark_published(self, *indices: str):
+        if indices:
+            self._write("sadd", f"{self._key}:published", *indices)
+
+    def published(self) -> set[str]:
+        return self._client.smembers(f"{self._key}:published")
+
+    def add_subpage(self, heading: Heading, page_id: str):
+        self._write("hset", f"{self._key}:subpages", heading.index, page_id)
+
+    def subpages(self) -> dict[str, str]:
+        return self._client.hgetall(f"{self._key}:subpages")
+
+    def add_failure(self, heading: Heading, block_ids: list[str]):
+        self._write("hset", f"{self._key}:failures", heading.index, json.dumps(block_ids))
+
+    def remove_failure(self, heading: Heading):
+        self._client.hdel(f"{self._key}:failures", heading.index)
+
+    def failures(self) -> dict[str, list[str]]:
+        return {
+            index: json.loads(block_ids)
+            for index, block_ids in self._client.hgetall(f"{self._key}:failures").items()
+        }
+
+    def exists(self) -> bool:
+        return bool(self._client.exists(self._key))
+
+    def touch(self):
+        with self._client.pipeline(transaction=False) as pipe:
+            for key in self._keys():
+                pipe.expire(key, Checkpoints.TTL)
+            pipe.execute()
+
+    def clear(self):
+        self._client.delete(*self._keys())
@@ -0,0 +1,135 @@
+import json
+import re
+from typing import AsyncIterator
+
+from redis import StrictRedis
+
+from config.redis import redis_client, async_redis_client
+
+# How many events are kept for replaying to reconnecting clients
+JOB_STREAM_LENGTH = 500
+GLOBAL_STREAM_LENGTH = 10_000
+
+# Seconds between keep-alive comments on an idle event stream
+KEEPALIVE_INTERVAL = 15
+
+# * Appends the event to the replay streams and publishes it, tagged with its stream ID, in one round trip
+PUBLISH_SCRIPT = """
+local job_id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[2], '*', 'data', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+local global_id = redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], '*', 'data', ARGV[1])
+
+redis.call('PUBLISH', KEYS[3], job_id .. ' ' .. ARGV[1])
+redis.call('PUBLISH', KEYS[4], global_id .. ' ' .. ARGV[1])
+return job_id
+"""
+
+
+def valid_event_id(event_id: str) -> bool:
+    """Whether an event ID (e.g. a client's `Last-Event-ID`) is a Redis stream ID, like `1700000000000-0`."""
+    return re.fullmatch(r"\d+(-\d+)?", event_id) is not None
+
+
+def _stream_id(event_id: str) -> tuple[int, int]:
+    milliseconds, _, sequence = event_id.partition("-")
+    return int(milliseconds), int(sequence or 0)
+
+
+def format_event(event_id: str, data: str) -> str:
+    """Format an event as a Server-Sent Event."""
+    return f"id: {event_id}\nevent: status\ndata: {data}\n\n"
+
+
+class JobEvents:
+    """Publishes job status events, and streams them to subscribers.
+
+    Every event is published on a per-job channel and a global channel, and appended to matching capped Redis
+    streams, so a subscriber that reconnects with the ID of the last event it saw can be sent what it missed.
+    """
+
+    def __init__(self, client: StrictRedis = redis_client) -> None:
+        self._client = client
+        self._publish = client.register_script(PUBLISH_SCRIPT)
+
+    def _keys(self, task_id: str | None) -> tuple[str, str]:
+        """The replay stream and channel of a job, or the global ones if `task_id` is None."""
+        if task_id is None:
+            return "generation:events", "generation:events"
+
+        return f"generation:{task_id}:events", f"generation:{task_id}:events"
+
+    def publish(self, task_id: str, event: dict, ttl: int, client: StrictRedis | None = None):
+        """
+        The function `publish` sends a status event for a job to its subscribers, and to subscribers of
+        every job.
+
+        Args:
+          task_id (str): The ID of the job.
+          event (dict): The event, which must be JSON serialisable.
+          ttl (int): Seconds to keep the job's replay stream for.
+          client (StrictRedis | None): The client (or pipeline) to send the event through.
+        """
+        job_stream, job_channel = self._keys(task_id)
+        global_stream, global_channel = self._keys(None)
+
+        self._publish(
+            keys=[job_stream, global_stream, job_channel, global_channel],
+            args=[
+                json.dumps({"id": task_id, **event}),
+                JOB_STREAM_LENGTH,
+                GLOBAL_STREAM_LENGTH,
+                ttl,
+            ],
+            client=client,
+        )
+
+    async def stream(
+        self, task_id: str | None = None, last_event_id: str | None = None
+    ) -> AsyncIterator[str]:
+        """
+        The function `stream` yields the status events of a job (or of every job) as Server-Sent Events,
+        until the subscriber disconnects.
+
+        Args:
+          task_id (str | None): The job to stream the events of, or None to stream every job.
+          last_event_id (str | None): The ID of the last event the subscriber saw. Missed events are replayed
+        first. If None, the full history of a job is replayed, while the global stream only sends new events.
+
+        Yields:
+          Server-Sent Event strings, and keep-alive comments while there are no events.
+        """
+        stream_key, channel = self._keys(task_id)
+        pubsub = async_redis_client.pubsub()
+
+        # * Subscribe before replaying, so no event can fall between the two
+        await pubsub.subscribe(channel)
+
+        try:
+            last = _stream_id(last_event_id) if last_event_id else (0, 0)
+
+            if last_event_id or task_id is not None:
+                for event_id, fields in await async_redis_client.xrange(
+                    stream_key, f"({last_event_id}" if last_event_id else "-", "+"
+                ):
+                    last = _stream_id(event_id)
+                    yield format_event(event_id, fields["data"])
+
+            while True:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=KEEPALIVE_INTERVAL
+                )
+                if message is None:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                event_id, _, data = message["data"].partition(" ")
+
+                # * Skip events that were already sent while replaying
+                if _stream_id(event_id) <= last:
+                    continue
+
+                last = _stream_id(event_id)
+                yield format_event(event_id, data)
+        finally:
+            await pubsub.unsubscribe(channel)
+            await pubsub.aclose()
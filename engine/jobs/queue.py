@@ -0,0 +1,237 @@
+import json
+from dataclasses import dataclass, field, asdict
+
+from redis import StrictRedis
+
+from config import Queue
+from config.redis import redis_client
+from models import ModelConfig
+
+# Jobs are claimed in order of priority, then of when they were queued. Each priority step outweighs this many
+# enqueues, while keeping scores exact as floats for priorities within `MAX_PRIORITY`
+PRIORITY_STEP = 10**12
+MAX_PRIORITY = 1000
+
+# * Every script reads the clock from Redis, so workers on different nodes agree on lease deadlines
+CLAIM_SCRIPT = """
+local popped = redis.call('ZPOPMIN', KEYS[1])
+if #popped == 0 then
+    return nil
+end
+
+local now = redis.call('TIME')
+local deadline = tonumber(now[1]) + tonumber(ARGV[1])
+
+redis.call('ZADD', KEYS[2], deadline, popped[1])
+redis.call('HSET', KEYS[3], popped[1], popped[2])
+local attempts = redis.call('HINCRBY', KEYS[4], popped[1], 1)
+
+return {popped[1], redis.call('GET', ARGV[2] .. popped[1]), attempts}
+"""
+
+EXTEND_SCRIPT = """
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    return 0
+end
+
+local now = redis.call('TIME')
+redis.call('ZADD', KEYS[1], tonumber(now[1]) + tonumber(ARGV[2]), ARGV[1])
+return 1
+"""
+
+ACK_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+
+-- Queued again (e.g. resumed) before this delivery was acknowledged, the new delivery needs its data
+if redis.call('ZSCORE', KEYS[2], ARGV[1]) then
+    return 0
+end
+
+redis.call('DEL', ARGV[2] .. ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+redis.call('HDEL', KEYS[4], ARGV[1])
+return 1
+"""
+
+REAP_SCRIPT = """
+local now = redis.call('TIME')
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now[1])
+
+for _, id in ipairs(expired) do
+    redis.call('ZREM', KEYS[1], id)
+    local attempts = tonumber(redis.call('HGET', KEYS[3], id) or '0')
+
+    if attempts >= tonumber(ARGV[1]) then
+        redis.call('RPUSH', KEYS[4], id)
+        -- Only the ID is dead lettered, the job's data holds its secrets
+        redis.call('DEL', ARGV[2] .. id)
+        redis.call('HDEL', KEYS[2], id)
+    else
+        redis.call('ZADD', KEYS[5], redis.call('HGET', KEYS[2], id), id)
+    end
+end
+
+return #expired
+"""
+
+
+@dataclass
+class Job:
+    task_id: str
+    title: str
+    page_url: str
+    notion_secret: str
+    model_config: ModelConfig
+    categories: list[str] | None = field(
+        default=None
+    )  # The database's categories, when they were read once for a whole batch
+    regenerate: list[str] | None = field(
+        default=None
+    )  # The indices of the headings to regenerate, when regenerating the page of another job
+    source_id: str | None = field(default=None)  # The job that generated the page being regenerated
+    attempts: int = field(default=0)
+
+    def to_json(self) -> str:
+        payload = asdict(self)
+        payload.pop("attempts")
+        return json.dumps(payload)
+
+    @classmethod
+    def from_json(cls, value: str, attempts: int = 0) -> "Job":
+        payload = json.loads(value)
+        payload["model_config"] = ModelConfig(**payload["model_config"])
+        return cls(**payload, attempts=attempts)
+
+
+class JobQueue:
+    """A durable job queue stored in Redis.
+
+    Claimed jobs are leased rather than removed: a worker must `extend` the lease while it runs the job and
+    `ack` it when it is done. A job whose lease runs out (e.g. the worker died) is put back on the queue by
+    `reap`, until it has been delivered `Queue.MAX_ATTEMPTS` times, after which it is moved to the dead list.
+
+    The data of each job (which holds its Notion secret and OpenAI key) is kept at `queue:{name}:job:{id}`, for
+    at most `Queue.DATA_TTL` seconds, and is deleted as soon as the job is acknowledged or dead lettered.
+    """
+
+    def __init__(
+        self,
+        name: str = "generation",
+        client: StrictRedis = redis_client,
+        visibility_timeout: int = Queue.VISIBILITY_TIMEOUT,
+        max_attempts: int = Queue.MAX_ATTEMPTS,
+    ) -> None:
+        self._client = client
+        self._visibility_timeout = visibility_timeout
+        self._max_attempts = max_attempts
+
+        self._pending = f"queue:{name}:pending"
+        self._leases = f"queue:{name}:leases"
+        self._scores = f"queue:{name}:scores"
+        self._attempts = f"queue:{name}:attempts"
+        self._data = f"queue:{name}:job:"  # Followed by the task ID
+        self._dead = f"queue:{name}:dead"
+        self._sequence = f"queue:{name}:sequence"
+
+        self._claim = client.register_script(CLAIM_SCRIPT)
+        self._extend = client.register_script(EXTEND_SCRIPT)
+        self._ack = client.register_script(ACK_SCRIPT)
+        self._reap = client.register_script(REAP_SCRIPT)
+
+    def _score(self, sequence: int, priority: int) -> int:
+        if abs(priority) > MAX_PRIORITY:
+            raise ValueError(f"Priority must be between -{MAX_PRIORITY} and {MAX_PRIORITY}")
+
+        return sequence - priority * PRIORITY_STEP
+
+    def enqueue(self, job: Job, priority: int = 0):
+        """Add a job to the queue, behind every job queued before it with the same or a higher priority."""
+        self.enqueue_many([(job, priority)])
+
+    def enqueue_many(self, jobs: list[tuple[Job, int]]):
+        """
+        The function `enqueue_many` adds several jobs to the queue in a single round trip, in the order they
+        are given within each priority.
+
+        Args:
+          jobs (list[tuple[Job, int]]): The jobs, each with its priority. Higher priorities are claimed first.
+        """
+        if not jobs:
+            return
+
+        # * Reserve a run of sequence numbers for the whole batch at once
+        last = self._client.incrby(self._sequence, len(jobs))
+        first = last - len(jobs) + 1
+
+        with self._client.pipeline() as pipe:
+            for job, _ in jobs:
+                pipe.set(self._data + job.task_id, job.to_json(), ex=Queue.DATA_TTL)
+            pipe.zadd(
+                self._pending,
+                {
+                    job.task_id: self._score(first + i, priority)
+                    for i, (job, priority) in enumerate(jobs)
+                },
+            )
+            pipe.execute()
+
+    def claim(self) -> Job | None:
+        """
+        The function `claim` takes the job at the front of the queue and leases it to the caller for
+        `visibility_timeout` seconds.
+
+        Returns:
+          the claimed job, or None if the queue is empty.
+        """
+        claimed = self._claim(
+            keys=[self._pending, self._leases, self._scores, self._attempts],
+            args=[self._visibility_timeout, self._data],
+        )
+        if not claimed:
+            return None
+
+        task_id, payload, attempts = claimed
+        if payload is None:
+            # * The job data is gone (e.g. it expired, or was deleted by hand), there is nothing to run
+            self.ack(task_id)
+            return None
+
+        return Job.from_json(payload, attempts=int(attempts))
+
+    def extend(self, task_id: str) -> bool:
+        """Push back the lease deadline of a claimed job. Returns False if the job is no longer leased."""
+        return bool(
+            self._extend(keys=[self._leases], args=[task_id, self._visibility_timeout])
+        )
+
+    def ack(self, task_id: str):
+        """Remove a finished job from the queue for good, unless it has been queued again since it was claimed."""
+        self._ack(
+            keys=[self._leases, self._pending, self._scores, self._attempts],
+            args=[task_id, self._data],
+        )
+
+    def leased(self, task_id: str) -> bool:
+        """Whether a job is claimed by a worker, which may still be finishing it."""
+        return self._client.zscore(self._leases, task_id) is not None
+
+    def reap(self) -> int:
+        """Re-queue every job whose lease has expired. Returns the number of expired leases."""
+        return self._reap(
+            keys=[self._leases, self._scores, self._attempts, self._dead, self._pending],
+            args=[self._max_attempts, self._data],
+        )
+
+    def depth(self) -> int:
+        """The number of jobs waiting to be claimed."""
+        return self._client.zcard(self._pending)
+
+    def sizes(self) -> dict[str, int]:
+        """The number of jobs waiting to be claimed, claimed by a worker, and moved to the dead letter list."""
+        with self._client.pipeline(transaction=False) as pipe:
+            pipe.zcard(self._pending)
+            pipe.zcard(self._leases)
+            pipe.llen(self._dead)
+            pending, leased, dead = pipe.execute()
+
+        return {"pending": pending, "leased": leased, "dead": dead}
@@ -0,0 +1,280 @@
+import time
+from enum import Enum
+from datetime import timedelta
+
+from redis import StrictRedis
+
+from config.redis import redis_client, Status
+from .events import JobEvents
+
+# Job hashes, and their entries in the indexes, are kept for this long after the job is created
+JOB_TTL = timedelta(days=3)
+
+
+class JobState(Enum):
+    WAITING = "waiting"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+    @classmethod
+    def from_status(cls, status: Status | str) -> "JobState":
+        return {
+            Status.WAITING: cls.WAITING,
+            Status.COMPLETE: cls.COMPLETED,
+            Status.FAILED: cls.FAILED,
+        }.get(status, cls.RUNNING)
+
+
+# * Moves a job between the state indexes, keeping the creation time it was registered with. Updates to a job
+# * that has expired only drop what is left of it from the indexes
+UPDATE_SCRIPT = """
+local created = redis.call('ZSCORE', KEYS[2], ARGV[1])
+if not created then
+    return 0
+end
+
+-- The job has expired, writing to its hash would recreate it without a TTL
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    for i = 2, #KEYS do
+        redis.call('ZREM', KEYS[i], ARGV[1])
+    end
+    return 0
+end
+
+redis.call('HSET', KEYS[1], 'status', ARGV[2], 'state', ARGV[3])
+for i = 4, #KEYS do
+    redis.call('ZREM', KEYS[i], ARGV[1])
+end
+redis.call('ZADD', KEYS[3], created, ARGV[1])
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+return 1
+"""
+
+
+class JobRegistry:
+    """An index of generation jobs.
+
+    Each job is a hash at `generation:{id}`, and is indexed by creation time in a sorted set of every job, and in a
+    sorted set per `JobState`, so jobs can be listed (and filtered) without scanning the keyspace. Jobs queued
+    together are also listed, in order, at `generation:batch:{id}`.
+    """
+
+    def __init__(self, client: StrictRedis = redis_client) -> None:
+        self._client = client
+        self._index = "generation:index"
+        self._update = client.register_script(UPDATE_SCRIPT)
+        self.events = JobEvents(client)
+
+    def _key(self, task_id: str) -> str:
+        return f"generation:{task_id}"
+
+    def _state_index(self, state: JobState) -> str:
+        return f"{self._index}:{state.value}"
+
+    def _batch_key(self, batch_id: str) -> str:
+        return f"generation:batch:{batch_id}"
+
+    def _register(self, pipe, task_id: str, title: str, created: float, **fields):
+        pipe.hset(
+            self._key(task_id),
+            mapping={
+                "title": title,
+                "status": Status.WAITING.value,
+                "state": JobState.WAITING.value,
+                "created_at": created,
+                **fields,
+            },
+        )
+        pipe.expire(self._key(task_id), JOB_TTL, nx=True)
+
+        for index in (self._index, self._state_index(JobState.WAITING)):
+            pipe.zadd(index, {task_id: created})
+            pipe.expire(index, JOB_TTL)
+
+        self.events.publish(
+            task_id,
+            {"title": title, "status": Status.WAITING.value, "state": JobState.WAITING.value},
+            int(JOB_TTL.total_seconds()),
+            client=pipe,
+        )
+
+    def register(self, task_id: str, title: str, **fields: str):
+        """
+        Add a new, waiting job to the registry, and publish its first status event. Any `fields` (e.g. the
+        settings it needs to be resumed) are kept with the job.
+        """
+        with self._client.pipeline() as pipe:
+            self._register(pipe, task_id, title, time.time(), **fields)
+            pipe.execute()
+
+    def register_batch(self, batch_id: str, jobs: dict[str, str], **fields: str):
+        """
+        The function `register_batch` adds every job of a batch to the registry, and records the batch so
+        its progress can be followed as a whole, in a single round trip.
+
+        Args:
+          batch_id (str): The ID of the batch.
+          jobs (dict[str, str]): The title of each job in the batch, by task ID, in the order they were queued.
+          **fields (str): Fields kept with every job in the batch, see `register`.
+        """
+        created = time.time()
+
+        with self._client.pipeline() as pipe:
+            # * Jobs are paged through by creation time, so no two may share one
+            for i, (task_id, title) in enumerate(jobs.items()):
+                self._register(
+                    pipe, task_id, title, created + i * 1e-6, batch=batch_id, **fields
+                )
+
+            pipe.rpush(self._batch_key(batch_id), *jobs)
+            pipe.expire(self._batch_key(batch_id), JOB_TTL)
+            pipe.execute()
+
+    def get_batch(self, batch_id: str) -> dict | None:
+        """
+        The function `get_batch` returns the aggregate progress of a batch, and the current fields of each of
+        its jobs.
+
+        Args:
+          batch_id (str): The ID of the batch.
+
+        Returns:
+          the number of jobs in each `JobState`, the fraction of jobs that have finished, and the jobs, or None
+        if there is no such batch.
+        """
+        task_ids = self._client.lrange(self._batch_key(batch_id), 0, -1)
+        if not task_ids:
+            return None
+
+        with self._client.pipeline(transaction=False) as pipe:
+            for task_id in task_ids:
+                pipe.hgetall(self._key(task_id))
+            hashes = pipe.execute()
+
+        jobs = [{"id": task_id, **job} for task_id, job in zip(task_ids, hashes) if job]
+        states = {state.value: 0 for state in JobState}
+        for job in jobs:
+            states[job["state"]] += 1
+
+        finished = states[JobState.COMPLETED.value] + states[JobState.FAILED.value]
+
+        return {
+            "id": batch_id,
+            "total": len(task_ids),
+            "states": states,
+            "progress": finished / len(task_ids),
+            "jobs": jobs,
+        }
+
+    def update(self, task_id: str, status: Status | str, client: StrictRedis | None = None):
+        """
+        The function `update` sets the status of a job, moving it to the index of its new state, and
+        publishes the change to subscribers of the job and of every job.
+
+        Args:
+          task_id (str): The ID of the job.
+          status (Status | str): The new status, either a `Status` or a free text progress message.
+          client (StrictRedis | None): The client (or pipeline) to send the update through. Defaults to the
+        registry's client.
+        """
+        state = JobState.from_status(status)
+        status = status.value if isinstance(status, Status) else status
+
+        self._update(
+            keys=[
+                self._key(task_id),
+                self._index,
+                self._state_index(state),
+                *[self._state_index(s) for s in JobState],
+            ],
+            args=[
+                task_id,
+                status,
+                state.value,
+                int(JOB_TTL.total_seconds()),
+            ],
+            client=client,
+        )
+        self.events.publish(
+            task_id,
+            {"status": status, "state": state.value},
+            int(JOB_TTL.total_seconds()),
+            client=client,
+        )
+
+    def get(self, task_id: str) -> dict | None:
+        """Return the fields of a job, or None if there is no such job."""
+        job = self._client.hgetall(self._key(task_id))
+        return {"id": task_id, **job} if job else None
+
+    def list(
+        self,
+        cursor: float | None = None,
+        limit: int = 50,
+        state: JobState | None = None,
+    ) -> tuple[list[dict], float | None]:
+        """
+        The function `list` returns a page of jobs, newest first, fetching their hashes in a single
+        pipelined round trip.
+
+        Args:
+          cursor (float | None): The `next_cursor` of the previous page, or None for the first page.
+          limit (int): The most jobs to return.
+          state (JobState | None): Only return jobs in this state.
+
+        Returns:
+          the jobs on this page, and the cursor of the next page (None if this is the last page).
+        """
+        index = self._state_index(state) if state else self._index
+        self._prune()
+
+        entries = self._client.zrevrangebyscore(
+            index,
+            f"({cursor}" if cursor is not None else "+inf",
+            "-inf",
+            start=0,
+            num=limit,
+            withscores=True,
+        )
+
+        with self._client.pipeline(transaction=False) as pipe:
+            for task_id, _ in entries:
+                pipe.hgetall(self._key(task_id))
+            hashes = pipe.execute()
+
+        jobs = [
+            {"id": task_id, **job}
+            for (task_id, _), job in zip(entries, hashes)
+            if job  # * The hash may have been deleted by hand
+        ]
+        next_cursor = entries[-1][1] if len(entries) == limit else None
+
+        return jobs, next_cursor
+
+    def count(self) -> dict[JobState, int]:
+        """Return the number of jobs in each `JobState`, in a single round trip."""
+        self._prune()
+
+        with self._client.pipeline(transaction=False) as pipe:
+            for state in JobState:
+                pipe.zcard(self._state_index(state))
+            counts = pipe.execute()
+
+        return dict(zip(JobState, counts))
+
+    def delete(self, task_id: str):
+        with self._client.pipeline() as pipe:
+            pipe.delete(self._key(task_id))
+            for index in (self._index, *[self._state_index(s) for s in JobState]):
+                pipe.zrem(index, task_id)
+            pipe.execute()
+
+    def _prune(self):
+        """Drop index entries for jobs older than `JOB_TTL`, as their hashes have expired."""
+        expired = time.time() - JOB_TTL.total_seconds()
+
+        with self._client.pipeline(transaction=False) as pipe:
+            for index in (self._index, *[self._state_index(s) for s in JobState]):
+                pipe.zremrangebyscore(index, "-inf", expired)
+            pipe.execute()
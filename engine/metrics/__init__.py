@@ -0,0 +1,13 @@
+from .instruments import (
+    PIPELINE_STAGE_SECONDS,
+    PIPELINE_RUNS,
+    HEADINGS_PUBLISHED,
+    HEADING_WRITE_SECONDS,
+    LLM_REQUEST_SECONDS,
+    LLM_TOKENS,
+    PROMPT_CACHE_LOOKUPS,
+    SEARCHES,
+    NOTION_REQUEST_SECONDS,
+    NOTION_REQUESTS,
+)
+from .exposition import QueueCollector, build_registry, render, start_exporter
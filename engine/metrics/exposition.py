@@ -0,0 +1,94 @@
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    generate_latest,
+    start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector
+from rich import print
+
+from jobs import JobQueue, JobRegistry
+
+
+class QueueCollector:
+    """Reports the depth of the job queue and the number of jobs in each state, read from Redis when scraped.
+
+    These are shared by every worker, so they are read by whichever process serves them rather than counted by
+    each worker.
+    """
+
+    def __init__(self, queue: JobQueue, registry: JobRegistry) -> None:
+        self._queue = queue
+        self._registry = registry
+
+    @staticmethod
+    def _families() -> tuple[GaugeMetricFamily, GaugeMetricFamily]:
+        depth = GaugeMetricFamily(
+            "wikiwizard_queue_jobs",
+            "Jobs in the queue: waiting to be claimed, claimed by a worker, or dead lettered.",
+            labels=["state"],
+        )
+        jobs = GaugeMetricFamily(
+            "wikiwizard_jobs",
+            "Jobs in the registry, by state. Running jobs are the ones being generated.",
+            labels=["state"],
+        )
+        return depth, jobs
+
+    def describe(self):
+        # * Without this the registry calls `collect` on registration, reading Redis as soon as it is imported
+        return list(self._families())
+
+    def collect(self):
+        depth, jobs = self._families()
+
+        for state, size in self._queue.sizes().items():
+            depth.add_metric([state], size)
+        yield depth
+
+        for state, count in self._registry.count().items():
+            jobs.add_metric([state.value], count)
+        yield jobs
+
+
+def multiprocess() -> bool:
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+
+def build_registry(*collectors) -> CollectorRegistry:
+    """
+    The function `build_registry` returns the registry to serve this process's metrics from, with any extra
+    collectors registered on it.
+
+    Args:
+      *collectors: Collectors to serve along with the engine's metrics, e.g. a `QueueCollector`.
+
+    Returns:
+      a registry aggregating the metrics of every process sharing `PROMETHEUS_MULTIPROC_DIR` when it is set,
+    otherwise the default registry of this process.
+    """
+    if multiprocess():
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    for collector in collectors:
+        registry.register(collector)
+
+    return registry
+
+
+def render(registry: CollectorRegistry) -> tuple[bytes, str]:
+    """Return the metrics of a registry in the Prometheus text format, and its content type."""
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def start_exporter(port: int, *collectors):
+    """Serve the metrics of this process (see `build_registry`) over HTTP on `port`, in a background thread."""
+    start_http_server(port, registry=build_registry(*collectors))
+    print(f"[bold grey]Serving metrics on port {port}[/bold grey]")
@@ -0,0 +1,64 @@
+from prometheus_client import Counter, Histogram
+
+# Seconds, from a single heading up to a whole page of several hundred headings
+STAGE_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+REQUEST_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+PIPELINE_STAGE_SECONDS = Histogram(
+    "wikiwizard_pipeline_stage_seconds",
+    "Time spent in each stage of a page's generation.",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+PIPELINE_RUNS = Counter(
+    "wikiwizard_pipeline_runs_total",
+    "Pages whose generation finished, by outcome.",
+    ["outcome"],
+)
+HEADINGS_PUBLISHED = Counter(
+    "wikiwizard_headings_published_total",
+    "Headings published to Notion, by outcome.",
+    ["outcome"],
+)
+HEADING_WRITE_SECONDS = Histogram(
+    "wikiwizard_heading_write_seconds",
+    "Time taken to write a single heading, including waiting for a writer.",
+    ["method"],
+    buckets=STAGE_BUCKETS,
+)
+
+LLM_REQUEST_SECONDS = Histogram(
+    "wikiwizard_llm_request_seconds",
+    "Time taken by requests to the OpenAI API once admitted, by model and outcome.",
+    ["model", "outcome"],
+    buckets=REQUEST_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "wikiwizard_llm_tokens_total",
+    "Tokens used by requests to the OpenAI API, by model and kind (prompt or completion).",
+    ["model", "kind"],
+)
+
+PROMPT_CACHE_LOOKUPS = Counter(
+    "wikiwizard_prompt_cache_lookups_total",
+    "Lookups of LLM responses in the prompt cache, by prompt type and result (hit or miss).",
+    ["prompt_type", "result"],
+)
+
+SEARCHES = Counter(
+    "wikiwizard_searches_total",
+    "Web searches asked for by the writers, by where their result came from.",
+    ["source"],
+)
+
+NOTION_REQUEST_SECONDS = Histogram(
+    "wikiwizard_notion_request_seconds",
+    "Time taken by each attempt at a request to the Notion API, by endpoint.",
+    ["endpoint"],
+    buckets=REQUEST_BUCKETS,
+)
+NOTION_REQUESTS = Counter(
+    "wikiwizard_notion_requests_total",
+    "Attempts at requests to the Notion API, by endpoint and response status.",
+    ["endpoint", "status"],
+)
@@ -16,3 +16,4 @@ class ModelConfig:
     headings: str = field(default=EnabledModels.HEADINGS)
     icons: str = field(default=EnabledModels.ICONS)
     categories: str = field(default=EnabledModels.CATEGORIES)
+    writing_method: str = field(default="single")  # The name of the `WritingMethod` headings are written with
@@ -4,6 +4,9 @@ from typing import Generator
 from itertools import groupby
 from nutree import Tree
 
+# Matches a numbered heading of the outline, e.g. '3.5.1: 20th Century Cars'
+HEADING_PATTERN = re.compile(r"(\d+(\.\d+)*)\s*:\s*(.*)")
+
 
 @dataclass(unsafe_hash=True)
 class Heading:
@@ -34,38 +37,46 @@ class Section:
         Returns:
             list[Section]: Aggregated and ordered Sections.
         """
-        pattern = re.compile(r"(\d+(\.\d+)*)\s*:\s*(.*)")
-        matches = pattern.findall(value)
+        matches = HEADING_PATTERN.findall(value)
 
         # Turn the text into groups of headings, called Sections
         headings = group_headings(
             [Heading(index=match[0], title=match[2].strip()) for match in matches]
         )
 
-        # Create 'n' amount of Tree objects
-        trees = [Section(Tree()) for _ in range(len(headings))]
+        return [cls.from_headings(section) for section in headings]
+
+    @classmethod
+    def from_headings(cls, headings: list[Heading]) -> "Section":
+        """Build the tree of a single Section from its headings.
 
-        # Iterate over everything, and add each heading to the respective tree
-        for i, section in enumerate(headings):
-            last_index = ""
-            last_node = trees[i].tree
+        Args:
+            headings (list[Heading]): The headings of one group, in order, see `group_headings`.
 
-            stack = [last_node]
+        Returns:
+            Section: The Section, with each heading nested under its parent.
+        """
+        section = cls(Tree())
 
-            for heading in section:
-                if heading.index.count(".") > last_index.count("."):
-                    stack.append(last_node)
-                    last_node = last_node.add(heading)
-                    last_index = heading.index
-                    continue
+        last_index = ""
+        last_node = section.tree
 
-                if heading.index.count(".") < last_index.count("."):
-                    stack.pop()
+        stack = [last_node]
 
-                last_node = stack[-1].add(heading)
+        for heading in headings:
+            if heading.index.count(".") > last_index.count("."):
+                stack.append(last_node)
+                last_node = last_node.add(heading)
                 last_index = heading.index
+                continue
+
+            if heading.index.count(".") < last_index.count("."):
+                stack.pop()
+
+            last_node = stack[-1].add(heading)
+            last_index = heading.index
 
-        return trees
+        return section
 
     def format(self) -> str:
         """Formats this section into a human-readable list.
@@ -125,4 +136,67 @@ def group_headings(sections: list[Heading]) -> list[list[Heading]]:
     Returns:
         list[list[Heading]]: A list of sublists containing ordered groups of headings.
     """
-    return [list(section) for _, section in groupby(sections, lambda s: s.index[0])]
+    return [list(section) for _, section in groupby(sections, _group)]
+
+
+def _group(heading: Heading) -> str:
+    # * The whole leading number, so section 1 isn't merged with sections 10-19
+    return heading.index.split(".")[0]
+
+
+class OutlineParser:
+    """Parses an outline as it is streamed, emitting each Section as soon as it is complete.
+
+    A Section is complete once a heading of the next section arrives (or the outline ends), so sections can be
+    written while the rest of the outline is still being generated.
+
+    Example:
+    ```python
+    parser = OutlineParser()
+    for chunk in chunks:
+        for section in parser.feed(chunk):
+            ...
+    sections = parser.close()
+    ```
+    """
+
+    def __init__(self) -> None:
+        self._buffer = ""  # The last line, until it is known to be complete
+        self._headings: list[Heading] = []  # The headings of the section being parsed
+
+    def _parse(self, line: str) -> list["Section"]:
+        sections = []
+
+        for match in HEADING_PATTERN.findall(line):
+            heading = Heading(index=match[0], title=match[2].strip())
+
+            if self._headings and _group(heading) != _group(self._headings[0]):
+                sections.append(Section.from_headings(self._headings))
+                self._headings = []
+
+            self._headings.append(heading)
+
+        return sections
+
+    def feed(self, text: str) -> list["Section"]:
+        """Add the next chunk of the outline.
+
+        Args:
+            text (str): The chunk, which may end part way through a line.
+
+        Returns:
+            list[Section]: Every Section completed by this chunk, in order.
+        """
+        *lines, self._buffer = (self._buffer + text).split("\n")
+        return [section for line in lines for section in self._parse(line)]
+
+    def close(self) -> list["Section"]:
+        """Finish the outline, returning the Sections that were still being parsed."""
+        sections = self._parse(self._buffer)
+        self._buffer = ""
+
+        if self._headings:
+            sections.append(Section.from_headings(self._headings))
+            self._headings = []
+
+        return sections
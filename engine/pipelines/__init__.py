@@ -1,2 +1,5 @@
 from .complete import CompletePipeline
+from .regenerate import RegeneratePipeline, select_leaves
+from .writer import PageWriter
+from .pool import init_writer_pool, get_writer_pool, shutdown_writer_pool
 from .event import EventHandler, StatusEventHandler
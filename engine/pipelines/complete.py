@@ -1,12 +1,19 @@
+import json
+import asyncio
+import contextvars
+from typing import AsyncIterator
 from nutree import Node
-import multiprocessing as mp
-from langchain.globals import set_verbose
 from rich import print
 
-from config import Prompts
-from models import Section, ModelConfig, Model
-from tasks import NotionWiki, writing, WritingMethod, generate
+from config import Prompts, Concurrency
+from jobs import Checkpoint, RedisCheckpoint
+from models import Section, OutlineParser, ModelConfig, Model
+from tasks import NotionWiki, BlockWriter, WritingMethod, generate
+from tasks.icons import PendingIcons, generate_icons
+from tasks.usage import usage_scope
 from .event.event_handler import EventHandler
+from .event.metrics import PipelineMetrics
+from .writer import PageWriter
 
 
 class CompletePipeline:
@@ -15,19 +22,28 @@ class CompletePipeline:
         notion_page_url: str,
         notion_secret: str,
         model_config: ModelConfig,
-        concurrency: int = 5,
-        event_handler: EventHandler = EventHandler(),
+        concurrency: int = Concurrency.JOB_CONCURRENCY,
+        event_handler: EventHandler | None = None,
+        categories: list[str] | None = None,
+        task_id: str | None = None,
     ) -> None:
         self.notion = NotionWiki(notion_secret)
+        self._page_url = notion_page_url
         self._database = self.notion.split_url(notion_page_url)
         self._concurrency = concurrency
-        self._handler = event_handler
+        self._handler = event_handler or EventHandler()
+        self._metrics = PipelineMetrics(self._handler)
         self._model_config = model_config
+        self._categories = categories  # * Read once for a whole batch, as a seed for the categories of each job
+        self._task_id = task_id  # * The job LLM usage is recorded against, if any
+        # * Progress is checkpointed against the job, so a failed run can carry on where it stopped
+        self._checkpoint = RedisCheckpoint(task_id) if task_id else Checkpoint()
 
     def _get_category(self, title: str) -> str:
         """
         The function `_get_category` retrieves the category of a given title from a database, creates the
-        category if it doesn't exist, and returns the category.
+        category if it doesn't exist, and returns the category. A category picked by an earlier run of the
+        job is reused.
 
         Args:
           title (str): The `title` parameter in the `_get_category` method is a string that represents the
@@ -36,7 +52,21 @@ class CompletePipeline:
         Returns:
           a string, which is the category of the given title.
         """
-        categories = self.notion.get_categories(self._database)
+        if (category := self._checkpoint.get("category")) is not None:
+            self._handler.fire("categoryFound", category)
+            return category
+
+        # * The categories read for a batch are only a seed, as earlier jobs of the batch may have created more.
+        # * Those created in this process are in its cached schema, which is re-read at most every `NotionSchema.TTL`
+        categories = list(
+            dict.fromkeys(
+                [
+                    *(self._categories or []),
+                    *(cat["name"] for cat in self.notion.get_categories(self._database)),
+                ]
+            )
+        )
+
         category = generate.prompt(
             prompt=title,
             system_message=Prompts.categoriser_prompt,
@@ -44,12 +74,15 @@ class CompletePipeline:
                 key=self._model_config.oai_key,
                 model=self._model_config.categories,
             ),
-            categories=", ".join([cat["name"] for cat in categories]),
+            cache="categories",
+            categories=", ".join(categories),
         )
 
-        if category not in [cat["name"] for cat in categories]:
+        if category not in categories:
+            # * Checks the latest options first, as another job may have created it since they were read
             self.notion.create_category(self._database, category)
 
+        self._checkpoint.update(category=category)
         self._handler.fire("categoryFound", category)
 
         return category
@@ -57,7 +90,8 @@ class CompletePipeline:
     def _setup_page(self, title: str, category: str) -> str:
         """
         The `_setup_page` function creates a primary page in a Notion database with a given title, category,
-        and icon, and writes default content to the page including a table of contents and a divider.
+        and icon, and writes default content to the page including a table of contents and a divider. A page
+        set up by an earlier run of the job is reused.
 
         Args:
           title (str): The `title` parameter is a string that represents the title of the page that will be
@@ -68,6 +102,12 @@ class CompletePipeline:
         Returns:
           The function `_setup_page` returns the `page_id` as a string.
         """
+        if (page_id := self._checkpoint.get("page_id")) is not None:
+            # * The earlier run marked the page as failed
+            self.notion.update_status(page_id, "In progress")
+            self._handler.fire("pageSetup", title, page_id)
+            return page_id
+
         page_id = self.notion.create_primary_page(
             self._database,
             title=title,
@@ -80,6 +120,8 @@ class CompletePipeline:
                     model=self._model_config.icons,
                     temperature=0.9,
                 ),
+                cache="icons",
+                cache_sampled=True,
             ),
         )
 
@@ -95,113 +137,319 @@ class CompletePipeline:
             ],
         )
 
+        self._checkpoint.update(page_id=page_id)
         self._handler.fire("pageSetup", title, page_id)
 
         return page_id
 
-    def _generate_content(self, sections: list[Section], title: str):
+    async def _stream_outline(self, title: str) -> AsyncIterator[Section]:
+        """
+        The function `_stream_outline` generates the outline of the page, yielding each section as soon as
+        its part of the outline has been generated. Sections outlined by an earlier run of the job are
+        yielded first, and if that outline was cut short, the rest is taken from a new one.
+
+        Args:
+          title (str): The title of the page.
+
+        Yields:
+          each section of the outline, in order.
+        """
+        restored = self._checkpoint.sections()
+        for section in restored:
+            yield section
+
+        if self._checkpoint.get("outlined"):
+            return
+
+        parser = OutlineParser()
+        skip = len(restored)
+
+        def new(sections: list[Section]):
+            nonlocal skip
+            for section in sections:
+                if skip:
+                    skip -= 1
+                    continue
+
+                self._checkpoint.add_section(section)
+                yield section
+
+        async for chunk in generate.stream_prompt(
+            prompt=title,
+            system_message=Prompts.heading_prompt,
+            model=Model(
+                key=self._model_config.oai_key,
+                model=self._model_config.headings,
+            ),
+            cache="headings",
+        ):
+            for section in new(parser.feed(chunk)):
+                yield section
+
+        for section in new(parser.close()):
+            yield section
+
+        self._checkpoint.update(outlined="1")
+
+    async def _write_and_publish(self, title: str, page_id: str):
         """
-        The function `_write_leaves` iterates through a list of sections and their headings, writes the
-        content of each section using a specified writing method, and updates the content of each heading
-        with the written section.
+        The function `_write_and_publish` writes every section through a single bounded scheduler as soon
+        as it is outlined, and publishes each section to Notion as soon as it (and every section before it)
+        is written, while later sections are still being outlined and written.
 
         Args:
-          sections (list[Section]): A list of Section objects. Each Section object represents a section of
-        content.
           title (str): The `title` parameter is a string that represents the title of the document or
         section being written.
+          page_id (str): The ID of the page the sections are published to.
         """
-        pool = mp.Pool(self._concurrency)
-
-        print(
-            f"[bold grey]Writing sections for [bold green]{title}[/bold green][/bold grey]"
-        )
-        for section in sections:
-            results = pool.map(
-                writing.write_section_mp,
+        loop = asyncio.get_running_loop()
+        sections: list[Section] = []
+        outlined = loop.create_future()
+        # * Headings written or published by an earlier run of the job aren't written again
+        contents = self._checkpoint.contents()
+        published = self._checkpoint.published()
+        failures = self._checkpoint.failures()
+
+        async def outline():
+            try:
+                async for section in self._stream_outline(title):
+                    for heading in section.get_writable_headings():
+                        heading.content = contents.get(heading.index)
+
+                    sections.append(section)
+                    yield section
+            except Exception as ex:
+                # * Anything waiting on the whole outline fails with it, rather than waiting forever
+                outlined.set_exception(ex)
+                raise
+
+            self._handler.fire("sectionsGenerated", sections)
+            outlined.set_result(sections)
+
+        async def pick_icons() -> dict[str, str]:
+            # * Icons are picked for the whole outline at once, while the first sections are being written
+            await outlined
+            if (picked := self._checkpoint.get("icons")) is not None:
+                return json.loads(picked)
+
+            # * Runs in the usage scope of the job, which threads don't inherit
+            icons = await loop.run_in_executor(
+                None,
+                contextvars.copy_context().run,
+                generate_icons,
                 [
-                    (
-                        section.format(),
-                        heading,
-                        title,
-                        WritingMethod.SINGLE,
-                        self._model_config,
-                    )
+                    heading.title
+                    for section in sections
                     for heading in section.get_writable_headings()
                 ],
+                Model(
+                    key=self._model_config.oai_key,
+                    model=self._model_config.icons,
+                    temperature=0.9,
+                ),
             )
+            self._checkpoint.update(icons=json.dumps(icons, ensure_ascii=False))
+            return icons
+
+        async def patch_icons():
+            # * Headings are published without waiting for the icons, those published before them are patched
+            for subpage_id, icon in pending.resolve(await picking):
+                try:
+                    await loop.run_in_executor(None, self.notion.update_icon, subpage_id, icon)
+                except Exception as ex:
+                    print(f"[yellow]Could not patch the icon of subpage {subpage_id}: {ex}[/yellow]")
 
-            for heading, result in zip(section.get_writable_headings(), results):
-                heading.content = result
+        pending = PendingIcons()
+        picking = asyncio.ensure_future(pick_icons())
+        patching = asyncio.ensure_future(patch_icons())
+
+        print(
+            f"[bold grey]Writing sections for [bold green]{title}[/bold green][/bold grey]"
+        )
 
-            self._handler.fire("sectionGenerated", section)
+        try:
+            with self.notion.writer(page_id) as writer:
+                index = 0
+                async for section in PageWriter(self._concurrency).stream(
+                    outline(),
+                    title,
+                    self._model_config,
+                    method=WritingMethod.named(self._model_config.writing_method),
+                    on_heading=self._checkpoint.save_content,
+                ):
+                    self._handler.fire("sectionGenerated", section)
+
+                    # * Publish in a thread, so the event loop keeps scheduling the remaining headings
+                    await loop.run_in_executor(
+                        None,
+                        self._publish_section,
+                        section,
+                        index,
+                        sections,
+                        page_id,
+                        writer,
+                        pending,
+                        published,
+                        failures,
+                    )
+                    index += 1
 
-        self._handler.fire("sectionsGenerated", sections)
+            await patching
+        finally:
+            for task in (picking, patching):
+                task.cancel()
+                if task.done() and not task.cancelled():
+                    task.exception()  # * Already raised by the outline, don't log it as unhandled
 
-        pool.close()
-        pool.join()
         print(
             ":white_check_mark:",
             f"[bold green]Finished writing sections for [bold green]{title}[/bold green][/bold green]",
         )
 
-    def _write_content_to_notion(self, node: Node, page_id: str):
+    def _publish_section(
+        self,
+        section: Section,
+        index: int,
+        sections: list[Section],
+        page_id: str,
+        writer: BlockWriter,
+        icons: PendingIcons,
+        published: set[str],
+        failures: dict[str, list[str]],
+    ):
+        """
+        The function `_publish_section` writes every heading of a section to Notion, in order, and then
+        releases the content of each heading as it no longer needs to be kept in memory. Headings published
+        by an earlier run of the job are skipped, and headings that failed in it replace their error blocks.
+
+        Args:
+          section (Section): The written section to publish.
+          index (int): The position of the section on the page.
+          sections (list[Section]): Every section on the page.
+          page_id (str): The ID of the page the section is published to.
+          writer (BlockWriter): The buffered writer for `page_id`.
+          icons (PendingIcons): The icon of every heading, which may still be being picked.
+          published (set[str]): The index of every heading already on the page.
+          failures (dict[str, list[str]]): The error blocks of every heading that failed, by heading index.
+        """
+        for node in section.tree:
+            if node.data.index not in published:
+                self._write_content_to_notion(
+                    node=node,
+                    page_id=page_id,
+                    writer=writer,
+                    icons=icons,
+                    failed=failures.get(node.data.index),
+                )
+            node.data.content = None
+
+            self._handler.fire("sectionWritten", section=section, index=index, sections=sections)
+
+    def _write_content_to_notion(
+        self,
+        node: Node,
+        page_id: str,
+        writer: BlockWriter,
+        icons: PendingIcons,
+        failed: list[str] | None = None,
+    ):
         """
-        The `_write_heading` function writes a heading to a Notion page, creating a subpage if the heading
-        is a leaf node.
+        The `_write_content_to_notion` function writes a heading to a Notion page, creating a subpage if the
+        heading is a leaf node. Headings that are not leaves are buffered in `writer`, which is flushed
+        before a subpage is created so the page keeps its order. Each heading is checkpointed as published
+        once it is actually on the page.
+
+        A heading that fails is replaced by an error block, which is checkpointed rather than published, so
+        running the job again retries the heading and deletes its error block. A retried heading is written where
+        its error block was, except for a subpage, which Notion only creates at the end of the page, so a link to
+        it is written there instead.
 
         Args:
           node (Node): The `node` parameter is of type `Node` and represents a node in a tree structure. It
         likely contains data related to a specific section or heading.
           page_id (str): The `page_id` parameter is the unique identifier of the page where the content will
         be written. It is used to specify the destination page for creating subpages or writing content.
+          writer (BlockWriter): The buffered writer for `page_id`.
+          icons (PendingIcons): The icon of every heading, which may still be being picked.
+          failed (list[str] | None): The IDs of the error blocks an earlier run wrote in place of the heading.
           section (Section): The `section` parameter is an object of the `Section` class. It represents a
         section within a page or document.
           title (str): The `title` parameter is a string that represents the title of the section or
         heading.
         """
-        try:
-            heading = node.data
+        heading = node.data
+
+        def mark_published():
+            self._checkpoint.mark_published(heading.index)
 
+        try:
             if node.is_leaf():
                 parsed = self.notion.md_to_blocks(heading.content)
 
-                self.notion.create_subpage(
+                writer.flush()
+                icon = icons.get(heading.title)
+                subpage_id = self.notion.create_subpage(
                     page_id,
                     title=heading.title,
-                    icon=generate.prompt(
-                        prompt=heading.title,
-                        system_message=Prompts.icons_prompt,
-                        model=Model(
-                            key=self._model_config.oai_key,
-                            model=self._model_config.icons,
-                            temperature=0.9,
-                        ),
-                    ),
+                    icon=icon,
                     content=parsed,
                 )
+                if (picked := icons.published(subpage_id, heading.title, icon)) is not None:
+                    self.notion.update_icon(subpage_id, picked)
+                # * Kept so the heading can be regenerated in place, see `RegeneratePipeline`
+                self._checkpoint.add_subpage(heading, subpage_id)
+                if failed:
+                    # * Subpages can only be created at the end of the page, so link to it where the error block is
+                    self.notion.write(
+                        page_id,
+                        [{"type": "link_to_page", "link_to_page": {"type": "page_id", "page_id": subpage_id}}],
+                        after=failed[-1],
+                    )
+                mark_published()
             else:
                 # * Only write title in case we don't create page > should this be configurable
                 content = self.notion.md_to_blocks(
                     # f"#{'#'*heading.index.count('.')} {heading.index} - {heading.title}" # ? MAke this configurable option
                     f"#{'#'*heading.index.count('.')} {heading.title}"
                 )
-                self.notion.write(page_id, content)
+                if failed:
+                    # * Written where the error block is, rather than at the end of the page
+                    self.notion.write(page_id, content, after=failed[-1])
+                    mark_published()
+                else:
+                    writer.append(content, on_written=mark_published)
+
+            if failed:
+                self.notion.delete_blocks(failed)
+                self._checkpoint.remove_failure(heading)
 
             self._handler.fire("headingSave", heading, page_id)
             print(f"[green]Saved '{heading.index}: {heading.title}' to page.[/green]")
         except Exception as ex:
-            content = self.notion.md_to_blocks(f"❌ ERROR: {heading.title} ❌ - {ex}")
-            try:
-                self.notion.write(page_id, content)
-            except Exception:
-                self._write_content_to_notion(node, page_id)
             self._handler.fire("headingFail", heading, page_id)
+            if failed:
+                return  # * Its error block from the earlier run is still on the page
+
+            try:
+                # * Written straight away, so the IDs of the error blocks can be checkpointed
+                writer.flush()
+                self._checkpoint.add_failure(
+                    heading,
+                    self.notion.write(
+                        page_id,
+                        self.notion.md_to_blocks(f"❌ ERROR: {heading.title} ❌ - {ex}"),
+                    ),
+                )
+            except Exception as write_ex:
+                print(
+                    f"[red]Could not write the error of '{heading.index}: {heading.title}': {write_ex}[/red]"
+                )
 
     def _iterate_sections(self, page_id: str, title: str):
         """
-        The `_iterate_sections` function iterates through sections and headings, creates subpages for leaf
-        nodes, and writes content for non-leaf nodes.
+        The `_iterate_sections` function streams the outline of the page, writing each section as soon as it
+        is outlined, and publishes them to Notion as they are written, creating subpages for leaf nodes and
+        headings for non-leaf nodes. If any heading could not be published, the page is left unfinished.
 
         Args:
           page_id (str): The `page_id` parameter is a string that represents the ID of a page in the Notion
@@ -209,67 +457,54 @@ class CompletePipeline:
           title (str): The `title` parameter in the `_iterate_sections` method is a string that represents
         the title of a page.
         """
-        sections = Section.from_string(
-            generate.prompt(
-                prompt=title,
-                system_message=Prompts.heading_prompt,
-                model=Model(
-                    key=self._model_config.oai_key,
-                    model=self._model_config.headings,
-                ),
-            )
-        )
-        
-        self._handler.fire("sectionsGenerated", sections)
-
-        self._generate_content(sections, title)
+        asyncio.run(self._write_and_publish(title, page_id))
 
-        for index, section in enumerate(sections):
-            for node in section.tree:
-                self._write_content_to_notion(
-                    node=node,
-                    page_id=page_id,
-                )
-                
-                self._handler.fire("sectionWritten", section=section, index=index, sections=sections)
+        if failures := self._checkpoint.failures():
+            # * Fails the job, so it can be resumed to retry them
+            raise RuntimeError(f"Could not publish headings {', '.join(sorted(failures))}")
 
         self.notion.update_status(page_id, "Done")
 
-    def _create_sections(self, page_id: str, title: str):
-        """
-        The function `_create_sections` is responsible for iterating through sections and updating the
-        status of a page in a Notion database.
-
-        Args:
-          page_id (str): The `page_id` parameter is a string that represents the unique identifier of a page
-        in the Notion database. It is used to identify the page where the sections will be created.
-          title (str): The `title` parameter is a string that represents the title of a page.
-        """
-        try:
-            self._iterate_sections(page_id, title)
-        except Exception as ex:
-            self._handler.fire("onFail", title, page_id)
-            self.notion.update_status(page_id, "Failed")
-            raise ex
-
     def run(self, title: str):
         """
         The `run` function takes a `title` as input, retrieves the `category` based on the title, sets up a
         page with the given title and category, and creates sections for the page.
 
+        Running the pipeline of a job again (e.g. once it has failed) carries on from its checkpoint, reusing
+        its page and every heading already written or published. The checkpoint is kept once the page is
+        finished, as the outline and subpages its headings are regenerated from.
+
         Args:
           title (str): The `title` parameter is a string that represents the title of a page.
         """
+        from langchain.globals import set_verbose
+
         # TODO: Add a debug mode, where we print more to terminal
         set_verbose(False)  # * Stop langchain printing every output to terminal
         print(f"Starting generation of {title}")
         
         self._handler.fire("onStart", title)
-        
-        category = self._get_category(title)
-        page_id = self._setup_page(title, category)
-        self._create_sections(page_id, title)
+
+        self._checkpoint.update(title=title, page_url=self._page_url)
+
+        page_id = None
+        try:
+            with usage_scope(task_id=self._task_id):
+                category = self._get_category(title)
+                page_id = self._setup_page(title, category)
+                self._iterate_sections(page_id, title)
+        except Exception as ex:
+            # * Fired for a failed setup too, so the job is marked failed and can be resumed
+            self._handler.fire("onFail", title, page_id)
+            self._handler.flush()
+            if page_id is not None:
+                self.notion.update_status(page_id, "Failed")
+            raise ex
+
+        self._checkpoint.update(completed="1")
+        self._checkpoint.touch()
         self._handler.fire("onComplete", title)
+        self._handler.flush()
         print(
             ":white_check_mark:",
             f"[bold green]Completed wiki page: '{title}'[/bold green]",
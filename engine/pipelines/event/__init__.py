@@ -1,2 +1,3 @@
 from .event_handler import EventHandler
-from .status_handler import StatusEventHandler
\ No newline at end of file
+from .status_handler import StatusEventHandler
+from .metrics import PipelineMetrics
@@ -1,20 +1,121 @@
+import queue
+import threading
 from collections import defaultdict
+from contextlib import contextmanager
 from typing import Callable
 
 from rich import print
 
+_STOP = object()
+
 
 class EventHandler:
-    def __init__(self) -> None:
+    def __init__(self, background: bool = False, coalesce: set[str] | None = None) -> None:
+        """
+        Args:
+          background (bool): Queue fired events and run their callbacks on a background thread, so firing
+        never blocks the pipeline. Call `flush` to wait for queued events to be delivered.
+          coalesce (set[str] | None): Events that are superseded by a later firing of the same event (e.g.
+        progress updates). When several are waiting to be delivered, only the latest is.
+        """
         self._registry = defaultdict(list)
+        self._inline = defaultdict(list)
+        self._background = background
+        self._coalesce = coalesce or set()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
 
-    def register(self, event: str, callback: Callable):
-        self._registry[event].append(callback)
+    def register(self, event: str, callback: Callable, inline: bool = False):
+        """
+        Args:
+          event (str): The name of the event.
+          callback (Callable): Called with the arguments the event is fired with.
+          inline (bool): Call the callback as the event is fired, even when other callbacks run in the
+        background, and for every firing of a coalesced event. Inline callbacks must be quick, e.g. recording
+        when the event happened.
+        """
+        (self._inline if inline else self._registry)[event].append(callback)
 
     def fire(self, event: str, *args, **kwargs):
-        for callback in self._registry.get(event, []):
+        if event in self._inline:
+            self._call(self._inline[event], event, args, kwargs)
+
+        if not self._background:
+            self._dispatch(event, args, kwargs)
+            return
+
+        self._start()
+        self._queue.put((event, args, kwargs))
+
+    def flush(self):
+        """Block until every event fired so far has been delivered."""
+        if self._background:
+            self._queue.join()
+
+    def close(self):
+        """Deliver every queued event, then stop the background thread."""
+        with self._lock:
+            if self._thread is None:
+                return
+
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def _dispatch(self, event: str, args: tuple, kwargs: dict):
+        self._call(self._registry.get(event, []), event, args, kwargs)
+
+    def _call(self, callbacks: list[Callable], event: str, args: tuple, kwargs: dict):
+        for callback in callbacks:
             try:
                 callback(*args, **kwargs)
             except Exception as ex:
                 print(f"[red]Error when firing event '{event}': {ex}[/red]")
 
+    @contextmanager
+    def _batch(self):
+        """Wraps the delivery of a batch of queued events, e.g. so their writes can be sent together."""
+        yield
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._deliver, daemon=True)
+                self._thread.start()
+
+    def _drain(self) -> list:
+        """Wait for at least one queued event, then take every event queued so far."""
+        items = [self._queue.get()]
+
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    def _deliver(self):
+        while True:
+            items = self._drain()
+            events = [item for item in items if item is not _STOP]
+
+            # * Keep only the last firing of coalesced events, in its place in the batch
+            latest = {event: i for i, (event, _, _) in enumerate(events)}
+            events = [
+                (event, args, kwargs)
+                for i, (event, args, kwargs) in enumerate(events)
+                if event not in self._coalesce or latest[event] == i
+            ]
+
+            try:
+                with self._batch():
+                    for event, args, kwargs in events:
+                        self._dispatch(event, args, kwargs)
+            except Exception as ex:
+                print(f"[red]Error when delivering events: {ex}[/red]")
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+            if any(item is _STOP for item in items):
+                return
@@ -0,0 +1,48 @@
+import time
+
+from metrics import PIPELINE_STAGE_SECONDS, PIPELINE_RUNS, HEADINGS_PUBLISHED
+from .event_handler import EventHandler
+
+
+class PipelineMetrics:
+    """Times the stages of a pipeline from the events it fires, and records them as Prometheus metrics.
+
+    A stage runs from the first firing of the event that starts it to the first firing of the event that ends it,
+    so with a streamed outline, stages overlap (e.g. the first section is written before the outline is done).
+    """
+
+    # The events each stage starts and ends at
+    STAGES = {
+        "category": ("onStart", "categoryFound"),
+        "page_setup": ("categoryFound", "pageSetup"),
+        "outline": ("pageSetup", "sectionsGenerated"),
+        "first_section": ("pageSetup", "sectionGenerated"),
+        "sections": ("pageSetup", "onComplete"),
+        "total": ("onStart", "onComplete"),
+    }
+
+    def __init__(self, handler: EventHandler) -> None:
+        self._fired: dict[str, float] = {}
+
+        events = {event for stage in self.STAGES.values() for event in stage}
+        for event in events:
+            handler.register(event, lambda *_, event=event, **__: self._mark(event), inline=True)
+
+        handler.register("onComplete", lambda *_: PIPELINE_RUNS.labels("completed").inc(), inline=True)
+        handler.register("onFail", lambda *_: PIPELINE_RUNS.labels("failed").inc(), inline=True)
+        handler.register("headingSave", lambda *_: HEADINGS_PUBLISHED.labels("saved").inc(), inline=True)
+        handler.register("headingFail", lambda *_: HEADINGS_PUBLISHED.labels("failed").inc(), inline=True)
+
+    def _mark(self, event: str):
+        now = time.monotonic()
+
+        if event == "onStart":
+            self._fired.clear()  # * The pipeline is being run again
+        if event in self._fired:
+            return
+
+        self._fired[event] = now
+
+        for stage, (start, end) in self.STAGES.items():
+            if end == event and start in self._fired:
+                PIPELINE_STAGE_SECONDS.labels(stage).observe(now - self._fired[start])
@@ -1,14 +1,18 @@
-from datetime import timedelta
+from contextlib import contextmanager
 
 from .event_handler import EventHandler
 
-from config.redis import update_status, Status, redis_client
+from config.redis import Status, redis_client
+from jobs import JobRegistry
 from models import Section
 
 class StatusEventHandler(EventHandler):
-    def __init__(self, task_id: str) -> None:
-        super().__init__()
+    def __init__(self, task_id: str, background: bool = True) -> None:
+        # * Only the latest progress message matters, so a backlog of them is coalesced into one
+        super().__init__(background=background, coalesce={"sectionWritten"})
         self._task_id = task_id
+        self._jobs = JobRegistry()
+        self._client = None
         
         self.register("onStart", self.on_start)
         self.register("pageSetup", self.on_page_setup)
@@ -21,27 +25,36 @@ class StatusEventHandler(EventHandler):
     def task_id(self):
         return self._task_id
     
+    @contextmanager
+    def _batch(self):
+        # * Every status update delivered in a batch is sent to Redis in one round trip
+        with redis_client.pipeline(transaction=False) as pipe:
+            self._client = pipe
+            try:
+                yield
+            finally:
+                self._client = None
+            pipe.execute()
+
+    def update_status(self, status: Status | str):
+        self._jobs.update(self.task_id, status, client=self._client)
+
     def on_start(self, title: str):
-        update_status(self.task_id, Status.PAGE_SETUP)
-        
-        # Add the title to the redis cache
-        redis_client.hset(f"generation:{self.task_id}", "title", title)
-        
-        # Set the value to expire in 3 days
-        redis_client.expire(f"generation:{self.task_id}", timedelta(days=3), nx=True)
+        # * The job was registered, with its title, when it was queued
+        self.update_status(Status.PAGE_SETUP)
         
     def on_page_setup(self, title: str, page_id: str):
-        update_status(self.task_id, Status.GENERATING_SECTIONS)
+        self.update_status(Status.GENERATING_SECTIONS)
         
     def on_sections_generated(self, sections: list):
-        update_status(self.task_id, Status.GENERATING_CONTENT)
+        self.update_status(Status.GENERATING_CONTENT)
         
     def on_section_write(self, section: Section, index: int, sections: list[Section]):
-        update_status(self.task_id, "Written section " + str(index + 1) + " of " + str(len(sections)))
+        self.update_status("Written section " + str(index + 1) + " of " + str(len(sections)))
         
     def on_complete(self, title: str):
-        update_status(self.task_id, Status.COMPLETE)
+        self.update_status(Status.COMPLETE)
         
     def on_fail(self, title: str, page_id: str):
-        update_status(self.task_id, Status.FAILED)
+        self.update_status(Status.FAILED)
  
\ No newline at end of file
@@ -0,0 +1,58 @@
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+from rich import print
+
+from config import Concurrency
+
+_pool: Executor | None = None
+_lock = threading.Lock()
+
+
+def _warm_up():
+    # * Import the default writing method once per worker process, rather than on the first heading of a job
+    from tasks import WritingMethod
+
+    WritingMethod.SINGLE.load()
+
+
+def init_writer_pool(
+    size: int = Concurrency.WRITER_POOL_SIZE, executor: Executor | None = None
+) -> Executor:
+    """
+    The function `init_writer_pool` creates the process-wide writer pool that every pipeline submits
+    headings to. The size of the pool is the global cap on headings being written at once.
+
+    Args:
+      size (int): The number of writer processes. Defaults to `Concurrency.WRITER_POOL_SIZE`.
+      executor (Executor | None): Use this executor as the pool instead, e.g. threads when benchmarking
+    in a single process.
+
+    Returns:
+      the shared writer pool. If the pool already exists, it is returned unchanged.
+    """
+    global _pool
+
+    with _lock:
+        if _pool is None and executor is not None:
+            _pool = executor
+        elif _pool is None:
+            _pool = ProcessPoolExecutor(size, initializer=_warm_up)
+            print(f"[bold grey]Started writer pool with {size} processes[/bold grey]")
+
+        return _pool
+
+
+def get_writer_pool() -> Executor:
+    """Return the shared writer pool, creating it on first use."""
+    return _pool or init_writer_pool()
+
+
+def shutdown_writer_pool():
+    """Stop the shared writer pool, waiting for in-flight headings to finish."""
+    global _pool
+
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
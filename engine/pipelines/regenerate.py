@@ -0,0 +1,182 @@
+import asyncio
+from rich import print
+
+from config import Concurrency
+from jobs import RedisCheckpoint
+from models import Heading, Section, ModelConfig
+from tasks import NotionWiki, WritingMethod
+from tasks.usage import usage_scope
+from .event.event_handler import EventHandler
+from .writer import PageWriter
+
+
+def select_leaves(sections: list[Section], indices: list[str]) -> set[str]:
+    """
+    The function `select_leaves` finds the headings to regenerate for the given heading indices. A heading
+    with subheadings stands for every heading beneath it, as only the lowest headings have content.
+
+    Args:
+      sections (list[Section]): The outline of the page.
+      indices (list[str]): The indices of the chosen headings, e.g. ['2', '3.1'].
+
+    Returns:
+      the index of every chosen heading that has content.
+
+    Raises:
+      KeyError: if an index isn't a heading of the outline.
+    """
+    known = {node.data.index for section in sections for node in section.tree}
+    if unknown := [index for index in indices if index not in known]:
+        raise KeyError(", ".join(unknown))
+
+    return {
+        heading.index
+        for section in sections
+        for heading in section.get_writable_headings()
+        if any(heading.index == index or heading.index.startswith(f"{index}.") for index in indices)
+    }
+
+
+class RegeneratePipeline:
+    """Rewrites a chosen set of headings of a page that has already been generated, in place.
+
+    Only the headings chosen are written again, with the rest of their section as context. The new content of
+    each heading is diffed against its old content, and only the blocks of its subpage that changed are written
+    to Notion. The outline, content and subpage of every heading are read from the checkpoint of the job that
+    generated the page.
+    """
+
+    def __init__(
+        self,
+        notion_secret: str,
+        model_config: ModelConfig,
+        source_id: str,
+        concurrency: int = Concurrency.JOB_CONCURRENCY,
+        event_handler: EventHandler | None = None,
+        task_id: str | None = None,
+    ) -> None:
+        self.notion = NotionWiki(notion_secret)
+        self._model_config = model_config
+        self._concurrency = concurrency
+        self._handler = event_handler or EventHandler()
+        self._task_id = task_id  # * The job LLM usage is recorded against, if any
+        self._checkpoint = RedisCheckpoint(source_id)
+        self._failed: list[str] = []  # The index of every chosen heading that couldn't be regenerated
+
+    def _publish_heading(self, heading: Heading, old: str | None, subpage_id: str | None, page_id: str):
+        """
+        The function `_publish_heading` writes the new content of a heading over its subpage, only changing
+        the blocks that differ from its old content. The checkpoint keeps the old content of a heading that
+        fails.
+
+        Args:
+          heading (Heading): The regenerated heading.
+          old (str | None): The content the heading was last published with.
+          subpage_id (str | None): The ID of the heading's subpage, None if it was never published as one.
+          page_id (str): The ID of the page the heading is on.
+        """
+        try:
+            if subpage_id is None:
+                raise ValueError("the heading was never published as a subpage")
+
+            counts = self.notion.sync_blocks(
+                subpage_id,
+                self.notion.md_to_blocks(old or ""),
+                self.notion.md_to_blocks(heading.content),
+            )
+            self._checkpoint.save_content(heading)
+
+            self._handler.fire("headingSave", heading, page_id)
+            print(f"[green]Regenerated '{heading.index}: {heading.title}' ({counts})[/green]")
+        except Exception as ex:
+            print(f"[red]Could not regenerate '{heading.index}: {heading.title}': {ex}[/red]")
+            self._failed.append(heading.index)
+            self._handler.fire("headingFail", heading, page_id)
+
+    async def _regenerate(self, title: str, page_id: str, sections: list[Section], chosen: set[str]):
+        loop = asyncio.get_running_loop()
+        contents = self._checkpoint.contents()
+        subpages = self._checkpoint.subpages()
+
+        for section in sections:
+            for heading in section.get_writable_headings():
+                heading.content = None if heading.index in chosen else contents.get(heading.index)
+
+        index = 0
+        async for section in PageWriter(self._concurrency).stream(
+            sections,
+            title,
+            self._model_config,
+            method=WritingMethod.named(self._model_config.writing_method),
+        ):
+            for heading in section.get_writable_headings():
+                if heading.index in chosen:
+                    # * Publish in a thread, so the event loop keeps scheduling the remaining headings
+                    await loop.run_in_executor(
+                        None,
+                        self._publish_heading,
+                        heading,
+                        contents.get(heading.index),
+                        subpages.get(heading.index),
+                        page_id,
+                    )
+
+            self._handler.fire("sectionWritten", section=section, index=index, sections=sections)
+            index += 1
+
+    def run(self, headings: list[str]):
+        """
+        The function `run` regenerates the chosen headings of the page, and the headings beneath them.
+
+        Args:
+          headings (list[str]): The indices of the headings to regenerate, e.g. ['2', '3.1'].
+        """
+        from langchain.globals import set_verbose
+
+        set_verbose(False)  # * Stop langchain printing every output to terminal
+
+        title = self._checkpoint.get("title")
+        page_id = self._checkpoint.get("page_id")
+        self._handler.fire("onStart", title)
+
+        try:
+            if not self._checkpoint.get("completed"):
+                raise ValueError("Only finished pages can be regenerated")
+
+            sections = self._checkpoint.sections()
+            chosen = select_leaves(sections, headings)
+            # * Only the sections with a chosen heading are written
+            affected = [
+                section
+                for section in sections
+                if any(heading.index in chosen for heading in section.get_writable_headings())
+            ]
+
+            print(f"Regenerating {len(chosen)} headings of {title}")
+            self._handler.fire("pageSetup", title, page_id)
+            self._handler.fire("sectionsGenerated", affected)
+
+            self.notion.update_status(page_id, "In progress")
+            self._failed = []
+            with usage_scope(task_id=self._task_id):
+                asyncio.run(self._regenerate(title, page_id, affected, chosen))
+
+            if self._failed:
+                # * Fails the job like a generation with failed headings, rather than reporting it complete
+                raise RuntimeError(f"Could not regenerate headings {', '.join(sorted(self._failed))}")
+
+            self.notion.update_status(page_id, "Done")
+        except Exception as ex:
+            self._handler.fire("onFail", title, page_id)
+            self._handler.flush()
+            if page_id is not None:
+                self.notion.update_status(page_id, "Failed")
+            raise ex
+
+        self._checkpoint.touch()
+        self._handler.fire("onComplete", title)
+        self._handler.flush()
+        print(
+            ":white_check_mark:",
+            f"[bold green]Regenerated {len(chosen)} headings of '{title}'[/bold green]",
+        )
@@ -0,0 +1,160 @@
+import asyncio
+import time
+from concurrent.futures import Executor
+from typing import AsyncIterable, AsyncIterator, Callable
+
+from config import Concurrency, SearchCache
+from metrics import HEADING_WRITE_SECONDS
+from models import Heading, Section, ModelConfig
+from tasks import writing, WritingMethod, search
+from tasks.usage import current_scope
+from .pool import get_writer_pool
+
+
+async def _iterate(sections: list[Section] | AsyncIterable[Section]):
+    if isinstance(sections, AsyncIterable):
+        async for section in sections:
+            yield section
+    else:
+        for section in sections:
+            yield section
+
+
+class PageWriter:
+    def __init__(
+        self,
+        concurrency: int = Concurrency.JOB_CONCURRENCY,
+        executor: Executor | None = None,
+    ) -> None:
+        self._concurrency = concurrency  # * Per-job cap, the pool size is the global cap
+        self._executor = executor or get_writer_pool()
+
+    async def _write_section(
+        self,
+        section: Section,
+        title: str,
+        model_config: ModelConfig,
+        method: WritingMethod,
+        semaphore: asyncio.Semaphore,
+        on_heading: Callable[[Heading], None] | None = None,
+    ) -> Section:
+        loop = asyncio.get_running_loop()
+        # * Headings that already have content (e.g. restored from a checkpoint) aren't written again
+        headings = [h for h in section.get_writable_headings() if not h.has_content()]
+        context = section.format()
+        scope = current_scope()  # * Writers run in other processes, so are given the job's usage scope
+
+        async def write_heading(heading: Heading):
+            # * Headings are queued in page order, and the semaphore hands out slots in that order
+            async with semaphore:
+                start = time.monotonic()
+                heading.content = await loop.run_in_executor(
+                    self._executor,
+                    writing.write_section_mp,
+                    (context, heading, title, method, model_config, scope),
+                )
+                HEADING_WRITE_SECONDS.labels(method.name.lower()).observe(
+                    time.monotonic() - start
+                )
+
+            if on_heading:
+                on_heading(heading)
+
+        await asyncio.gather(*[write_heading(heading) for heading in headings])
+
+        return section
+
+    async def stream(
+        self,
+        sections: list[Section] | AsyncIterable[Section],
+        title: str,
+        model_config: ModelConfig,
+        method: WritingMethod = WritingMethod.SINGLE,
+        on_heading: Callable[[Heading], None] | None = None,
+    ) -> AsyncIterator[Section]:
+        """
+        The `stream` function schedules every writable heading of every section onto a single bounded
+        scheduler, so a slow heading in one section no longer holds back the headings of the next. Sections
+        are yielded in page order as soon as they (and every section before them) are written, while the
+        remaining sections carry on being written in the background.
+
+        Args:
+          sections (list[Section] | AsyncIterable[Section]): The sections of the page, in order. Sections of
+        an async iterable (e.g. an outline that is still being generated) start being written as they arrive.
+          title (str): The title of the page being written.
+          model_config (ModelConfig): The model configuration passed to the writing method.
+          method (WritingMethod): The writing method used for each heading.
+          on_heading (Callable[[Heading], None] | None): Called with each heading as soon as it is written,
+        in whatever order they finish.
+
+        Yields:
+          each section, with the content of every writable heading filled in.
+        """
+        semaphore = asyncio.Semaphore(self._concurrency)
+        tasks = []
+        scheduled = asyncio.Queue()
+
+        async def schedule():
+            try:
+                async for section in _iterate(sections):
+                    if SearchCache.PREFETCH:
+                        # * Searched in the background, while the section waits for a writer
+                        search.prefetch(search.likely_queries(title, section))
+                    task = asyncio.ensure_future(
+                        self._write_section(
+                            section, title, model_config, method, semaphore, on_heading
+                        )
+                    )
+                    tasks.append(task)
+                    scheduled.put_nowait(task)
+            finally:
+                scheduled.put_nowait(None)
+
+        scheduler = asyncio.ensure_future(schedule())
+
+        try:
+            while (task := await scheduled.get()) is not None:
+                yield await task
+
+            # * Raise anything that stopped the sections arriving
+            await scheduler
+        finally:
+            # * Stop writing if the consumer gives up (e.g. publishing failed)
+            scheduler.cancel()
+            for task in tasks:
+                task.cancel()
+
+    async def write(
+        self,
+        sections: list[Section] | AsyncIterable[Section],
+        title: str,
+        model_config: ModelConfig,
+        method: WritingMethod = WritingMethod.SINGLE,
+        on_section: Callable[[Section], None] | None = None,
+    ) -> list[Section]:
+        """
+        The `write` function writes every section of a page, see `stream`.
+
+        Args:
+          sections (list[Section] | AsyncIterable[Section]): The sections of the page, in order.
+          title (str): The title of the page being written.
+          model_config (ModelConfig): The model configuration passed to the writing method.
+          method (WritingMethod): The writing method used for each heading.
+          on_section (Callable[[Section], None] | None): Called with each section, in order, once all of its
+        headings have content.
+
+        Returns:
+          the given sections, with the content of every writable heading filled in.
+        """
+        written = []
+
+        async for section in self.stream(sections, title, model_config, method):
+            written.append(section)
+            if on_section:
+                on_section(section)
+
+        return written
+
+    def run(self, *args, **kwargs) -> list[Section]:
+        """Run `write` to completion from synchronous code."""
+        return asyncio.run(self.write(*args, **kwargs))
@@ -1,2 +1,2 @@
 from .writing import WritingMethod
-from .notion import NotionWiki
+from .notion import NotionWiki, BlockWriter
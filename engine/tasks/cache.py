@@ -0,0 +1,132 @@
+import json
+import time
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from config import LLMCache
+from config.redis import redis_client
+from metrics import PROMPT_CACHE_LOOKUPS
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    def get(self, key: str) -> str | None:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: str, ttl: int):
+        ...
+
+
+class MemoryBackend(CacheBackend):
+    """An in-process LRU cache, bounded by the total size of the values it holds."""
+
+    def __init__(self, max_bytes: int = LLMCache.MAX_BYTES) -> None:
+        self._max_bytes = max_bytes
+        self._size = 0
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires, value = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: int):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._size += len(value)
+
+            while self._size > self._max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        _, value = self._entries.pop(key)
+        self._size -= len(value)
+
+
+class DiskBackend(CacheBackend):
+    """A cache on local disk, shared by every process on the machine."""
+
+    def __init__(
+        self, directory: str = LLMCache.DIRECTORY, max_bytes: int = LLMCache.MAX_BYTES
+    ) -> None:
+        from diskcache import Cache
+
+        self._cache = Cache(
+            directory,
+            size_limit=max_bytes,
+            eviction_policy="least-recently-used",
+        )
+
+    def get(self, key: str) -> str | None:
+        return self._cache.get(key)
+
+    def set(self, key: str, value: str, ttl: int):
+        self._cache.set(key, value, expire=ttl)
+
+
+class RedisBackend(CacheBackend):
+    """A cache in Redis, shared by every worker. Size based eviction is left to Redis' `maxmemory` policy."""
+
+    def __init__(self, prefix: str = "llm") -> None:
+        self._prefix = prefix
+
+    def get(self, key: str) -> str | None:
+        return redis_client.get(f"{self._prefix}:{key}")
+
+    def set(self, key: str, value: str, ttl: int):
+        redis_client.set(f"{self._prefix}:{key}", value, ex=ttl)
+
+
+class PromptCache:
+    """Caches LLM responses by prompt type. Hits and misses are counted in `PROMPT_CACHE_LOOKUPS`."""
+
+    def __init__(self, backend: CacheBackend | None) -> None:
+        self._backend = backend
+
+    @staticmethod
+    def key(**parts) -> str:
+        """Build a content-addressed key from everything that affects a response."""
+        return hashlib.sha256(
+            json.dumps(parts, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def get(self, prompt_type: str, key: str) -> str | None:
+        if self._backend is None:
+            return None
+
+        value = self._backend.get(key)
+        PROMPT_CACHE_LOOKUPS.labels(prompt_type, "hit" if value is not None else "miss").inc()
+        return value
+
+    def set(self, prompt_type: str, key: str, value: str):
+        if self._backend is not None:
+            self._backend.set(
+                key, value, LLMCache.TTLS.get(prompt_type, LLMCache.DEFAULT_TTL)
+            )
+
+
+BACKENDS = {
+    "memory": MemoryBackend,
+    "disk": DiskBackend,
+    "redis": RedisBackend,
+}
+
+prompt_cache = PromptCache(
+    BACKENDS[LLMCache.BACKEND]() if LLMCache.BACKEND in BACKENDS else None
+)
@@ -0,0 +1,171 @@
+"""
+Long-lived API clients, shared by every job in a process, so requests reuse pooled keep-alive connections rather
+than opening (and TLS handshaking) new ones for every call.
+
+Clients are kept in a `ClientRegistry`, keyed by what they were built for (e.g. a hashed secret and a model). A
+process forked from one holding clients (e.g. a writer process) starts without any, as it can't share the
+connections of its parent.
+"""
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, TypeVar
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Clients
+
+T = TypeVar("T")
+
+
+class ClientRegistry(Generic[T]):
+    """Clients of one kind, keyed by what they were built for.
+
+    A client unused for `Clients.IDLE_TIMEOUT` seconds is closed. Once `Clients.MAX_CLIENTS` are kept, the least
+    recently used is dropped, but not closed, as it may still be in use. Callers should `get` a client whenever
+    they use it rather than hold on to it, so a client in use is never taken for an idle one.
+    """
+
+    def __init__(
+        self,
+        close: Callable[[T], None] | None = None,
+        max_clients: int = Clients.MAX_CLIENTS,
+        idle_timeout: float = Clients.IDLE_TIMEOUT,
+    ) -> None:
+        self._close = close
+        self._max_clients = max_clients
+        self._idle_timeout = idle_timeout
+        self._clients: OrderedDict[Hashable, tuple[float, T]] = OrderedDict()  # Least recently used first
+        self._lock = threading.Lock()
+
+        os.register_at_fork(after_in_child=self._forget)
+
+    def get(self, key: Hashable, build: Callable[[], T]) -> T:
+        """
+        The function `get` returns the client kept for a key, building it on first use.
+
+        Args:
+          key (Hashable): What the client is for, e.g. a hashed secret. Never the secret itself.
+          build (Callable[[], T]): Builds the client, called without holding the registry's lock.
+
+        Returns:
+          the client.
+        """
+        with self._lock:
+            idle = self._evict_idle()
+            client = self._touch(key)
+
+        if client is None:
+            built = build()
+            with self._lock:
+                # * Another thread may have built one in the meantime, only one of them is kept
+                client = self._touch(key)
+                if client is None:
+                    client = built
+                    self._clients[key] = (time.monotonic(), client)
+                    while len(self._clients) > self._max_clients:
+                        self._clients.popitem(last=False)
+                else:
+                    idle.append(built)
+
+        for stale in idle:
+            self._shutdown(stale)
+
+        return client
+
+    def _touch(self, key: Hashable) -> T | None:
+        if key not in self._clients:
+            return None
+
+        _, client = self._clients.pop(key)
+        self._clients[key] = (time.monotonic(), client)
+        return client
+
+    def _evict_idle(self) -> list[T]:
+        cutoff = time.monotonic() - self._idle_timeout
+        idle = []
+
+        while self._clients and next(iter(self._clients.values()))[0] < cutoff:
+            idle.append(self._clients.popitem(last=False)[1][1])
+
+        return idle
+
+    def _shutdown(self, client: T):
+        if self._close is None:
+            return
+
+        try:
+            self._close(client)
+        except Exception:
+            pass  # * Already unusable, there is nothing left to clean up
+
+    def clear(self):
+        """Close every client."""
+        with self._lock:
+            clients = [client for _, client in self._clients.values()]
+            self._clients.clear()
+
+        for client in clients:
+            self._shutdown(client)
+
+    def _forget(self):
+        # * The connections belong to the parent process, closing them here would close them under it too
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+
+def pooled_httpx(**kwargs) -> httpx.Client:
+    """Build an `httpx.Client` with a bounded pool of keep-alive connections, see `Clients`."""
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=Clients.MAX_CONNECTIONS,
+            max_keepalive_connections=Clients.MAX_KEEPALIVE,
+            keepalive_expiry=Clients.KEEPALIVE_EXPIRY,
+        ),
+        **kwargs,
+    )
+
+
+class SharedSession(requests.Session):
+    """A requests session shared by every thread of a process, with a bounded pool of connections.
+
+    The OpenAI library (which uses requests rather than httpx) closes the session of each thread every few minutes,
+    which would close this one under every other thread, so only its registry really closes it.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.mount(
+            "https://",
+            HTTPAdapter(pool_maxsize=Clients.MAX_CONNECTIONS, max_retries=2),
+        )
+
+    def close(self):
+        pass
+
+    def shutdown(self):
+        super().close()
+
+
+sessions: ClientRegistry[SharedSession] = ClientRegistry(close=SharedSession.shutdown)
+
+
+def openai_session() -> requests.Session:
+    """The session the OpenAI library sends requests with, set as `openai.requestssession`."""
+    return sessions.get("openai", SharedSession)
+
+
+def _forget_openai_session():
+    # * The OpenAI library keeps a session per thread, and the forking thread's is copied into the child
+    if (requestor := sys.modules.get("openai.api_requestor")) is not None:
+        requestor._thread_context = threading.local()
+
+
+os.register_at_fork(after_in_child=_forget_openai_session)
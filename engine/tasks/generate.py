@@ -1,12 +1,51 @@
-from langchain.chat_models import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
-from langchain.schema.messages import SystemMessage
-
+from typing import AsyncIterator
 
 from models import Model
+from .cache import prompt_cache
+from .scheduler import chat_model
+
+
+def _cache_key(prompt: str, system_message: str, model: Model, kwargs: dict) -> str:
+    return prompt_cache.key(
+        model=model.model,
+        temperature=model.temperature,
+        system_message=system_message,
+        prompt=prompt,
+        kwargs=kwargs,
+    )
 
 
-def prompt(prompt: str, system_message: str, model: Model, **kwargs) -> str:
+def _chat(prompt: str, system_message: str, model: Model, stage: str | None, kwargs: dict):
+    """Build the chat model, recording its usage under `stage`, and the messages to send it."""
+    # * Imported here, so processes that never prompt don't pay for loading langchain
+    from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
+    from langchain.schema.messages import SystemMessage
+
+    chat_template = ChatPromptTemplate.from_messages(
+        [
+            SystemMessage(content=system_message),
+            HumanMessagePromptTemplate.from_template("{text}"),
+        ]
+    )
+
+    llm = chat_model(
+        model=model.model,
+        temperature=model.temperature,
+        api_key=model.key,
+        stage=stage,
+    )
+
+    return llm, chat_template.format_messages(text=prompt, **kwargs)
+
+
+def prompt(
+    prompt: str,
+    system_message: str,
+    model: Model,
+    cache: str | None = None,
+    cache_sampled: bool = False,
+    **kwargs,
+) -> str:
     """
     The `prompt` function takes in a prompt, a system message, a model configuration, and an optional
     temperature value. It creates a chat template using the prompt and system message, and then uses the
@@ -25,21 +64,71 @@ def prompt(prompt: str, system_message: str, model: Model, **kwargs) -> str:
     generated text. A higher temperature value (e.g., 1.0) will result in more random and diverse
     responses, while a lower temperature value (e.g., 0.2) will produce more focused and deterministic
     responses. Defaults to 0
+      cache (str | None): The prompt type to cache the response as (e.g. "categories"), which also picks
+    its TTL and the stage its usage is recorded under. Responses are not cached if this is None. Defaults to None
+      cache_sampled (bool): Whether to cache the response even though the model's temperature is above 0,
+    i.e. when any one of its possible responses is good enough to reuse. Defaults to False
 
     Returns:
       The `prompt` function returns a string.
     """
-    chat_template = ChatPromptTemplate.from_messages(
-        [
-            SystemMessage(content=system_message),
-            HumanMessagePromptTemplate.from_template("{text}"),
-        ]
-    )
+    cacheable = cache is not None and (model.temperature == 0 or cache_sampled)
 
-    llm = ChatOpenAI(
-        model=model.model,
-        temperature=model.temperature,
-        api_key=model.key,
-    )
+    if cacheable:
+        key = _cache_key(prompt, system_message, model, kwargs)
+
+        if (cached := prompt_cache.get(cache, key)) is not None:
+            return cached
+
+    llm, messages = _chat(prompt, system_message, model, cache or "prompt", kwargs)
+    response = llm(messages).content
+
+    if cacheable:
+        prompt_cache.set(cache, key, response)
+
+    return response
+
+
+async def stream_prompt(
+    prompt: str,
+    system_message: str,
+    model: Model,
+    cache: str | None = None,
+    cache_sampled: bool = False,
+    **kwargs,
+) -> AsyncIterator[str]:
+    """
+    The `stream_prompt` function sends the same request as `prompt`, but yields the response in chunks as
+    it is generated, so the caller can start on the start of a long response before it has all arrived.
+
+    Args:
+      prompt (str): The message or question to ask the model.
+      system_message (str): The instructions given to the model before the prompt.
+      model (Model): The model to prompt, and its temperature.
+      cache (str | None): The prompt type to cache the complete response as, see `prompt`. A cached
+    response is yielded as a single chunk. Defaults to None
+      cache_sampled (bool): Whether to cache the response even though the model's temperature is above 0.
+    Defaults to False
+
+    Yields:
+      the response, a chunk of text at a time.
+    """
+    cacheable = cache is not None and (model.temperature == 0 or cache_sampled)
+
+    if cacheable:
+        key = _cache_key(prompt, system_message, model, kwargs)
+
+        if (cached := prompt_cache.get(cache, key)) is not None:
+            yield cached
+            return
+
+    llm, messages = _chat(prompt, system_message, model, cache or "prompt", kwargs)
+    chunks = []
+
+    async for chunk in llm.astream(messages):
+        chunks.append(chunk.content)
+        yield chunk.content
 
-    return llm(chat_template.format_messages(text=prompt, **kwargs)).content
+    # * Only cache responses that were streamed in full
+    if cacheable:
+        prompt_cache.set(cache, key, "".join(chunks))
@@ -0,0 +1,162 @@
+import json
+import re
+import threading
+
+from rich import print
+
+from config import Prompts
+from models import Model
+from . import generate
+
+DEFAULT_ICON = "📄"
+
+
+# A keycap emoji, e.g. 1️⃣ or #️⃣: a digit, '#' or '*', an optional variation selector, then the keycap mark
+KEYCAP = re.compile("[0-9#*]\ufe0f?\u20e3")
+
+
+def _is_emoji(value) -> bool:
+    # * Emojis can be several code points long (e.g. flags, skin tones), but never contain plain text, apart from
+    # * the digit of a keycap
+    return (
+        isinstance(value, str)
+        and 0 < len(value.strip()) <= 10
+        and not re.search(r"[A-Za-z0-9]", KEYCAP.sub("", value))
+    )
+
+
+def _parse_icons(response: str) -> dict[str, str]:
+    """Parse a title -> emoji JSON object out of an LLM response, ignoring anything around it."""
+    match = re.search(r"\{.*\}", response, re.DOTALL)
+    if not match:
+        return {}
+
+    try:
+        parsed = json.loads(match[0])
+    except json.JSONDecodeError:
+        return {}
+
+    if not isinstance(parsed, dict):
+        return {}
+
+    return {
+        title: icon.strip() for title, icon in parsed.items() if _is_emoji(icon)
+    }
+
+
+def _single_icon(title: str, model: Model) -> str:
+    try:
+        icon = generate.prompt(
+            prompt=title,
+            system_message=Prompts.icons_prompt,
+            model=model,
+            cache="icons",
+            cache_sampled=True,
+        ).strip()
+    except Exception as ex:
+        print(f"[red]Could not pick an icon for '{title}': {ex}[/red]")
+        return DEFAULT_ICON
+
+    return icon if _is_emoji(icon) else DEFAULT_ICON
+
+
+def generate_icons(
+    titles: list[str], model: Model, batch_size: int = 50
+) -> dict[str, str]:
+    """
+    The function `generate_icons` picks an emoji for every given title, asking for up to `batch_size`
+    titles in a single prompt. Titles missing from (or malformed in) a batched response fall back to a
+    prompt of their own.
+
+    Args:
+      titles (list[str]): The titles to pick icons for. Duplicates are only asked for once.
+      model (Model): The model used to pick the icons.
+      batch_size (int): The number of titles sent in a single prompt. Defaults to 50.
+
+    Returns:
+      a dictionary mapping every title to an emoji.
+    """
+    titles = list(dict.fromkeys(titles))
+    icons = {}
+
+    for i in range(0, len(titles), batch_size):
+        batch = titles[i : i + batch_size]
+
+        try:
+            parsed = _parse_icons(
+                generate.prompt(
+                    prompt=json.dumps(batch, ensure_ascii=False),
+                    system_message=Prompts.icons_batch_prompt,
+                    model=model,
+                    cache="icons",
+                    cache_sampled=True,
+                )
+            )
+        except Exception as ex:
+            print(f"[red]Batched icon prompt failed, falling back per title: {ex}[/red]")
+            parsed = {}
+
+        for title in batch:
+            icons[title] = parsed.get(title) or _single_icon(title, model)
+
+    return icons
+
+
+class PendingIcons:
+    """The icons of a page's headings, while they are being picked and the first headings are already published.
+
+    Headings published before the icons are picked get `DEFAULT_ICON`, and are patched with their own once the
+    icons are `resolve`d. Shared by the event loop and the threads publishing the page.
+    """
+
+    def __init__(self) -> None:
+        self._icons: dict[str, str] | None = None
+        self._placeholders: list[tuple[str, str]] = []  # (page ID, heading title) published with the default
+        self._lock = threading.Lock()
+
+    def get(self, title: str) -> str:
+        """The icon to publish a heading with now, the default one until the icons are picked."""
+        with self._lock:
+            return DEFAULT_ICON if self._icons is None else self._icons.get(title, DEFAULT_ICON)
+
+    def published(self, page_id: str, title: str, icon: str) -> str | None:
+        """
+        The function `published` records a page published with `icon`, so it can be patched once the icons
+        are picked.
+
+        Args:
+          page_id (str): The ID of the published page.
+          title (str): The title of the heading it was published for.
+          icon (str): The icon it was published with, see `get`.
+
+        Returns:
+          the icon to patch the page with straight away, if the icons were picked since `get`, otherwise None.
+        """
+        with self._lock:
+            if self._icons is None:
+                self._placeholders.append((page_id, title))
+                return None
+
+            picked = self._icons.get(title, DEFAULT_ICON)
+
+        return picked if picked != icon else None
+
+    def resolve(self, icons: dict[str, str]) -> list[tuple[str, str]]:
+        """
+        The function `resolve` sets the picked icons, for every heading published from now on.
+
+        Args:
+          icons (dict[str, str]): The icon of every heading, keyed by heading title.
+
+        Returns:
+          the ID of every page published with the default icon so far, and the icon to patch it with.
+        """
+        with self._lock:
+            self._icons = icons
+            placeholders, self._placeholders = self._placeholders, []
+
+        return [
+            (page_id, icons[title])
+            for page_id, title in placeholders
+            if icons.get(title, DEFAULT_ICON) != DEFAULT_ICON
+        ]
@@ -0,0 +1,261 @@
+"""
+A native replacement for the subset of https://github.com/tryfabric/martian we use, converting markdown into
+Notion blocks in-process rather than over the javascript bridge.
+
+Supported: headings, paragraphs, bulleted/numbered/to-do lists (nested), code blocks, quotes, tables, dividers,
+images, and inline bold/italic/strikethrough/code/links. Blocks are shaped like martian's output, so the two
+can be compared with `benchmarks/markdown_parity.py`.
+"""
+from markdown_it import MarkdownIt
+from markdown_it.tree import SyntaxTreeNode
+
+# The Notion API rejects text objects longer than this
+MAX_TEXT_LENGTH = 2000
+
+CODE_LANGUAGES = {
+    "abap", "arduino", "bash", "basic", "c", "clojure", "coffeescript", "c++", "c#", "css", "dart", "diff",
+    "docker", "elixir", "elm", "erlang", "flow", "fortran", "f#", "gherkin", "glsl", "go", "graphql", "groovy",
+    "haskell", "html", "java", "javascript", "json", "julia", "kotlin", "latex", "less", "lisp", "livescript",
+    "lua", "makefile", "markdown", "markup", "matlab", "mermaid", "nix", "objective-c", "ocaml", "pascal",
+    "perl", "php", "plain text", "powershell", "prolog", "protobuf", "python", "r", "reason", "ruby", "rust",
+    "sass", "scala", "scheme", "scss", "shell", "sql", "swift", "typescript", "vb.net", "verilog", "vhdl",
+    "visual basic", "webassembly", "xml", "yaml", "java/c/c++/c#",
+}  # fmt: skip
+
+CODE_ALIASES = {
+    "js": "javascript",
+    "jsx": "javascript",
+    "ts": "typescript",
+    "tsx": "typescript",
+    "py": "python",
+    "sh": "shell",
+    "zsh": "shell",
+    "console": "shell",
+    "yml": "yaml",
+    "md": "markdown",
+    "cpp": "c++",
+    "cs": "c#",
+    "csharp": "c#",
+    "rb": "ruby",
+    "rs": "rust",
+    "kt": "kotlin",
+    "dockerfile": "docker",
+    "text": "plain text",
+    "txt": "plain text",
+}
+
+_parser = MarkdownIt("commonmark").enable(["table", "strikethrough"])
+
+
+def _annotations(**overrides) -> dict:
+    annotations = {
+        "bold": False,
+        "strikethrough": False,
+        "underline": False,
+        "italic": False,
+        "code": False,
+        "color": "default",
+    }
+    annotations.update(overrides)
+    return annotations
+
+
+def _text(content: str, annotations: dict | None = None, url: str | None = None) -> list[dict]:
+    """Build the rich text objects for a run of text, split to fit the Notion length limit."""
+    rich_text = []
+
+    for i in range(0, len(content), MAX_TEXT_LENGTH):
+        text = {"content": content[i : i + MAX_TEXT_LENGTH]}
+        if url:
+            text["link"] = {"type": "url", "url": url}
+
+        rich_text.append(
+            {
+                "type": "text",
+                "annotations": dict(annotations or _annotations()),
+                "text": text,
+            }
+        )
+
+    return rich_text
+
+
+def _rich_text(
+    node: SyntaxTreeNode, annotations: dict | None = None, url: str | None = None
+) -> list[dict]:
+    """Flatten the inline children of a node into rich text, carrying the annotations of the parents down."""
+    annotations = annotations or _annotations()
+    rich_text = []
+
+    for child in node.children:
+        if child.type == "text":
+            rich_text += _text(child.content, annotations, url)
+        elif child.type == "code_inline":
+            rich_text += _text(child.content, {**annotations, "code": True}, url)
+        elif child.type in ("softbreak", "hardbreak"):
+            rich_text += _text("\n", annotations, url)
+        elif child.type == "strong":
+            rich_text += _rich_text(child, {**annotations, "bold": True}, url)
+        elif child.type == "em":
+            rich_text += _rich_text(child, {**annotations, "italic": True}, url)
+        elif child.type == "s":
+            rich_text += _rich_text(child, {**annotations, "strikethrough": True}, url)
+        elif child.type == "link":
+            rich_text += _rich_text(child, annotations, child.attrs.get("href"))
+        elif child.type == "html_inline":
+            rich_text += _text(child.content, annotations, url)
+        elif child.children:
+            # * Images are lifted into blocks of their own, anything else unknown keeps its text
+            if child.type != "image":
+                rich_text += _rich_text(child, annotations, url)
+
+    return rich_text
+
+
+def _inline(node: SyntaxTreeNode) -> SyntaxTreeNode | None:
+    return next((child for child in node.children if child.type == "inline"), None)
+
+
+def _images(node: SyntaxTreeNode) -> list[dict]:
+    images = []
+
+    for child in node.children:
+        if child.type == "image":
+            images.append(
+                {
+                    "object": "block",
+                    "type": "image",
+                    "image": {
+                        "type": "external",
+                        "external": {"url": child.attrs.get("src", "")},
+                    },
+                }
+            )
+        elif child.children:
+            images += _images(child)
+
+    return images
+
+
+def _block(block_type: str, **content) -> dict:
+    return {"object": "block", "type": block_type, block_type: content}
+
+
+def _language(info: str) -> str:
+    language = (info.split()[0] if info.strip() else "").lower()
+    language = CODE_ALIASES.get(language, language)
+    return language if language in CODE_LANGUAGES else "plain text"
+
+
+def _list_item(item: SyntaxTreeNode, list_type: str) -> dict:
+    first, *rest = item.children or [None]
+
+    rich_text, images = [], []
+    if first is not None and first.type == "paragraph":
+        inline = _inline(first)
+        rich_text, images = _rich_text(inline), _images(inline)
+    elif first is not None:
+        rest = [first, *rest]
+
+    content = {"rich_text": rich_text}
+
+    # * GFM task list items, e.g. '- [ ] Something to do'
+    if list_type == "bulleted_list_item" and rich_text:
+        marker = rich_text[0]["text"]["content"][:4]
+        if marker in ("[ ] ", "[x] ", "[X] "):
+            rich_text[0]["text"]["content"] = rich_text[0]["text"]["content"][4:]
+            list_type = "to_do"
+            content["checked"] = marker != "[ ] "
+
+    children = images + _blocks(rest)
+    if children:
+        content["children"] = children
+
+    return _block(list_type, **content)
+
+
+def _table(node: SyntaxTreeNode) -> dict:
+    rows = [row for part in node.children for row in part.children if row.type == "tr"]
+    width = max((len(row.children) for row in rows), default=0)
+
+    return _block(
+        "table",
+        table_width=width,
+        has_column_header=any(part.type == "thead" for part in node.children),
+        has_row_header=False,
+        children=[
+            _block(
+                "table_row",
+                cells=[
+                    _rich_text(_inline(cell)) if _inline(cell) else []
+                    for cell in row.children
+                ]
+                + [[]] * (width - len(row.children)),
+            )
+            for row in rows
+        ],
+    )
+
+
+def _blocks(nodes: list[SyntaxTreeNode]) -> list[dict]:
+    blocks = []
+
+    for node in nodes:
+        if node.type == "heading":
+            level = min(int(node.tag[1]), 3)
+            blocks.append(
+                _block(f"heading_{level}", rich_text=_rich_text(_inline(node)))
+            )
+        elif node.type == "paragraph":
+            inline = _inline(node)
+            rich_text = _rich_text(inline)
+
+            if any(text["text"]["content"].strip() for text in rich_text):
+                blocks.append(_block("paragraph", rich_text=rich_text))
+            blocks += _images(inline)
+        elif node.type == "bullet_list":
+            blocks += [_list_item(item, "bulleted_list_item") for item in node.children]
+        elif node.type == "ordered_list":
+            blocks += [_list_item(item, "numbered_list_item") for item in node.children]
+        elif node.type in ("fence", "code_block"):
+            blocks.append(
+                _block(
+                    "code",
+                    rich_text=_text(node.content.removesuffix("\n")),
+                    language=_language(node.info if node.type == "fence" else ""),
+                )
+            )
+        elif node.type == "blockquote":
+            first, *rest = node.children or [None]
+            rich_text = []
+
+            if first is not None and first.type == "paragraph":
+                rich_text = _rich_text(_inline(first))
+            elif first is not None:
+                rest = [first, *rest]
+
+            content = {"rich_text": rich_text}
+            if children := _blocks(rest):
+                content["children"] = children
+
+            blocks.append(_block("quote", **content))
+        elif node.type == "table":
+            blocks.append(_table(node))
+        elif node.type == "hr":
+            blocks.append(_block("divider"))
+        # * Anything else (e.g. html blocks) is not inline content, and is ignored like martian's 'nonInline: ignore'
+
+    return blocks
+
+
+def markdown_to_blocks(markdown: str) -> list[dict]:
+    """
+    The function `markdown_to_blocks` converts a markdown string into a list of Notion blocks.
+
+    Args:
+      markdown (str): The markdown string
+
+    Returns:
+      a list of Notion blocks, in the order they appear in the markdown.
+    """
+    return _blocks(SyntaxTreeNode(_parser.parse(markdown)).children)
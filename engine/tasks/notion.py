@@ -1,19 +1,248 @@
 import re
+import time
 import random
+import json
+import threading
+from difflib import SequenceMatcher
+from typing import Callable
+from dictdiffer import diff
 from notion_client import Client
-from javascript import require
+from notion_client.errors import (
+    APIErrorCode,
+    APIResponseError,
+    HTTPResponseError,
+    RequestTimeoutError,
+)
 
+from config import NotionLimits, NotionSchema, Markdown
+from config.redis import redis_client
 from exceptions.notion import MalformedDatabaseException
+from metrics import NOTION_REQUEST_SECONDS, NOTION_REQUESTS
+from .clients import ClientRegistry, pooled_httpx
+from .markdown import markdown_to_blocks
+from .ratelimit import TokenBucket, get_bucket, backoff, hash_key
 
-# * Martian is an external JS package built to convert markdown/text into notion blocks
-# https://github.com/tryfabric/martian
-# * We have to use an awesome javascript bridge to use this package as there is no python bindings
-martian = require("@tryfabric/martian")
+_martian = None
+
+
+def martian():
+    """
+    Martian is an external JS package built to convert markdown/text into notion blocks
+    https://github.com/tryfabric/martian
+
+    We have to use an awesome javascript bridge to use this package as there is no python bindings, so it is
+    only started the first time it is needed. It is used when `Markdown.CONVERTER` is "martian", and to check
+    the native converter against it.
+    """
+    global _martian
+
+    if _martian is None:
+        from javascript import require
+
+        _martian = require("@tryfabric/martian")
+
+    return _martian
+
+# The Notion API accepts at most 100 children per request
+MAX_CHILDREN = 100
+
+
+def chunk_blocks(blocks: list, size: int = MAX_CHILDREN) -> list[list]:
+    """Split a list of blocks into lists of at most `size` blocks."""
+    return [blocks[i : i + size] for i in range(0, len(blocks), size)]
+
+
+def _fingerprint(block: dict) -> str:
+    return json.dumps(block, sort_keys=True)
+
+
+def _updatable(old: dict, new: dict) -> bool:
+    """Whether `old` can be turned into `new` by updating it in place, i.e. only the content of its type changed."""
+    kind = new["type"]
+    if old["type"] != kind or "children" in old[kind] or "children" in new[kind]:
+        return False
+
+    # * Paths are dotted strings, or lists when a key contains a dot
+    paths = [path.split(".") if isinstance(path, str) else path for _, path, _ in diff(old, new)]
+    return all(path and path[0] == kind for path in paths)
+
+
+# Server errors worth retrying, 429s are always retried
+RETRYABLE_STATUSES = {500, 502, 503, 504}
+
+ID_PATTERN = re.compile(r"^[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{12}$", re.IGNORECASE)
+
+
+def endpoint_name(method: str, path: str) -> str:
+    """The endpoint of a request, without the IDs in its path, e.g. "PATCH blocks/{id}/children"."""
+    parts = ["{id}" if ID_PATTERN.match(part) else part for part in path.split("/")]
+    return f"{method} {'/'.join(parts)}"
+
+
+class ThrottledClient(Client):
+    """A Notion client that takes a token from a shared bucket before every request.
+
+    Rate limited requests are retried after their `Retry-After` delay, which also pauses every other client
+    sharing the bucket. Server errors and timeouts are retried with exponential backoff, but only for reads,
+    as retrying a write that may have gone through could duplicate content.
+    """
+
+    def __init__(self, auth: str, bucket: TokenBucket, **kwargs) -> None:
+        super().__init__(auth=auth, **kwargs)
+        self.bucket = bucket
+
+    def request(self, path: str, method: str, query=None, body=None, auth=None):
+        for attempt in range(NotionLimits.MAX_RETRIES + 1):
+            self.bucket.acquire()
+
+            try:
+                return self._send(path, method, query=query, body=body, auth=auth)
+            except HTTPResponseError as ex:
+                # * Also catches errors without a JSON body from Notion (e.g. a 502 from a proxy in front of it)
+                if ex.status == 429:
+                    delay = self._retry_after(ex) or backoff(attempt)
+                    self.bucket.pause(delay)
+                    self.bucket.record_throttle()
+                elif ex.status in RETRYABLE_STATUSES and method == "GET":
+                    delay = backoff(attempt)
+                else:
+                    raise
+
+                if attempt == NotionLimits.MAX_RETRIES:
+                    raise
+            except RequestTimeoutError:
+                if method != "GET" or attempt == NotionLimits.MAX_RETRIES:
+                    raise
+                delay = backoff(attempt)
+
+            self.bucket.record_retry()
+            time.sleep(delay)
+
+    def _send(self, path: str, method: str, **kwargs):
+        """Send a single attempt at a request, recording its time and response status."""
+        endpoint = endpoint_name(method, path)
+        status = "error"
+        start = time.monotonic()
+
+        try:
+            response = super().request(path, method, **kwargs)
+            status = "200"  # * Every successful Notion response is a 200
+            return response
+        except HTTPResponseError as ex:
+            status = str(ex.status)
+            raise
+        except RequestTimeoutError:
+            status = "timeout"
+            raise
+        finally:
+            NOTION_REQUEST_SECONDS.labels(endpoint).observe(time.monotonic() - start)
+            NOTION_REQUESTS.labels(endpoint, status).inc()
+
+    def _retry_after(self, ex: HTTPResponseError) -> float | None:
+        try:
+            return float(ex.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            return None
+
+
+_clients: ClientRegistry[ThrottledClient] = ClientRegistry(close=ThrottledClient.close)
+
+
+def shared_client(secret: str) -> ThrottledClient:
+    """Return the process-wide client for an integration secret, with its own pool of connections."""
+    return _clients.get(
+        hash_key(secret),
+        lambda: ThrottledClient(secret, get_bucket(secret), client=pooled_httpx()),
+    )
+
+
+# Database objects by database ID, with the time they were read
+_schemas: dict[str, tuple[float, dict]] = {}
+_schemas_lock = threading.Lock()
+
+
+def _cache_schema(database_id: str, database: dict) -> dict:
+    with _schemas_lock:
+        _schemas[database_id] = (time.monotonic(), database)
+
+    return database
+
+
+def invalidate_schema(database_id: str | None = None):
+    """Drop the cached schema of a database, or of every database if `database_id` is None."""
+    with _schemas_lock:
+        if database_id is None:
+            _schemas.clear()
+        else:
+            _schemas.pop(database_id, None)
+
+
+class BlockWriter:
+    """Buffers blocks appended to a single parent, and writes them in as few requests as possible.
+
+    Blocks are only sent when `flush` is called (or the writer is closed), so callers must flush before
+    doing anything that depends on the blocks already being on the page, e.g. creating a subpage that should
+    appear after them.
+    """
+
+    def __init__(self, wiki: "NotionWiki", parent_id: str) -> None:
+        self._wiki = wiki
+        self._parent_id = parent_id
+        self._buffer = []
+        self._appended = 0  # Blocks appended since the writer was opened
+        self._written = 0  # Blocks written to the parent since the writer was opened
+        self._on_written = []  # Callbacks, with the number of blocks that must be written before they're called
+
+    def append(self, blocks: list, on_written: Callable[[], None] | None = None):
+        """
+        Add blocks to the end of the buffer.
+
+        Args:
+          blocks (list): The blocks to append.
+          on_written (Callable[[], None] | None): Called once every one of the blocks has been written.
+        """
+        self._buffer.extend(blocks)
+        self._appended += len(blocks)
+
+        if on_written is not None:
+            self._on_written.append((self._appended, on_written))
+
+    def flush(self):
+        """Write every buffered block to the parent, in appends of up to `MAX_CHILDREN` blocks."""
+        while self._buffer:
+            batch = self._buffer[:MAX_CHILDREN]
+            self._wiki.notion.blocks.children.append(self._parent_id, children=batch)
+            # * Only drop the batch once it is written, so a failed flush can be retried
+            del self._buffer[: len(batch)]
+            self._written += len(batch)
+            self._notify()
+
+        self._notify()
+
+    def _notify(self):
+        while self._on_written and self._on_written[0][0] <= self._written:
+            self._on_written.pop(0)[1]()
+
+    def __enter__(self) -> "BlockWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.flush()
+        except Exception:
+            # * Don't hide the original error behind a failed flush
+            if exc_type is None:
+                raise
 
 
 class NotionWiki:
     def __init__(self, api_secret: str) -> None:
-        self.notion = Client(auth=api_secret)
+        self._secret = api_secret
+
+    @property
+    def notion(self) -> ThrottledClient:
+        # * Fetched for every request, so a client is only closed as idle once no page is using it
+        return shared_client(self._secret)
 
     def md_to_blocks(self, markdown: str):
         """Parse a markdown text string into valid Notion Blocks/JSON API text
@@ -24,9 +253,12 @@ class NotionWiki:
         Returns:
             list[any]: The parsed MD text in JSON format
         """
-        return martian.markdownToBlocks(
-            markdown, {"nonInline": "ignore", "strictImageUrls": False}
-        ).valueOf()
+        if Markdown.CONVERTER == "martian":
+            return martian().markdownToBlocks(
+                markdown, {"nonInline": "ignore", "strictImageUrls": False}
+            ).valueOf()
+
+        return markdown_to_blocks(markdown)
 
     def split_url(self, url: str):
         """
@@ -44,7 +276,7 @@ class NotionWiki:
         matches = re.search(r"\/(\w+)\?v=", url)
         return matches[1] if matches else None
 
-    def write(self, page_id: str, blocks: list):
+    def write(self, page_id: str, blocks: list, after: str | None = None) -> list[str]:
         """
         The function `write_to_page` appends a list of blocks to a Notion page with a given page ID.
 
@@ -53,8 +285,46 @@ class NotionWiki:
         where you want to write the blocks to. This ID is typically a unique identifier for the page.
           blocks (list): The `blocks` parameter is a list of blocks that you want to write to a Notion page.
         Each block in the list represents a different type of content that you want to add to the page.
+          after (str | None): The ID of a block on the page to write the blocks after, rather than at the end.
+
+        Returns:
+          the IDs of the written blocks, in order.
+        """
+        ids = []
+        for batch in chunk_blocks(blocks):
+            anchor = ids[-1] if ids else after
+            kwargs = {"after": anchor} if anchor else {}
+            results = self.notion.blocks.children.append(page_id, children=batch, **kwargs)["results"]
+
+            # * Older API versions list the page's other children too, so find the new ones among them
+            if anchor and len(results) > len(batch):
+                start = next(i + 1 for i, block in enumerate(results) if block["id"] == anchor)
+                results = results[start : start + len(batch)]
+            ids.extend(block["id"] for block in results[-len(batch) :])
+
+        return ids
+
+    def delete_blocks(self, block_ids: list[str]):
+        """Delete blocks by ID, skipping any that are already gone (e.g. deleted by hand)."""
+        for block_id in block_ids:
+            try:
+                self.notion.blocks.delete(block_id)
+            except APIResponseError as ex:
+                if ex.code != APIErrorCode.ObjectNotFound:
+                    raise
+
+    def writer(self, page_id: str) -> BlockWriter:
         """
-        self.notion.blocks.children.append(page_id, children=blocks)
+        The function `writer` returns a buffered writer for a page. Consecutive writes to the page are
+        combined into as few `blocks.children.append` requests as possible.
+
+        Args:
+          page_id (str): The ID of the page (or block) the blocks are appended to.
+
+        Returns:
+          a `BlockWriter` for the page.
+        """
+        return BlockWriter(self, page_id)
 
     def update_status(self, page: str, status: str):
         """
@@ -76,6 +346,10 @@ class NotionWiki:
             },
         )
 
+    def update_icon(self, page: str, icon: str):
+        """Replace the emoji icon of a page, e.g. one published before its icon was picked."""
+        self.notion.pages.update(page, icon={"type": "emoji", "emoji": icon})
+
     def create_primary_page(
         self, database: str, title: str, category: str, icon: str
     ) -> str:
@@ -159,12 +433,40 @@ class NotionWiki:
             },
         }
 
-        if content:
-            payload["children"] = content
+        batches = chunk_blocks(content or [])
+        if batches:
+            payload["children"] = batches[0]
 
-        return self.notion.pages.create(**payload)["id"]
+        page_id = self.notion.pages.create(**payload)["id"]
+
+        # * Anything over the children limit has to be appended after the page exists
+        for batch in batches[1:]:
+            self.notion.blocks.children.append(page_id, children=batch)
 
-    def get_categories(self, database_id: str) -> list[str]:
+        return page_id
+
+    def get_database(self, database_id: str, refresh: bool = False) -> dict:
+        """
+        The function `get_database` retrieves a Notion database, reusing a copy read in the last
+        `NotionSchema.TTL` seconds by any job in this process.
+
+        Args:
+          database_id (str): The ID of the Notion database.
+          refresh (bool): Always read the database from Notion, and cache the fresh copy.
+
+        Returns:
+          the database object, as returned by `notion.databases.retrieve()`.
+        """
+        if not refresh:
+            with _schemas_lock:
+                cached = _schemas.get(database_id)
+
+            if cached is not None and time.monotonic() - cached[0] < NotionSchema.TTL:
+                return cached[1]
+
+        return _cache_schema(database_id, self.notion.databases.retrieve(database_id))
+
+    def get_categories(self, database_id: str, refresh: bool = False) -> list[dict]:
         """
         The function `get_categories` retrieves the list of options for the "Category" property of a Notion
         database.
@@ -173,15 +475,16 @@ class NotionWiki:
           database_id (str): The `database_id` parameter is a string that represents the ID of the Notion
         database. This ID is unique to each database and can be found in the URL of the Notion page when you
         are viewing the database.
+          refresh (bool): Read the options from Notion, rather than from the cached schema.
 
         Returns:
-          a list of strings, which represents the options available for the "Category" property in a Notion
-        database.
+          a list of the options available for the "Category" property in a Notion database, each with a
+        "name" and "color".
         """
         try:
-            return self.notion.databases.retrieve(database_id)["properties"][
-                "Category"
-            ]["select"]["options"]
+            return self.get_database(database_id, refresh)["properties"]["Category"][
+                "select"
+            ]["options"]
         except KeyError as e:
             raise MalformedDatabaseException(
                 "Could not access Category properties, ensure the Notion page is correct schema."
@@ -221,21 +524,148 @@ class NotionWiki:
         want to create.
 
         Returns:
-          the result of the `notion.databases.update()` method.
+          the updated database object, or the current one if the category already exists.
         """
-        existing_categories = self.get_categories(database_id)
+        # * Updating the options replaces them all, so concurrent jobs must not update them from stale copies
+        with redis_client.lock(
+            f"notion:category-lock:{database_id}",
+            timeout=NotionSchema.LOCK_TIMEOUT,
+            blocking_timeout=NotionSchema.LOCK_WAIT,
+        ):
+            existing_categories = self.get_categories(database_id, refresh=True)
 
-        return self.notion.databases.update(
-            database_id,
-            properties={
-                "Category": {
-                    "type": "select",
-                    "select": {
-                        "options": [
-                            *existing_categories,  # ? We need to pass the existing categories, as this request would wipe them without them
-                            {"name": category, "color": self._random_colour()},
-                        ],
+            # * Another job may have created it since our copy of the schema was read
+            if category in [cat["name"] for cat in existing_categories]:
+                return self.get_database(database_id)
+
+            try:
+                database = self.notion.databases.update(
+                    database_id,
+                    properties={
+                        "Category": {
+                            "type": "select",
+                            "select": {
+                                "options": [
+                                    *existing_categories,  # ? We need to pass the existing categories, as this request would wipe them without them
+                                    {"name": category, "color": self._random_colour()},
+                                ],
+                            },
+                        },
                     },
-                },
-            },
+                )
+            except Exception:
+                invalidate_schema(database_id)
+                raise
+
+            return _cache_schema(database_id, database)
+
+    def list_children(self, block_id: str) -> list[dict]:
+        """Return every child block of a block (or page), reading every page of results."""
+        children = []
+        cursor = None
+
+        while True:
+            response = self.notion.blocks.children.list(
+                block_id, page_size=MAX_CHILDREN, **({"start_cursor": cursor} if cursor else {})
+            )
+            children.extend(response["results"])
+
+            if not response.get("has_more"):
+                return children
+            cursor = response["next_cursor"]
+
+    def _plan_sync(self, old: list[dict], new: list[dict]) -> list[tuple] | None:
+        """
+        The function `_plan_sync` works out the fewest block changes that turn `old` into `new`: unchanged
+        blocks are kept, blocks whose content changed are updated in place, and any others are deleted or
+        inserted.
+
+        Returns:
+          the changes, in page order, as ("keep", i), ("update", i, block), ("delete", i) or ("insert", block),
+        where `i` is the position of a block in `old`. None if the changes can't be made in place, as Notion can
+        only insert blocks after another block.
+        """
+        matcher = SequenceMatcher(
+            None, [_fingerprint(b) for b in old], [_fingerprint(b) for b in new], autojunk=False
         )
+        plan = []
+
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                plan.extend(("keep", i) for i in range(i1, i2))
+                continue
+
+            removed, added = list(range(i1, i2)), new[j1:j2]
+            # * Pair up changed blocks, so a block that was only reworded is updated rather than replaced
+            while removed and added and _updatable(old[removed[0]], added[0]):
+                plan.append(("update", removed.pop(0), added.pop(0)))
+
+            plan.extend(("delete", i) for i in removed)
+            plan.extend(("insert", block) for block in added)
+
+        anchored = [i for i, change in enumerate(plan) if change[0] in ("keep", "update")]
+        first_insert = next((i for i, change in enumerate(plan) if change[0] == "insert"), None)
+        if anchored and first_insert is not None and first_insert < anchored[0]:
+            return None
+
+        return plan
+
+    def sync_blocks(self, parent_id: str, old: list[dict], new: list[dict]) -> dict[str, int]:
+        """
+        The function `sync_blocks` replaces the children of a block (or page) with new blocks, only writing
+        the blocks that differ from the ones it already has.
+
+        Args:
+          parent_id (str): The ID of the block or page.
+          old (list[dict]): The blocks last written to the parent, in order.
+          new (list[dict]): The blocks the parent should have, in order.
+
+        Returns:
+          the number of blocks kept, updated, deleted and inserted.
+        """
+        children = self.list_children(parent_id)
+        counts = {"kept": 0, "updated": 0, "deleted": 0, "inserted": 0}
+
+        # * Blocks edited by hand since they were written can't be matched up, so are all replaced
+        plan = self._plan_sync(old, new) if len(children) == len(old) else None
+        if plan is None:
+            for child in children:
+                self.notion.blocks.delete(child["id"])
+            self.write(parent_id, new)
+            return {**counts, "deleted": len(children), "inserted": len(new)}
+
+        ids = [child["id"] for child in children]
+        after = None  # The last block written, in the new order
+        pending = []  # Blocks to insert after `after`
+
+        def insert():
+            nonlocal after
+            for batch in chunk_blocks(pending):
+                results = self.notion.blocks.children.append(
+                    parent_id, children=batch, **({"after": after} if after else {})
+                )["results"]
+                after = results[-1]["id"]
+            counts["inserted"] += len(pending)
+            pending.clear()
+
+        for change in plan:
+            if change[0] == "insert":
+                pending.append(change[1])
+                continue
+
+            insert()
+            if change[0] == "delete":
+                self.notion.blocks.delete(ids[change[1]])
+                counts["deleted"] += 1
+            elif change[0] == "update":
+                block = change[2]
+                self.notion.blocks.update(ids[change[1]], **{block["type"]: block[block["type"]]})
+                after = ids[change[1]]
+                counts["updated"] += 1
+            else:
+                after = ids[change[1]]
+                counts["kept"] += 1
+
+        insert()
+
+        return counts
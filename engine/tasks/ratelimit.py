@@ -0,0 +1,219 @@
+import time
+import random
+import hashlib
+import threading
+from dataclasses import dataclass, field, asdict
+
+from config import NotionLimits
+from config.redis import redis_client
+
+# * Returns the seconds to wait as a string, as Redis truncates Lua numbers to integers
+REDIS_ACQUIRE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+-- A cost above the capacity could never be met, so it only has to wait for a full bucket
+local cost = math.min(tonumber(ARGV[3] or '1'), capacity)
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated', 'paused_until')
+
+local paused_until = tonumber(bucket[3]) or 0
+if paused_until > now then
+    return tostring(paused_until - now)
+end
+
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * rate)
+
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], 60)
+return tostring(wait)
+"""
+
+# * Charges (or refunds, if negative) tokens once the real cost of a request is known
+REDIS_ADJUST_SCRIPT = """
+local capacity = tonumber(ARGV[2])
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens')) or capacity
+tokens = math.min(capacity, tokens - tonumber(ARGV[1]))
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens))
+redis.call('EXPIRE', KEYS[1], 60)
+return tostring(tokens)
+"""
+
+REDIS_PAUSE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+
+local until_ = now + tonumber(ARGV[1])
+local current = tonumber(redis.call('HGET', KEYS[1], 'paused_until')) or 0
+
+if until_ > current then
+    redis.call('HSET', KEYS[1], 'paused_until', tostring(until_))
+    redis.call('EXPIRE', KEYS[1], 60 + math.ceil(tonumber(ARGV[1])))
+end
+return 1
+"""
+
+
+@dataclass
+class LimiterStats:
+    acquired: int = field(default=0)  # Number of requests let through
+    waited: int = field(default=0)  # Number of requests that had to wait for a token
+    total_wait: float = field(default=0)  # Seconds spent waiting for tokens, across all requests
+    max_wait: float = field(default=0)  # Longest single wait for a token
+    throttled: int = field(default=0)  # Number of 429 responses
+    retries: int = field(default=0)  # Number of retried requests
+
+    def record_wait(self, seconds: float):
+        self.acquired += 1
+        if seconds > 0:
+            self.waited += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+
+
+class TokenBucket:
+    """A thread-safe token bucket, shared by every job in this process that uses the same key."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+        self.stats = LimiterStats()
+
+    def _reserve(self, cost: float = 1) -> float:
+        """Take `cost` tokens, returning the number of seconds the caller must wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self._capacity, self._tokens + (now - self._updated) * self._rate
+            )
+            self._updated = now
+
+            # * Going negative reserves a future token, so waiting callers are served in order
+            self._tokens -= cost
+            wait = max(0, -self._tokens / self._rate)
+
+            return max(wait, self._paused_until - now)
+
+    def acquire(self, cost: float = 1) -> float:
+        """Block until a request costing `cost` tokens may be sent. Returns the number of seconds waited."""
+        wait = self._reserve(cost)
+        if wait > 0:
+            time.sleep(wait)
+
+        with self._lock:
+            self.stats.record_wait(wait)
+        return wait
+
+    def adjust(self, tokens: float):
+        """Take `tokens` more (or give them back, if negative), once the real cost of a request is known."""
+        with self._lock:
+            self._tokens = min(self._capacity, self._tokens - tokens)
+
+    def record_throttle(self):
+        with self._lock:
+            self.stats.throttled += 1
+
+    def record_retry(self):
+        with self._lock:
+            self.stats.retries += 1
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for `seconds`, e.g. after a 429 with a Retry-After header."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class RedisTokenBucket(TokenBucket):
+    """A token bucket stored in Redis, shared by every worker that uses the same key."""
+
+    def __init__(self, key: str, rate: float, capacity: float) -> None:
+        super().__init__(rate, capacity)
+        self._key = f"ratelimit:{key}"
+        self._acquire = redis_client.register_script(REDIS_ACQUIRE_SCRIPT)
+        self._pause = redis_client.register_script(REDIS_PAUSE_SCRIPT)
+        self._adjust = redis_client.register_script(REDIS_ADJUST_SCRIPT)
+
+    def acquire(self, cost: float = 1) -> float:
+        waited = 0
+        while True:
+            wait = float(
+                self._acquire(
+                    keys=[self._key], args=[self._rate, self._capacity, cost]
+                )
+            )
+            if wait <= 0:
+                break
+
+            time.sleep(wait)
+            waited += wait
+
+        with self._lock:
+            self.stats.record_wait(waited)
+        return waited
+
+    def adjust(self, tokens: float):
+        self._adjust(keys=[self._key], args=[tokens, self._capacity])
+
+    def pause(self, seconds: float):
+        self._pause(keys=[self._key], args=[seconds])
+
+
+_buckets: dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def hash_key(secret: str) -> str:
+    # * Never keep the secret itself around as a key, in memory or in Redis
+    return hashlib.sha256(secret.encode()).hexdigest()[:16]
+
+
+def get_bucket(secret: str) -> TokenBucket:
+    """
+    The function `get_bucket` returns the token bucket for an integration secret, creating it on first
+    use. Every client in this process using the same secret shares one bucket.
+
+    Args:
+      secret (str): The Notion integration secret.
+
+    Returns:
+      a `RedisTokenBucket` if `NotionLimits.BACKEND` is "redis", otherwise a `TokenBucket`.
+    """
+    key = hash_key(secret)
+
+    with _buckets_lock:
+        if key not in _buckets:
+            if NotionLimits.BACKEND == "redis":
+                _buckets[key] = RedisTokenBucket(
+                    f"notion:{key}", NotionLimits.RATE, NotionLimits.BURST
+                )
+            else:
+                _buckets[key] = TokenBucket(NotionLimits.RATE, NotionLimits.BURST)
+
+        return _buckets[key]
+
+
+def limiter_stats() -> dict[str, dict]:
+    """Return the queue-wait statistics of every bucket in this process, keyed by hashed secret."""
+    with _buckets_lock:
+        return {key: asdict(bucket.stats) for key, bucket in _buckets.items()}
+
+
+def backoff(attempt: int) -> float:
+    """The jittered exponential backoff delay for a retry, capped at `NotionLimits.BACKOFF_MAX` seconds."""
+    delay = min(NotionLimits.BACKOFF_MAX, NotionLimits.BACKOFF_BASE * 2**attempt)
+    return delay * random.uniform(0.5, 1)
@@ -0,0 +1,511 @@
+"""
+Schedules requests to the OpenAI API per API key, so every job (and writer process) using the same key shares one
+budget, rather than each job firing requests at a fixed concurrency of its own.
+
+A request is admitted once there is a free concurrency slot for its key, and the key's requests-per-minute and
+tokens-per-minute buckets have room for it. The concurrency of each key adapts (AIMD): it grows by one slot for
+every window of successful requests, and is cut by `OpenAILimits.DECREASE` after a 429 or a slow response.
+
+Requests are scheduled by `ScheduledChatCompletion`, which stands in for `openai.ChatCompletion` as the client of
+the chat models built by `chat_model`, so it covers every call langchain makes, including those made by agents.
+"""
+import time
+import json
+import uuid
+import random
+import asyncio
+import threading
+from dataclasses import dataclass, field, asdict
+
+from config import OpenAILimits
+from config.redis import redis_client
+from metrics import LLM_REQUEST_SECONDS, LLM_TOKENS
+from .clients import ClientRegistry, openai_session
+from .ratelimit import TokenBucket, RedisTokenBucket, hash_key
+from .usage import LLMCall, usage_ledger, current_scope
+
+# Roughly how many characters make up a token of English text, for estimating requests without a tokenizer
+CHARS_PER_TOKEN = 4
+
+# * Takes a slot if fewer than the current limit are held, dropping slots whose holders never released them
+REDIS_ACQUIRE_SLOT_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local limit = tonumber(redis.call('HGET', KEYS[2], 'limit')) or tonumber(ARGV[3])
+
+if redis.call('ZCARD', KEYS[1]) < math.floor(limit) then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[1])
+    redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[2])))
+    return 1
+end
+return 0
+"""
+
+# * Frees a slot, and applies the additive increase / multiplicative decrease to the limit of the key
+REDIS_RELEASE_SLOT_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+
+local limit = tonumber(redis.call('HGET', KEYS[2], 'limit')) or tonumber(ARGV[3])
+if ARGV[2] == 'congested' then
+    limit = math.max(tonumber(ARGV[4]), limit * tonumber(ARGV[6]))
+elseif ARGV[2] == 'ok' then
+    limit = math.min(tonumber(ARGV[5]), limit + 1 / limit)
+end
+
+redis.call('HSET', KEYS[2], 'limit', tostring(limit))
+redis.call('EXPIRE', KEYS[2], 3600)
+return tostring(limit)
+"""
+
+
+def estimate_tokens(
+    messages: list[dict], functions: list[dict] | None = None, max_tokens: int | None = None
+) -> int:
+    """
+    The function `estimate_tokens` estimates the number of tokens a chat completion request will use, before
+    it is sent.
+
+    Args:
+      messages (list[dict]): The messages of the request.
+      functions (list[dict] | None): The functions (tools) offered to the model, which count towards the prompt.
+      max_tokens (int | None): The most tokens the response may use, or None to assume a response of
+    `OpenAILimits.EXPECTED_OUTPUT_TOKENS` tokens.
+
+    Returns:
+      the estimated number of prompt and response tokens.
+    """
+    prompt = len(json.dumps(messages)) + len(json.dumps(functions or []))
+    return prompt // CHARS_PER_TOKEN + (max_tokens or OpenAILimits.EXPECTED_OUTPUT_TOKENS)
+
+
+def next_limit(limit: float, congested: bool | None) -> float:
+    """The concurrency limit after a request finishes. A `congested` of None (e.g. a failed request) keeps it."""
+    if congested is None:
+        return limit
+    if congested:
+        return max(OpenAILimits.MIN_CONCURRENCY, limit * OpenAILimits.DECREASE)
+
+    return min(OpenAILimits.MAX_CONCURRENCY, limit + 1 / limit)
+
+
+class AdaptiveLimit:
+    """A concurrency limit for the requests of one key, shared by every thread in this process."""
+
+    def __init__(self, initial: float = OpenAILimits.INITIAL_CONCURRENCY) -> None:
+        self.limit = initial
+        self._active = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> str:
+        """Block until a slot is free, returning the ID of the slot taken."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._active < int(self.limit))
+            self._active += 1
+
+        return uuid.uuid4().hex
+
+    def release(self, slot: str, congested: bool | None) -> float:
+        """Free a slot, adapting the limit to how its request went. Returns the new limit."""
+        with self._condition:
+            self._active -= 1
+            self.limit = next_limit(self.limit, congested)
+            self._condition.notify_all()
+
+            return self.limit
+
+
+class RedisAdaptiveLimit(AdaptiveLimit):
+    """A concurrency limit stored in Redis, shared by every process that uses the same key."""
+
+    def __init__(self, key: str, initial: float = OpenAILimits.INITIAL_CONCURRENCY) -> None:
+        super().__init__(initial)
+        self._keys = [f"{key}:slots", f"{key}:limit"]
+        self._acquire = redis_client.register_script(REDIS_ACQUIRE_SLOT_SCRIPT)
+        self._release = redis_client.register_script(REDIS_RELEASE_SLOT_SCRIPT)
+
+    def acquire(self) -> str:
+        slot = uuid.uuid4().hex
+
+        while not self._acquire(
+            keys=self._keys,
+            args=[slot, OpenAILimits.SLOT_LEASE, OpenAILimits.INITIAL_CONCURRENCY],
+        ):
+            time.sleep(random.uniform(0.05, 0.2))
+
+        return slot
+
+    def release(self, slot: str, congested: bool | None) -> float:
+        outcome = {None: "unchanged", True: "congested", False: "ok"}[congested]
+
+        self.limit = float(
+            self._release(
+                keys=self._keys,
+                args=[
+                    slot,
+                    outcome,
+                    OpenAILimits.INITIAL_CONCURRENCY,
+                    OpenAILimits.MIN_CONCURRENCY,
+                    OpenAILimits.MAX_CONCURRENCY,
+                    OpenAILimits.DECREASE,
+                ],
+            )
+        )
+        return self.limit
+
+
+@dataclass
+class SchedulerStats:
+    admitted: int = field(default=0)  # Number of requests let through
+    throttled: int = field(default=0)  # Number of 429 responses
+    slow: int = field(default=0)  # Number of responses slower than `OpenAILimits.LATENCY_TARGET`
+    total_wait: float = field(default=0)  # Seconds requests spent waiting to be admitted
+    limit: float = field(default=0)  # The current concurrency limit
+
+
+@dataclass
+class Ticket:
+    slot: str
+    cost: int  # The estimated tokens the request was admitted with
+    admitted: float = field(default_factory=time.monotonic)
+
+
+class KeyScheduler:
+    """Admits the requests of one API key against its concurrency limit and per-minute budgets."""
+
+    def __init__(self, key: str) -> None:
+        if OpenAILimits.BACKEND == "redis":
+            self.requests = RedisTokenBucket(
+                f"openai:{key}:rpm", OpenAILimits.RPM / 60, OpenAILimits.RPM
+            )
+            self.tokens = RedisTokenBucket(
+                f"openai:{key}:tpm", OpenAILimits.TPM / 60, OpenAILimits.TPM
+            )
+            self.concurrency = RedisAdaptiveLimit(f"openai:{key}")
+        else:
+            self.requests = TokenBucket(OpenAILimits.RPM / 60, OpenAILimits.RPM)
+            self.tokens = TokenBucket(OpenAILimits.TPM / 60, OpenAILimits.TPM)
+            self.concurrency = AdaptiveLimit()
+
+        self._lock = threading.Lock()
+        self.stats = SchedulerStats(limit=self.concurrency.limit)
+
+    def acquire(self, cost: int) -> Ticket:
+        """Block until a request estimated to use `cost` tokens may be sent."""
+        started = time.monotonic()
+
+        # * Take the slot first, so requests waiting on the budgets can't pile up beyond the limit
+        slot = self.concurrency.acquire()
+        try:
+            self.requests.acquire()
+            self.tokens.acquire(cost)
+        except BaseException:
+            # * Otherwise every failed admission (e.g. a Redis error) would shrink the key's concurrency for good
+            try:
+                self.concurrency.release(slot, None)
+            except Exception:
+                pass  # * A slot held in Redis is freed once its lease runs out
+            raise
+
+        with self._lock:
+            self.stats.admitted += 1
+            self.stats.total_wait += time.monotonic() - started
+
+        return Ticket(slot=slot, cost=cost)
+
+    def release(
+        self,
+        ticket: Ticket,
+        used: int | None = None,
+        throttled: bool = False,
+        failed: bool = False,
+        retry_after: float | None = None,
+    ):
+        """
+        The function `release` finishes a request, adapting the concurrency of the key to how it went.
+
+        Args:
+          ticket (Ticket): The ticket the request was admitted with.
+          used (int | None): The tokens the request really used, if known, to correct the estimate with.
+          throttled (bool): Whether the request was rate limited (a 429).
+          failed (bool): Whether the request failed for any other reason, which leaves the limit unchanged.
+          retry_after (float | None): Seconds the API asked to wait before the next request, after a 429.
+        """
+        latency = time.monotonic() - ticket.admitted
+        slow = latency > OpenAILimits.LATENCY_TARGET * max(1, ticket.cost / 1000)
+
+        if used is not None:
+            self.tokens.adjust(used - ticket.cost)
+
+        if throttled and retry_after:
+            # * Every process using the key holds off, not just the one that was throttled
+            self.requests.pause(retry_after)
+
+        congested = None if failed and not throttled else throttled or slow
+        limit = self.concurrency.release(ticket.slot, congested)
+
+        with self._lock:
+            self.stats.throttled += throttled
+            self.stats.slow += slow and not failed
+            self.stats.limit = limit
+
+
+_schedulers: dict[str, KeyScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(api_key: str) -> KeyScheduler:
+    """Return the scheduler of an API key, creating it on first use."""
+    key = hash_key(api_key)
+
+    with _schedulers_lock:
+        if key not in _schedulers:
+            _schedulers[key] = KeyScheduler(key)
+
+        return _schedulers[key]
+
+
+def scheduler_stats() -> dict[str, dict]:
+    """Return the statistics of every scheduler in this process, keyed by hashed API key."""
+    with _schedulers_lock:
+        return {key: asdict(scheduler.stats) for key, scheduler in _schedulers.items()}
+
+
+def _retry_after(ex: Exception) -> float | None:
+    try:
+        return float((getattr(ex, "headers", None) or {}).get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _streamed_length(chunk) -> int:
+    """The number of characters of content in a chunk of a streamed response."""
+    choices = chunk.get("choices") or [{}]
+    return len(choices[0].get("delta", {}).get("content") or "")
+
+
+def _tool_calls(response) -> int:
+    """The number of functions (tools) the model asked to call in a response."""
+    message = (response.get("choices") or [{}])[0].get("message", {})
+    return len(message.get("tool_calls") or []) or int(bool(message.get("function_call")))
+
+
+class ScheduledChatCompletion:
+    """Stands in for `openai.ChatCompletion`, admitting every request through the scheduler of its API key.
+
+    A 429 is raised once it has been recorded, so the retries of the chat model using this client wait to be
+    admitted again like any other request.
+    """
+
+    def __init__(self, stage: str | None = None) -> None:
+        self._stage = stage  # * Attributes usage to this stage, over the stage of the current usage scope
+
+    def _admit(self, kwargs: dict) -> tuple[KeyScheduler, int]:
+        import openai
+
+        scheduler = get_scheduler(kwargs.get("api_key") or openai.api_key or "")
+        cost = estimate_tokens(
+            kwargs.get("messages", []), kwargs.get("functions"), kwargs.get("max_tokens")
+        )
+        return scheduler, cost
+
+    def _observe(
+        self,
+        kwargs: dict,
+        start: float,
+        outcome: str,
+        usage: dict | None = None,
+        tool_calls: int = 0,
+    ):
+        """Record a finished request in the metrics and, if it succeeded, in the usage ledger."""
+        model = kwargs.get("model") or kwargs.get("engine") or "unknown"
+        latency = time.monotonic() - start
+        usage = usage or {}
+        LLM_REQUEST_SECONDS.labels(model, outcome).observe(latency)
+
+        for kind in ("prompt", "completion"):
+            if usage.get(f"{kind}_tokens"):
+                LLM_TOKENS.labels(model, kind).inc(usage[f"{kind}_tokens"])
+
+        if outcome == "ok":
+            scope = current_scope()
+            if self._stage:
+                scope["stage"] = self._stage
+
+            usage_ledger.safe_record(
+                LLMCall(
+                    model=model,
+                    prompt_tokens=usage.get("prompt_tokens", 0),
+                    completion_tokens=usage.get("completion_tokens", 0),
+                    latency=latency,
+                    tool_calls=tool_calls,
+                ),
+                scope,
+            )
+
+    def _failed(
+        self, scheduler: KeyScheduler, ticket: Ticket, ex: Exception, kwargs: dict, start: float
+    ):
+        import openai
+
+        throttled = isinstance(ex, openai.error.RateLimitError)
+        scheduler.release(
+            ticket, throttled=throttled, failed=not throttled, retry_after=_retry_after(ex)
+        )
+        self._observe(kwargs, start, "throttled" if throttled else "error")
+
+    def _succeeded(self, scheduler: KeyScheduler, ticket: Ticket, response, kwargs: dict, start: float):
+        usage = response.get("usage", {})
+        scheduler.release(ticket, used=usage.get("total_tokens"))
+        self._observe(kwargs, start, "ok", usage, _tool_calls(response))
+
+    def create(self, **kwargs):
+        import openai
+
+        scheduler, cost = self._admit(kwargs)
+        ticket = scheduler.acquire(cost)
+        start = time.monotonic()
+
+        try:
+            response = openai.ChatCompletion.create(**kwargs)
+        except Exception as ex:
+            self._failed(scheduler, ticket, ex, kwargs, start)
+            raise
+
+        if kwargs.get("stream"):
+            return self._stream(response, scheduler, ticket, kwargs, start)
+
+        self._succeeded(scheduler, ticket, response, kwargs, start)
+        return response
+
+    async def acreate(self, **kwargs):
+        import openai
+
+        scheduler, cost = self._admit(kwargs)
+        # * Waiting to be admitted blocks, so it mustn't hold up the event loop
+        ticket = await asyncio.get_running_loop().run_in_executor(
+            None, scheduler.acquire, cost
+        )
+        start = time.monotonic()
+
+        try:
+            response = await openai.ChatCompletion.acreate(**kwargs)
+        except Exception as ex:
+            self._failed(scheduler, ticket, ex, kwargs, start)
+            raise
+
+        if kwargs.get("stream"):
+            return self._astream(response, scheduler, ticket, kwargs, start)
+
+        self._succeeded(scheduler, ticket, response, kwargs, start)
+        return response
+
+    def _finish_stream(
+        self,
+        scheduler: KeyScheduler,
+        ticket: Ticket,
+        error: Exception | None,
+        kwargs: dict,
+        start: float,
+        streamed: int,
+    ):
+        if error is not None:
+            self._failed(scheduler, ticket, error, kwargs, start)
+            return
+
+        scheduler.release(ticket)
+        # * Streamed responses carry no usage, so their tokens are estimated like those of a request
+        self._observe(
+            kwargs,
+            start,
+            "ok",
+            {
+                "prompt_tokens": len(json.dumps(kwargs.get("messages", []))) // CHARS_PER_TOKEN,
+                "completion_tokens": streamed // CHARS_PER_TOKEN,
+            },
+        )
+
+    def _stream(self, chunks, scheduler: KeyScheduler, ticket: Ticket, kwargs: dict, start: float):
+        # * A streamed request holds its slot until the response has been read, or the reader gives up
+        error = None
+        streamed = 0
+        try:
+            for chunk in chunks:
+                streamed += _streamed_length(chunk)
+                yield chunk
+        except Exception as ex:
+            error = ex
+            raise
+        finally:
+            self._finish_stream(scheduler, ticket, error, kwargs, start, streamed)
+
+    async def _astream(
+        self, chunks, scheduler: KeyScheduler, ticket: Ticket, kwargs: dict, start: float
+    ):
+        error = None
+        streamed = 0
+        try:
+            async for chunk in chunks:
+                streamed += _streamed_length(chunk)
+                yield chunk
+        except Exception as ex:
+            error = ex
+            raise
+        finally:
+            self._finish_stream(scheduler, ticket, error, kwargs, start, streamed)
+
+
+scheduled_completion = ScheduledChatCompletion()
+
+# Chat models by hashed API key, model and settings, as building one for every call adds up over a page
+_chat_models = ClientRegistry()
+
+
+def chat_model(
+    model: str,
+    temperature: float = 0,
+    api_key: str | None = None,
+    stage: str | None = None,
+    **kwargs,
+):
+    """
+    The function `chat_model` returns a langchain `ChatOpenAI` whose requests are admitted by the scheduler of
+    its API key, and recorded in the usage ledger. Chat models are kept and shared by every call with the same
+    settings, and send their requests over a pool of connections shared by the whole process.
+
+    Args:
+      model (str): The OpenAI model to use.
+      temperature (float): The sampling temperature. Defaults to 0
+      api_key (str | None): The OpenAI API key, or None to use the `OPENAI_API_KEY` environment variable.
+      stage (str | None): The stage to record the model's usage under, or None to use the current usage scope.
+      **kwargs: Any other `ChatOpenAI` fields.
+
+    Returns:
+      the chat model.
+    """
+    import openai
+    from langchain.chat_models import ChatOpenAI
+
+    openai.requestssession = openai_session
+
+    key = (
+        hash_key(api_key or ""),
+        model,
+        temperature,
+        stage,
+        json.dumps(kwargs, sort_keys=True, default=repr),
+    )
+    if api_key is not None:
+        kwargs["api_key"] = api_key
+
+    return _chat_models.get(
+        key,
+        lambda: ChatOpenAI(
+            model=model,
+            temperature=temperature,
+            client=scheduled_completion if stage is None else ScheduledChatCompletion(stage),
+            max_retries=OpenAILimits.MAX_RETRIES,
+            **kwargs,
+        ),
+    )
@@ -0,0 +1,235 @@
+"""
+Web searches for the writers, shared by every heading being written.
+
+Queries are normalised, so near identical queries (e.g. differing in case or punctuation) are one query. A query
+being searched for is only searched once, however many writers ask for it at the same time, and its result is
+cached for the job that asked for it and, for `SearchCache.TTL`, for every job. Searches can also be prefetched,
+for the likely queries of each heading, before the heading is written.
+"""
+import os
+import re
+import threading
+import unicodedata
+import hashlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from typing import Iterable
+
+from rich import print
+
+from config import SearchCache
+from config.redis import redis_client
+from metrics import SEARCHES
+from models import Section
+from .cache import BACKENDS, RedisBackend
+from .clients import ClientRegistry
+from .usage import current_scope, usage_scope
+
+# The most results whose snippets are returned for a single search
+MAX_RESULTS = 5
+
+_clients = ClientRegistry(close=lambda ddgs: ddgs.__exit__(None, None, None))
+
+if SearchCache.BACKEND == "redis":
+    _cache = RedisBackend("search")
+elif SearchCache.BACKEND in BACKENDS:
+    _cache = BACKENDS[SearchCache.BACKEND]()
+else:
+    _cache = None
+
+# Searches being made by this process, by query key
+_inflight: dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+_prefetcher: ThreadPoolExecutor | None = None
+_prefetcher_lock = threading.Lock()
+
+
+def _forget():
+    # * A forked process (e.g. a writer) has none of its parent's threads, so would wait on their searches forever
+    global _inflight, _inflight_lock, _prefetcher, _prefetcher_lock
+
+    _inflight = {}
+    _inflight_lock = threading.Lock()
+    _prefetcher = None
+    _prefetcher_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget)
+
+
+def normalise_query(query: str) -> str:
+    """The form of a query used to spot duplicates, ignoring case, punctuation, spacing and unicode variants."""
+    return " ".join(re.findall(r"[\w+#]+", unicodedata.normalize("NFKC", query).casefold()))
+
+
+def query_key(query: str) -> str:
+    return hashlib.sha256(normalise_query(query).encode()).hexdigest()
+
+
+def _job_key(task_id: str) -> str:
+    return f"search:job:{task_id}"
+
+
+def _cached(key: str, task_id: str | None) -> str | None:
+    """The cached result of a query, from the cache of the job first, then the cache of every job."""
+    if task_id and SearchCache.JOB_TTL:
+        if (result := redis_client.hget(_job_key(task_id), key)) is not None:
+            SEARCHES.labels("job_cache").inc()
+            return result
+
+    if _cache is not None and (result := _cache.get(f"result:{key}")) is not None:
+        SEARCHES.labels("cache").inc()
+        # * Keep it for the rest of the job, even if it expires for everyone else
+        _remember(key, task_id, result, shared=False)
+        return result
+
+    return None
+
+
+def _remember(key: str, task_id: str | None, result: str, shared: bool = True):
+    if task_id and SearchCache.JOB_TTL:
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset(_job_key(task_id), key, result)
+            pipe.expire(_job_key(task_id), SearchCache.JOB_TTL)
+            pipe.execute()
+
+    if shared and _cache is not None:
+        _cache.set(f"result:{key}", result, SearchCache.TTL)
+
+
+@contextmanager
+def _searching(key: str):
+    """Hold the lock on searching for a query across every process, for as long as the search may take."""
+    if SearchCache.DEDUPE != "redis":
+        yield
+        return
+
+    lock = redis_client.lock(
+        f"search:lock:{key}",
+        timeout=SearchCache.LOCK_TIMEOUT,
+        blocking_timeout=SearchCache.LOCK_TIMEOUT,
+    )
+    # * If the search holding the lock takes too long, search without waiting any longer
+    acquired = lock.acquire()
+    try:
+        yield
+    finally:
+        if acquired:
+            try:
+                lock.release()
+            except Exception:
+                pass  # * The lock expired during the search, and may belong to another process by now
+
+
+def _ddgs():
+    # * Imported here, so processes that never search don't pay for loading it
+    from duckduckgo_search import DDGS
+
+    return _clients.get("duckduckgo", DDGS)
+
+
+def _search(query: str) -> str:
+    results = _ddgs().text(query, region="wt-wt", safesearch="moderate", timelimit="y")
+    snippets = [result["body"] for result in islice(filter(None, results), MAX_RESULTS)]
+
+    return " ".join(snippets) or "No good DuckDuckGo Search Result was found"
+
+
+def _search_once(query: str, key: str, task_id: str | None) -> str:
+    with _searching(key):
+        # * Another process may have made the search while this one waited for it
+        if (result := _cached(key, task_id)) is not None:
+            return result
+
+        try:
+            result = _search(query)
+        except Exception:
+            SEARCHES.labels("failed").inc()
+            raise
+
+        SEARCHES.labels("searched").inc()
+        _remember(key, task_id, result)
+        return result
+
+
+def search(query: str) -> str:
+    """
+    The function `search` searches DuckDuckGo, through a client (and its connections) shared by every search in
+    the process. A query is only searched for once at a time, and its result is cached, see the module.
+
+    Used by the writers as a tool, in place of langchain's `DuckDuckGoSearchAPIWrapper`.
+
+    Args:
+      query (str): The query to search for.
+
+    Returns:
+      the snippets of the top results, joined into one string.
+    """
+    key = query_key(query)
+    task_id = current_scope().get("task_id")
+
+    if (result := _cached(key, task_id)) is not None:
+        return result
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        searching = future is None
+        if searching:
+            future = _inflight[key] = Future()
+
+    if not searching:
+        SEARCHES.labels("shared").inc()
+        result = future.result()
+        _remember(key, task_id, result, shared=False)
+        return result
+
+    try:
+        result = _search_once(query, key, task_id)
+        future.set_result(result)
+        return result
+    except Exception as ex:
+        future.set_exception(ex)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+
+def likely_queries(title: str, section: Section) -> list[str]:
+    """The queries the writers of a section are likely to search for, one for each heading still to be written."""
+    return [
+        f"{title} {heading.title}"
+        for heading in section.get_writable_headings()
+        if not heading.has_content()
+    ]
+
+
+def _prefetch(query: str, scope: dict):
+    with usage_scope(**scope):
+        try:
+            search(query)
+        except Exception as ex:
+            print(f"[yellow]Could not prefetch search '{query}': {ex}[/yellow]")
+
+
+def prefetch(queries: Iterable[str]):
+    """
+    The function `prefetch` searches for each query in the background, for the current job, so the writers
+    find them cached (or already being searched for).
+
+    Args:
+      queries (Iterable[str]): The queries to search for, see `likely_queries`.
+    """
+    global _prefetcher
+
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = ThreadPoolExecutor(
+                SearchCache.PREFETCH_WORKERS, thread_name_prefix="search-prefetch"
+            )
+
+    scope = current_scope()
+    for query in queries:
+        _prefetcher.submit(_prefetch, query, scope)
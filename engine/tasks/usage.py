@@ -0,0 +1,227 @@
+"""
+Records every LLM call against the job (and heading) it was made for, so the cost of a page can be broken down by
+model, by stage and by heading.
+
+Calls are attributed through a usage scope, set with `usage_scope` around the work of a job. The scope is kept in a
+context variable, so it follows the work into coroutines, but has to be passed on explicitly to other threads and
+processes (see `current_scope`).
+"""
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from redis import StrictRedis
+from rich import print
+
+from config import LLMUsage
+from config.redis import redis_client
+
+# The fields of each call kept in a job's list of calls, followed by its cost in millionths of a dollar
+CALL_FIELDS = (
+    "at",
+    "stage",
+    "heading",
+    "model",
+    "prompt_tokens",
+    "completion_tokens",
+    "latency_ms",
+    "tool_calls",
+)
+
+_scope: ContextVar[dict] = ContextVar("usage_scope", default={})
+
+
+@contextmanager
+def usage_scope(**fields):
+    """
+    The function `usage_scope` attributes the LLM calls made inside it, on top of any scope it is nested in.
+
+    Args:
+      **fields: Any of `task_id` (the job), `stage` (e.g. "categories" or "writing:single") and `heading`.
+    """
+    token = _scope.set({**_scope.get(), **fields})
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def current_scope() -> dict:
+    """The current usage scope, to be passed to `usage_scope` in another thread or process."""
+    return dict(_scope.get())
+
+
+@dataclass
+class LLMCall:
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    latency: float  # Seconds
+    tool_calls: int = 0
+
+    @property
+    def cost(self) -> float:
+        """The estimated cost of the call in US dollars, from `LLMUsage.PRICES`."""
+        prompt, completion = LLMUsage.PRICES.get(self.model, (0, 0))
+        return (self.prompt_tokens * prompt + self.completion_tokens * completion) / 1000
+
+    def totals(self) -> dict[str, int]:
+        """The amounts the call adds to each total. Cost is kept in millionths of a dollar, so it adds up exactly."""
+        return {
+            "calls": 1,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "tool_calls": self.tool_calls,
+            "latency_ms": round(self.latency * 1000),
+            "cost_micros": round(self.cost * 1_000_000),
+        }
+
+
+def _breakdowns(fields: dict[str, str]) -> dict:
+    """Turn the flat fields of a usage hash back into totals, and totals by model, stage and heading."""
+    usage = {"total": {}, "models": {}, "stages": {}, "headings": {}}
+
+    for field, value in fields.items():
+        group, _, rest = field.partition(":")
+        if group == "total":
+            totals = usage["total"]
+            name = rest
+        else:
+            key, _, name = rest.rpartition(":")
+            totals = usage[f"{group}s"].setdefault(key, {})
+
+        if name == "cost_micros":
+            totals["cost"] = int(value) / 1_000_000
+        else:
+            totals[name] = int(value)
+
+    return usage
+
+
+class UsageLedger:
+    """The ledger of LLM calls, kept in Redis.
+
+    The usage of a job is a hash at `usage:{id}` of totals, by model, by stage and by heading, with its most recent
+    calls listed at `usage:{id}:calls`. Totals across every job are kept at `usage:totals`, and jobs are ranked by
+    cost at `usage:jobs`.
+    """
+
+    def __init__(self, client: StrictRedis = redis_client) -> None:
+        self._client = client
+
+    def _key(self, task_id: str) -> str:
+        return f"usage:{task_id}"
+
+    def record(self, call: LLMCall, scope: dict | None = None):
+        """
+        The function `record` adds a call to the totals of its job, and to the totals across every job, in a
+        single round trip. Calls made outside of a job are not recorded.
+
+        Args:
+          call (LLMCall): The call that was made.
+          scope (dict | None): The scope the call was made in. Defaults to the current scope.
+        """
+        scope = current_scope() if scope is None else scope
+        if not (task_id := scope.get("task_id")):
+            return
+
+        key = self._key(task_id)
+        totals = call.totals()
+        groups = ["total", f"model:{call.model}"]
+        if scope.get("stage"):
+            groups.append(f"stage:{scope['stage']}")
+
+        with self._client.pipeline(transaction=False) as pipe:
+            for group in groups:
+                for name, value in totals.items():
+                    pipe.hincrby("usage:totals", f"{group}:{name}", value)
+
+            if scope.get("heading"):
+                groups.append(f"heading:{scope['heading']}")
+
+            for group in groups:
+                for name, value in totals.items():
+                    pipe.hincrby(key, f"{group}:{name}", value)
+
+            # * Calls are kept as compact arrays, newest last
+            pipe.rpush(
+                f"{key}:calls",
+                json.dumps(
+                    [
+                        round(time.time(), 3),
+                        scope.get("stage"),
+                        scope.get("heading"),
+                        call.model,
+                        call.prompt_tokens,
+                        call.completion_tokens,
+                        totals["latency_ms"],
+                        call.tool_calls,
+                        totals["cost_micros"],
+                    ],
+                    separators=(",", ":"),
+                ),
+            )
+            pipe.ltrim(f"{key}:calls", -LLMUsage.MAX_CALLS, -1)
+            pipe.zincrby("usage:jobs", totals["cost_micros"], task_id)
+            pipe.zremrangebyrank("usage:jobs", 0, -LLMUsage.MAX_JOBS - 1)
+
+            for name in (key, f"{key}:calls"):
+                pipe.expire(name, LLMUsage.TTL)
+
+            pipe.execute()
+
+    def safe_record(self, call: LLMCall, scope: dict | None = None):
+        """Record a call, logging rather than raising any error, so a failed write never fails the call."""
+        try:
+            self.record(call, scope)
+        except Exception as ex:
+            print(f"[red]Could not record LLM usage: {ex}[/red]")
+
+    def get(self, task_id: str, calls: bool = False) -> dict | None:
+        """
+        The function `get` returns the usage of a job.
+
+        Args:
+          task_id (str): The ID of the job.
+          calls (bool): Whether to include the job's most recent calls.
+
+        Returns:
+          the totals of the job, by model, by stage and by heading, or None if it has made no calls.
+        """
+        fields = self._client.hgetall(self._key(task_id))
+        if not fields:
+            return None
+
+        usage = _breakdowns(fields)
+
+        if calls:
+            records = self._client.lrange(f"{self._key(task_id)}:calls", 0, -1)
+            usage["calls"] = [
+                {**dict(zip(CALL_FIELDS, record)), "cost": record[-1] / 1_000_000}
+                for record in map(json.loads, records)
+            ]
+
+        return usage
+
+    def summary(self, limit: int = 10) -> dict:
+        """
+        The function `summary` returns the usage across every job.
+
+        Args:
+          limit (int): The number of most expensive jobs to list.
+
+        Returns:
+          the totals across every job, by model and by stage, and the most expensive jobs with their cost.
+        """
+        usage = _breakdowns(self._client.hgetall("usage:totals"))
+        del usage["headings"]
+
+        jobs = self._client.zrevrange("usage:jobs", 0, limit - 1, withscores=True)
+        usage["jobs"] = [{"id": task_id, "cost": cost / 1_000_000} for task_id, cost in jobs]
+
+        return usage
+
+
+usage_ledger = UsageLedger()
@@ -1,14 +1,34 @@
+from enum import Enum
+from importlib import import_module
+from typing import Callable
+
 from models import Heading, Section, ModelConfig
+from tasks.usage import usage_scope
+
 
-from .agents import double_agent
-from .pae import plan_and_execute
-from .single import single_prompt
+class WritingMethod(Enum):
+    """The ways a heading can be written.
+
+    Each method lives in its own module, which is only imported the first time the method is used, so a process
+    never pays for the dependencies (langchain, autogen, ...) of methods it doesn't use. Members are called like the
+    functions they refer to, and pickle by name, so they can be passed to the writer pool.
+    """
 
+    DOUBLE_AGENT = "agents:double_agent"
+    SINGLE = "single:single_prompt"
+    PAE = "pae:plan_and_execute"
 
-class WritingMethod:
-    DOUBLE_AGENT = double_agent
-    SINGLE = single_prompt
-    PAE = plan_and_execute
+    @classmethod
+    def named(cls, name: str) -> "WritingMethod":
+        """The method with the given name, in any case, e.g. "double_agent"."""
+        return cls[name.upper()]
+
+    def load(self) -> Callable:
+        module, function = self.value.split(":")
+        return getattr(import_module(f"{__name__}.{module}"), function)
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
 
 
 # @monitor("[bold green]Writing section...")
@@ -50,23 +70,30 @@ def write_section(
     )
 
 
-def write_section_mp(args: tuple[str, Heading, str, WritingMethod, ModelConfig]):
+def write_section_mp(args: tuple[str, Heading, str, WritingMethod, ModelConfig, dict]):
     """
     The function `write_section_mp` takes in a tuple of arguments and uses them to call a specified
     writing method with the given section, heading, title, and model configuration.
 
     Args:
-      args (tuple[str, Heading, str, WritingMethod, ModelConfig]): A tuple containing the following
-    elements: `section, heading, title, method, model_config`
+      args (tuple[str, Heading, str, WritingMethod, ModelConfig, dict]): A tuple containing the following
+    elements: `section, heading, title, method, model_config, scope`, where `scope` is the usage scope of
+    the job (see `tasks.usage`), which the heading's LLM calls are recorded under.
 
     Returns:
       The function `write_section_mp` returns the result of calling the `method` function with the
     provided arguments.
     """
-    section, heading, title, method, model_config = args
-    return method(
-        section=section,
-        heading=heading,
-        title=title,
-        model_config=model_config,
-    )
+    section, heading, title, method, model_config, scope = args
+
+    with usage_scope(
+        **scope,
+        stage=f"writing:{method.name.lower()}",
+        heading=f"{heading.index} {heading.title}",
+    ):
+        return method(
+            section=section,
+            heading=heading,
+            title=title,
+            model_config=model_config,
+        )
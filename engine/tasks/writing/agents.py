@@ -1,26 +1,89 @@
 import autogen
+from langchain.adapters.openai import convert_dict_to_message
+from langchain.schema.messages import SystemMessage
 
-from models import Heading, Section
-from config import AutoGen, GPT35, GPT4, EnabledModels
+from config import WritingLimits
+from models import Heading, ModelConfig
+from tasks.scheduler import chat_model
+from .budget import BudgetExceeded, HeadingBudget, converged
 
-llm_config = (
-    {"config_list": AutoGen.CONFIG_LIST_GPT3, "seed": 42, "model": GPT35}
-    if EnabledModels.WRITING == GPT35
-    else {"config_list": AutoGen.CONFIG_LIST_GPT4, "seed": 42, "model": GPT4}
-)
+TERMINATE = "TERMINATE"
 
 
-def double_agent(section: Section, heading: Heading, title: str):
+def double_agent(section: str, heading: Heading, title: str, model_config: ModelConfig):
+    """
+    The function `double_agent` writes a heading with a Researcher, whose drafts are critiqued by a Quality
+    Assurer until it is happy with one.
+
+    The critique stops after `WritingLimits.MAX_ROUNDS` drafts, once the heading's token or time budget is
+    spent, or early once the drafts (or critiques) stop changing much between rounds. Every request goes through
+    the scheduler of the job's API key, like those of `single_prompt`.
+
+    Args:
+      section (str): The outline of the heading's section, as context.
+      heading (Heading): The heading to write.
+      title (str): The title of the page.
+      model_config (ModelConfig): The models, and API key, to write with.
+
+    Returns:
+      the latest draft.
+    """
+    llm = chat_model(model=model_config.writing, temperature=0, api_key=model_config.oai_key)
+    budget = HeadingBudget()
+    drafts: list[str] = []
+    critiques: list[str] = []
+
+    def ask(system_message: str, messages: list[dict]) -> str:
+        response = llm.generate(
+            [[SystemMessage(content=system_message), *map(convert_dict_to_message, messages)]],
+            callbacks=[budget],
+        )
+        return response.generations[0][0].text
+
+    def research(recipient, messages=None, sender=None, config=None):
+        # * Registered replies come before autogen's own termination check, so stop at a TERMINATE here
+        if TERMINATE in (messages[-1].get("content") or ""):
+            return True, None
+
+        try:
+            drafts.append(ask(recipient.system_message, messages))
+        except BudgetExceeded:
+            if not drafts:
+                raise
+            drafts.append(drafts[-1])  # * Nothing more is spent, the critique stops at the unchanged draft
+
+        return True, drafts[-1]
+
+    def critique(recipient, messages=None, sender=None, config=None):
+        if len(drafts) >= WritingLimits.MAX_ROUNDS or budget.exhausted() or converged(drafts):
+            return True, TERMINATE
+
+        try:
+            critiques.append(ask(recipient.system_message, messages))
+        except BudgetExceeded:
+            return True, TERMINATE
+
+        if TERMINATE in critiques[-1] or converged(critiques):
+            return True, TERMINATE
+
+        return True, critiques[-1]
+
     researcher = autogen.AssistantAgent(
         name="Researcher",
         system_message="Research Assistant. Your only goal is to provide high quality, detailed information on the topic given to you structured in markdown. If you are given improvements, you must use those comments to improve your previous response, do not write a new answer, it must be the previous answer incorporating the changes. You must ensure that you understand the topic and create a detailed and informative set of research on the topic. You should always reply with long, detailed research. Your research should always be structured using markdown. If you are prompted with improvements, use those improvements to improve your last set of research. Do not include the title you are writing for anywhere in your response. Do not engage in any conversation in anyt circumstance.",
-        llm_config=llm_config,
+        llm_config=False,
+        is_termination_msg=lambda message: TERMINATE in (message.get("content") or ""),
+        max_consecutive_auto_reply=WritingLimits.MAX_ROUNDS,
     )
     qa = autogen.AssistantAgent(
         name="Quality_Assurer",
         system_message="Quality Assurer. You are a quality assurer and should critique, comment and suggest tweaks to a given set of information and return the comments to the Researcher. You should always try to find improvements in a message. You will recieve information from a research agent, and it is your job to ensure that research is up to a high standard. You should help the researcher make more enformed writing choices in your comments. You should advise the researcher on different topics to go into depth into, add examples, and anything else that could improve the quality, accuracy and depth of a given block of information. You should not write or edit the information yourself, only provide high quality and accurate comments. If the message meets the given requirements, do not add any comments or anything else to your response, only reply with ONLY the word: 'TERMINATE' in all capital letters. Do not engage in any conversation in any circumstance. If you have no comments, reply with 'TERMINATE' in all capitals.",
-        llm_config=llm_config,
+        llm_config=False,
+        max_consecutive_auto_reply=WritingLimits.MAX_ROUNDS,
     )
+    # * Replies are written by the job's chat model, rather than autogen's own OpenAI client
+    researcher.register_reply(autogen.Agent, research)
+    qa.register_reply(autogen.Agent, critique)
 
     message = """
     Write an informational knowledge piece on the topic {objective}. You are writing for a larger knowledgebase with the title: '{title}'.
@@ -31,13 +94,14 @@ def double_agent(section: Section, heading: Heading, title: str):
     Only write about section {objective}, you can refer to other sections, but they are only for context, all information you write should align with the {objective}
     """.format(
         title=title,
-        section=section.format(),
+        section=section,
         objective=f"'{heading.index}: {heading.title}'",
     )
 
     qa.initiate_chat(
         researcher,
         message=message,
+        silent=True,
     )
 
-    return qa.chat_messages[researcher][-2]["content"]
+    return drafts[-1]
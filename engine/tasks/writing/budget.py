@@ -0,0 +1,56 @@
+import time
+from difflib import SequenceMatcher
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+from config import WritingLimits
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class HeadingBudget(BaseCallbackHandler):
+    """The tokens and time a writing method may spend on a single heading.
+
+    Passed as a callback to the chat models (and agents) writing the heading, it counts the tokens of every
+    response, and raises `BudgetExceeded` before the next request (or tool call) once either is spent.
+    """
+
+    raise_error = True  # * Otherwise langchain logs errors raised by callbacks and carries on
+
+    def __init__(
+        self,
+        max_tokens: int = WritingLimits.MAX_TOKENS,
+        max_seconds: float = WritingLimits.MAX_SECONDS,
+    ) -> None:
+        self.tokens = 0
+        self._max_tokens = max_tokens
+        self._deadline = time.monotonic() + max_seconds
+
+    def exhausted(self) -> bool:
+        return self.tokens >= self._max_tokens or time.monotonic() >= self._deadline
+
+    def check(self):
+        if self.tokens >= self._max_tokens:
+            raise BudgetExceeded(f"Spent {self.tokens} of {self._max_tokens} tokens")
+        if time.monotonic() >= self._deadline:
+            raise BudgetExceeded("Ran out of time")
+
+    def on_llm_start(self, *args, **kwargs):
+        self.check()
+
+    def on_chat_model_start(self, *args, **kwargs):
+        self.check()
+
+    def on_tool_start(self, *args, **kwargs):
+        self.check()
+
+    def on_llm_end(self, response, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        self.tokens += usage.get("total_tokens", 0)
+
+
+def converged(texts: list[str], threshold: float = WritingLimits.CONVERGENCE) -> bool:
+    """Whether the last two texts (e.g. drafts, or critiques) are alike enough that another round won't help."""
+    return len(texts) >= 2 and SequenceMatcher(None, texts[-2], texts[-1]).ratio() >= threshold
@@ -1,33 +1,72 @@
 from langchain.agents.tools import Tool
-from langchain.chat_models import ChatOpenAI
-from langchain.utilities import DuckDuckGoSearchAPIWrapper
 from langchain_experimental.plan_and_execute import (
     PlanAndExecute,
     load_agent_executor,
     load_chat_planner,
 )
+from langchain_experimental.plan_and_execute.planners.base import BasePlanner
+from langchain_experimental.plan_and_execute.schema import Plan
 from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
 from langchain.schema.messages import SystemMessage
 
-from config.models import EnabledModels
+from config import WritingLimits
+from models import Heading, ModelConfig
+from tasks.scheduler import chat_model
+from tasks.search import search
+from .budget import BudgetExceeded, HeadingBudget
 
-from models import Heading, Section
 
+class BoundedPlanner(BasePlanner):
+    """Cuts the plans of another planner down to `max_steps` steps, keeping the last, which writes the response."""
 
-def plan_and_execute(section: Section, heading: Heading, title: str):
-    search = DuckDuckGoSearchAPIWrapper()
+    planner: BasePlanner
+    max_steps: int
+
+    def _bound(self, plan: Plan) -> Plan:
+        if len(plan.steps) <= self.max_steps:
+            return plan
+
+        return Plan(steps=plan.steps[: self.max_steps - 1] + plan.steps[-1:])
+
+    def plan(self, inputs: dict, callbacks=None, **kwargs) -> Plan:
+        return self._bound(self.planner.plan(inputs, callbacks=callbacks, **kwargs))
+
+    async def aplan(self, inputs: dict, callbacks=None, **kwargs) -> Plan:
+        return self._bound(await self.planner.aplan(inputs, callbacks=callbacks, **kwargs))
+
+
+def plan_and_execute(section: str, heading: Heading, title: str, model_config: ModelConfig):
+    """
+    The function `plan_and_execute` writes a heading by planning the research it needs, and carrying out each
+    step of the plan with a search tool.
+
+    Plans are cut down to `WritingLimits.MAX_STEPS` steps, each of which makes at most
+    `WritingLimits.MAX_TOOL_CALLS` tool calls. Once the heading's token or time budget is spent, the response
+    of the latest step is used.
+
+    Args:
+      section (str): The outline of the heading's section, as context.
+      heading (Heading): The heading to write.
+      title (str): The title of the page.
+      model_config (ModelConfig): The models, and API key, to write with.
+
+    Returns:
+      the response of the plan's last step.
+    """
     tools = [
         Tool(
             name="Search",
-            func=search.run,
+            func=search,
             description="useful for when you need to answer questions about current events. Ask targeted questions.",
         ),
     ]
 
-    llm = ChatOpenAI(temperature=0, model=EnabledModels.WRITING)
+    llm = chat_model(temperature=0, model=model_config.writing, api_key=model_config.oai_key)
 
-    planner = load_chat_planner(llm)
-    executor = load_agent_executor(llm, tools, verbose=True)
+    planner = BoundedPlanner(planner=load_chat_planner(llm), max_steps=WritingLimits.MAX_STEPS)
+    executor = load_agent_executor(llm, tools)
+    executor.chain.max_iterations = WritingLimits.MAX_TOOL_CALLS
+    executor.chain.max_execution_time = WritingLimits.MAX_SECONDS
     agent = PlanAndExecute(planner=planner, executor=executor)
 
     chat_template = ChatPromptTemplate.from_messages(
@@ -50,8 +89,15 @@ def plan_and_execute(section: Section, heading: Heading, title: str):
     Only write about section {objective}, you can refer to other sections, but they are only for context, all information you write should align with the {objective}
     """.format(
         title=title,
-        section=section.format(),
+        section=section,
         objective=f"'{heading.index}: {heading.title}'",
     )
 
-    return agent.run(chat_template.format_messages(text=message))
+    budget = HeadingBudget()
+
+    try:
+        return agent.run(chat_template.format_messages(text=message), callbacks=[budget])
+    except BudgetExceeded:
+        if not agent.step_container.steps:
+            raise
+        return agent.step_container.get_final_response()
@@ -1,6 +1,4 @@
 from langchain.agents.tools import Tool
-from langchain.chat_models import ChatOpenAI
-from langchain.utilities import DuckDuckGoSearchAPIWrapper
 from langchain.tools.render import format_tool_to_openai_function
 from langchain.agents.format_scratchpad import format_to_openai_function_messages
 from langchain.agents.output_parsers import OpenAIFunctionsAgentOutputParser
@@ -8,21 +6,22 @@ from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.agents import AgentExecutor
 
 from models import Heading, ModelConfig
+from tasks.scheduler import chat_model
+from tasks.search import search
 
 
 def single_prompt(
     section: str, heading: Heading, title: str, model_config: ModelConfig
 ):
-    search = DuckDuckGoSearchAPIWrapper()
     tools = [
         Tool(
             name="Search",
-            func=search.run,
+            func=search,
             description="useful for searching for accurate information. Ask targeted questions.",
         ),
     ]
 
-    llm = ChatOpenAI(
+    llm = chat_model(
         model=model_config.writing, temperature=0, api_key=model_config.oai_key
     )
     llm_with_tools = llm.bind(
@@ -0,0 +1,130 @@
+import random
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from rich import print
+
+from config import Queue, Metrics
+from jobs import Job, JobQueue
+from metrics import start_exporter
+from pipelines import (
+    CompletePipeline,
+    RegeneratePipeline,
+    StatusEventHandler,
+    init_writer_pool,
+    shutdown_writer_pool,
+)
+
+queue = JobQueue()
+stopping = threading.Event()
+
+
+def heartbeat(task_id: str, done: threading.Event):
+    """Keep the lease of a running job alive until it is done."""
+    while not done.wait(Queue.VISIBILITY_TIMEOUT / 3):
+        if not queue.extend(task_id):
+            print(f"[yellow]Lost the lease on job {task_id}[/yellow]")
+            return
+
+
+def run_job(job: Job):
+    """
+    The function `run_job` runs a single claimed job through the `CompletePipeline` (or the
+    `RegeneratePipeline`, for a job regenerating headings of another job's page), keeping its lease alive
+    while it runs and acknowledging it afterwards.
+
+    A job that fails inside the pipeline is acknowledged too, as the pipeline has already marked the page
+    as failed. Only jobs whose worker dies are re-delivered.
+
+    Args:
+      job (Job): The claimed job.
+    """
+    print(f"Running job {job.task_id} (attempt {job.attempts}): '{job.title}'")
+
+    done = threading.Event()
+    threading.Thread(target=heartbeat, args=(job.task_id, done), daemon=True).start()
+
+    handler = StatusEventHandler(job.task_id)
+
+    try:
+        if job.regenerate:
+            RegeneratePipeline(
+                notion_secret=job.notion_secret,
+                model_config=job.model_config,
+                source_id=job.source_id,
+                event_handler=handler,
+                task_id=job.task_id,
+            ).run(job.regenerate)
+        else:
+            pipeline = CompletePipeline(
+                job.page_url,
+                notion_secret=job.notion_secret,
+                model_config=job.model_config,
+                event_handler=handler,
+                categories=job.categories,
+                task_id=job.task_id,
+            )
+            pipeline.run(job.title)
+    except Exception as ex:
+        print(f"[red]Job {job.task_id} failed: {ex}[/red]")
+    finally:
+        handler.close()
+        done.set()
+        queue.ack(job.task_id)
+
+
+def error_backoff(errors: int) -> float:
+    """The jittered delay before a worker tries again, after `errors` errors in a row."""
+    return min(Queue.ERROR_BACKOFF_MAX, Queue.POLL_INTERVAL * 2 ** (errors - 1)) * random.uniform(0.5, 1)
+
+
+def work():
+    """Claim and run jobs until the worker is asked to stop.
+
+    Errors outside of a job's pipeline (e.g. Redis being unreachable while claiming or acknowledging a job) are
+    logged and retried after a growing delay, rather than stopping the worker.
+    """
+    errors = 0
+
+    while not stopping.is_set():
+        try:
+            queue.reap()
+            job = queue.claim()
+            if job is not None:
+                run_job(job)
+        except Exception as ex:
+            errors += 1
+            delay = error_backoff(errors)
+            print(f"[red]Worker error ({type(ex).__name__}: {ex}), retrying in {delay:.1f}s[/red]")
+            stopping.wait(delay)
+            continue
+
+        errors = 0
+        if job is None:
+            stopping.wait(Queue.POLL_INTERVAL)
+
+
+def main():
+    def stop(*_):
+        print("[bold grey]Stopping after the current jobs...[/bold grey]")
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    if Metrics.WORKER_PORT:
+        start_exporter(Metrics.WORKER_PORT)
+
+    init_writer_pool()
+    print(f"Worker started, running up to {Queue.WORKER_JOBS} jobs at once")
+
+    with ThreadPoolExecutor(Queue.WORKER_JOBS) as executor:
+        for _ in range(Queue.WORKER_JOBS):
+            executor.submit(work)
+
+    shutdown_writer_pool()
+
+
+if __name__ == "__main__":
+    main()
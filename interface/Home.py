@@ -21,6 +21,13 @@ def generate_page(title: str, notion_url: str, notion_api_key: str, openai_api_k
     else:
         st.error(f"Could not add **{title}** to generation queue. {response.text}")
 
+def delete_generation(task_id: str):
+    pipe = redis_client.pipeline()
+    pipe.delete(f"generation:{task_id}")
+    for index in ["generation:index", *[f"generation:index:{state}" for state in ("waiting", "running", "completed", "failed")]]:
+        pipe.zrem(index, task_id)
+    pipe.execute()
+
 st.markdown("# 🪄 WikiWizard")
 
 st.markdown("Enter a topic to generate a wiki for.")
@@ -48,8 +55,18 @@ with col2:
 with st.container(border=True):
     st.markdown("## Generations")
     
-    for key in redis_client.keys(pattern="generation:*"):
+    # Newest first, from the job index the engine keeps, rather than scanning every key
+    task_ids = redis_client.zrevrange("generation:index", 0, 49)
+
+    pipe = redis_client.pipeline(transaction=False)
+    for task_id in task_ids:
+        pipe.hgetall(f"generation:{task_id}")
+
+    for task_id, job in zip(task_ids, pipe.execute()):
+        if not job:
+            continue
+
         with st.container(border=True):
-            st.markdown(f"**{redis_client.hget(key, 'title')}**")
-            st.markdown(redis_client.hget(key, "status"))
-            st.button("🗑️", on_click=redis_client.delete, args=(key,), key=f"delete_{key}_button")
+            st.markdown(f"**{job.get('title')}**")
+            st.markdown(job.get("status"))
+            st.button("🗑️", on_click=delete_generation, args=(task_id,), key=f"delete_{task_id}_button")